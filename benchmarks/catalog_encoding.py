@@ -0,0 +1,129 @@
+"""
+ Size and read cost of the shared catalog record with the plain episode list
+ against the packed one (CATALOG_ENCODING=zlib) and the chunked one
+ (CATALOG_ENCODING=chunked, see lambda/catalog_codec.py), for synthetic feeds
+ with anchor.fm style enclosure URLs and uuid guids.
+
+ For each size it reports the DynamoDB size of the catalog record (computed with
+ DynamoDB's sizing rules, not from the JSON the local stand-in stores), the read
+ units of the consistent GetItems a cold container needs to serve the newest
+ episode, the time that takes, and the time to decode every episode. The stand-in table
+ returns plain records through json.loads, which is much faster than boto3's
+ deserialization of a list of maps, so the cold load times favour the plain
+ format; read units and item size are what DynamoDB would charge.
+
+ Usage: python benchmarks/catalog_encoding.py [--sizes 100,1000,5000] [--repeat 20]
+ """
+
+import argparse
+import math
+import os
+import sys
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from standins import LAMBDA_DIR, LocalDynamoDbResource, configure_environment
+
+FEED_URL = 'https://anchor.fm/s/172e72c0/podcast/rss'
+
+def build_episodes(size):
+    from utils import episode_token
+    episodes = []
+    for n in range(1, size + 1):
+        guid = str(uuid.UUID(int=n * 7919 + 12345))
+        url = ('https://anchor.fm/s/172e72c0/podcast/play/{}/https%3A%2F%2Fd3ctxlq1ktw2nl.cloudfront.net'
+               '%2Fstaging%2F2020-{}-{}%2F{}.m4a').format(1000000 + n * 37, n % 12 + 1, n % 28 + 1, guid)
+        episodes.append({'url': url, 'title': 'Episode {}: a conversation about things'.format(n),
+                         'token': episode_token(guid), 'guid': guid})
+    return episodes
+
+# DynamoDB item size: attribute names plus values, with 3 bytes of overhead per
+# map or list and 1 per element, numbers at about one byte per two digits.
+def attribute_size(value):
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, str):
+        return len(value.encode('utf-8'))
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, (int, float)):
+        return int(math.ceil(len(str(abs(value)).replace('.', '')) / 2.0)) + 1
+    if isinstance(value, dict):
+        return 3 + sum(len(key.encode('utf-8')) + attribute_size(item) + 1 for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return 3 + sum(attribute_size(item) + 1 for item in value)
+    raise TypeError(type(value).__name__)
+
+def item_size(key, attributes):
+    return len('id') + len(key) + len('attributes') + attribute_size(attributes)
+
+# Size of the catalog record and read units to serve the newest episode from a
+# cold container: the record plus, for a chunked catalog, the chunk holding it
+def record_cost(catalog_codec, persistence, record):
+    attributes, chunks = catalog_codec.encode_catalog(record)
+    size = item_size(persistence.catalog_key(FEED_URL), attributes)
+    read_units = int(math.ceil(size / 4096.0))
+    if chunks:
+        chunk_id = attributes['chunk_ids'][-1]
+        packed = dict(chunks)[chunk_id]
+        read_units += int(math.ceil(item_size(persistence.chunk_key(FEED_URL, chunk_id),
+                                              {'packed': packed}) / 4096.0))
+    return size, read_units
+
+def cold_load(store, repeat):
+    import catalog
+    timings = []
+    for _ in range(repeat):
+        catalog._catalog_cache.clear()
+        start = time.perf_counter()
+        entry = catalog.get_catalog(FEED_URL)
+        episode = entry['episodes'][len(entry['episodes']) - 1]
+        episode['url']
+        timings.append(time.perf_counter() - start)
+    return min(timings), entry
+
+def decode_all(store, repeat):
+    timings = []
+    for _ in range(repeat):
+        episodes = store.get_catalog(FEED_URL)['episodes']
+        start = time.perf_counter()
+        list(episodes)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='100,1000,5000')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    configure_environment()
+    os.chdir(LAMBDA_DIR)
+    import catalog
+    import catalog_codec
+    import persistence
+
+    print('{:>8} {:<8} {:>12} {:>10} {:>16} {:>16}'.format(
+        'episodes', 'format', 'record bytes', 'read units', 'cold load ms', 'decode all ms'))
+    for size in [int(size) for size in args.sizes.split(',')]:
+        episodes = build_episodes(size)
+        for encoding in ('none', 'zlib', 'chunked'):
+            catalog_codec.catalog_encoding = encoding
+            store = persistence.CatalogStore(table_name='benchmark', dynamodb_resource=LocalDynamoDbResource())
+            catalog.catalog_store = store
+            record = {'version': 1, 'episodes': episodes, 'etag': '"abc"', 'last_modified': None}
+            store.save_catalog(FEED_URL, record)
+
+            size_bytes, read_units = record_cost(catalog_codec, persistence, record)
+            load, entry = cold_load(store, args.repeat)
+            if [entry['episodes'][i] for i in (0, size - 1)] != [episodes[0], episodes[-1]]:
+                print('FAIL: the {} catalog did not read back the episodes it was written with'.format(encoding))
+                sys.exit(1)
+            print('{:>8} {:<8} {:>12} {:>10} {:>16.3f} {:>16.3f}{}'.format(
+                size, encoding, size_bytes, read_units, load * 1e3,
+                decode_all(store, args.repeat) * 1e3, '  over the 400KB item limit' if size_bytes > 400 * 1024 else ''))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+ Dispatch overhead per request type: the time the request mapper takes to pick a
+ handler, for the SDK's GenericRequestMapper (can_handle on every handler in
+ registration order) against RoutingRequestMapper in lambda/routing.py.
+
+ Every request is also checked to be routed to the same handler by both mappers,
+ including requests from a device without the AudioPlayer interface, which the
+ audio interface check has to keep catching first.
+
+ Usage: python benchmarks/dispatch.py [--calls 20000]
+ """
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from standins import (LocalDynamoDbResource, load_skill, envelope, intent_request, launch_request,
+                      audio_player_event)
+
+def requests_to_route():
+    requests = [('LaunchRequest', launch_request())]
+    for event in ('PlaybackStarted', 'PlaybackStopped', 'PlaybackNearlyFinished',
+                  'PlaybackFinished', 'PlaybackFailed'):
+        requests.append(('AudioPlayer.' + event, audio_player_event(event, 'token', 1000)))
+    for command in ('Play', 'Pause', 'Next', 'Previous'):
+        request_type = 'PlaybackController.{}CommandIssued'.format(command)
+        requests.append((request_type, {'type': request_type}))
+    for intent_name in ('PlayNewestEpisodeIntent', 'AMAZON.PauseIntent', 'AMAZON.ResumeIntent',
+                        'AMAZON.NextIntent', 'AMAZON.HelpIntent', 'AMAZON.StopIntent', 'AMAZON.FallbackIntent'):
+        requests.append((intent_name, intent_request(intent_name)))
+    requests.append(('System.ExceptionEncountered', {'type': 'System.ExceptionEncountered',
+                                                     'error': {'type': 'INVALID_RESPONSE', 'message': 'x'},
+                                                     'cause': {'requestId': 'x'}}))
+    requests.append(('SessionEndedRequest', {'type': 'SessionEndedRequest', 'reason': 'USER_INITIATED'}))
+    return requests
+
+def handler_input(request, audio_player=True):
+    from ask_sdk_core.handler_input import HandlerInput
+    from ask_sdk_core.serialize import DefaultSerializer
+    from ask_sdk_model import RequestEnvelope
+    request_envelope = DefaultSerializer().deserialize(json.dumps(envelope(request, audio_player=audio_player)),
+                                                       RequestEnvelope)
+    return HandlerInput(request_envelope=request_envelope)
+
+def time_mapper(mapper, item, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        mapper.get_request_handler_chain(item)
+    return (time.perf_counter() - start) / calls
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=20000)
+    args = parser.parse_args()
+
+    skill = load_skill(LocalDynamoDbResource(), 'http://127.0.0.1:9/unused')
+    from ask_sdk_runtime.dispatch_components.request_components import GenericRequestMapper
+    from routing import RoutingRequestMapper
+
+    chains = skill.sb.skill_configuration.request_mappers[0].request_handler_chains
+    linear = GenericRequestMapper(chains)
+    routed = RoutingRequestMapper(chains)
+
+    print('{:<58} {:>12} {:>12} {:>9}  {}'.format('request', 'linear (us)', 'routed (us)', 'speedup', 'handler'))
+    mismatches = 0
+    for audio_player in (True, False):
+        for name, request in requests_to_route():
+            item = handler_input(request, audio_player)
+            expected = linear.get_request_handler_chain(item)
+            actual = routed.get_request_handler_chain(item)
+            if expected is not actual:
+                mismatches += 1
+            before = time_mapper(linear, item, args.calls)
+            after = time_mapper(routed, item, args.calls)
+            label = name if audio_player else name + ' (no AudioPlayer)'
+            print('{:<58} {:>12.2f} {:>12.2f} {:>8.1f}x  {}'.format(
+                label, before * 1e6, after * 1e6, before / after,
+                type(actual.request_handler).__name__ if actual is not None else '-'))
+
+    if mismatches:
+        print('{} requests were routed to a different handler than the linear scan picks'.format(mismatches))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
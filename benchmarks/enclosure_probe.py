@@ -0,0 +1,105 @@
+"""
+ Probes the enclosures of a synthetic feed served by a local HTTP stand-in
+ (standins.EnclosureServer) with some enclosures behind redirects, some slow and
+ some broken, one at a time against PROBE_CONCURRENCY at a time
+ (lambda/enclosures.py), and reports the time each took and what was found.
+
+ It then checks what the skill does with the results: a PlayDirective for a
+ redirected episode streams from the redirect target, and PlaybackNearlyFinished
+ after the episode before a broken one enqueues the next playable episode.
+
+ Usage: python benchmarks/enclosure_probe.py [--episodes 40] [--latency-ms 20] [--concurrency 8]
+ """
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from standins import (LocalDynamoDbResource, FeedServer, EnclosureServer, build_feed, load_skill, envelope,
+                      intent_request, audio_player_event)
+
+# Enclosure path of episode n: every tenth is missing, every tenth from the fifth
+# is empty, every third redirects twice and every seventh is slow
+def enclosure_path(n):
+    if n % 10 == 0:
+        return '/missing/episode-{n}.mp3'
+    if n % 10 == 5:
+        return '/empty/episode-{n}.mp3'
+    if n % 3 == 0:
+        return '/redirect/2/episode-{n}.mp3'
+    if n % 7 == 0:
+        return '/slow/0.2/episode-{n}.mp3'
+    return '/audio/episode-{n}.mp3'
+
+def fail(message):
+    print('FAIL: ' + message)
+    sys.exit(1)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--episodes', type=int, default=40)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+
+    enclosures = EnclosureServer(latency=args.latency_ms / 1e3)
+    feed = FeedServer(build_feed(args.episodes,
+                                 enclosure_url=lambda n: enclosures.url + enclosure_path(n).format(n=n)))
+    resource = LocalDynamoDbResource()
+    skill = load_skill(resource, feed.url)
+    import catalog
+    import enclosures as probing
+    import persistence
+    # The broken enclosures are the point; their warnings are not
+    logging.getLogger('enclosures').setLevel(logging.ERROR)
+
+    entry = catalog.refresh_catalog(feed.url)
+    feed.close()
+    probing.probe_episodes = args.episodes
+
+    print('{:<12} {:>10} {:>8} {:>10} {:>10}'.format('concurrency', 'time ms', 'probed', 'broken', 'redirected'))
+    for concurrency in (1, args.concurrency):
+        probing.probe_concurrency = concurrency
+        resource.table.items.pop(persistence.probes_key(feed.url), None)
+        start = time.perf_counter()
+        results = probing.probe_feed(feed.url, entry)
+        elapsed = time.perf_counter() - start
+        print('{:<12} {:>10.1f} {:>8} {:>10} {:>10}'.format(
+            concurrency, elapsed * 1e3, len(results), sum(1 for result in results.values() if result['broken']),
+            sum(1 for result in results.values() if result['redirects'])))
+
+    episodes = entry['episodes']
+    for index, episode in enumerate(episodes):
+        result = results[episode['token']]
+        expected_broken = (index + 1) % 5 == 0
+        if result['broken'] != expected_broken:
+            fail('episode {} was probed as {}'.format(index + 1, 'broken' if result['broken'] else 'playable'))
+        if not result['broken'] and result['content_length'] != enclosures.size:
+            fail('episode {} was probed with {} bytes'.format(index + 1, result['content_length']))
+
+    # A redirected episode streams from where it redirects to
+    redirected = next(index for index in range(len(episodes)) if '/redirect/' in episodes[index]['url'])
+    response = skill.lambda_handler(envelope(intent_request('ChooseEpisodeIntent',
+                                                            {'EpisodeNumber': str(redirected + 1)})), None)
+    url = response['response']['directives'][0]['audioItem']['stream']['url']
+    if url != enclosures.url + '/audio/episode-{}.mp3'.format(redirected + 1):
+        fail('episode {} streams from {}'.format(redirected + 1, url))
+
+    # The episode after the one before a broken one is enqueued, skipping it
+    before_broken = next(index for index in range(len(episodes) - 2) if results[episodes[index + 1]['token']]['broken'])
+    response = skill.lambda_handler(envelope(intent_request('ChooseEpisodeIntent',
+                                                            {'EpisodeNumber': str(before_broken + 1)})), None)
+    token = response['response']['directives'][0]['audioItem']['stream']['token']
+    response = skill.lambda_handler(envelope(audio_player_event('PlaybackNearlyFinished', token, 1000)), None)
+    enqueued = response['response']['directives'][0]['audioItem']['stream']['token']
+    if enqueued != episodes[before_broken + 2]['token']:
+        fail('episode {} was not skipped after episode {}'.format(before_broken + 2, before_broken + 1))
+    print('PlayDirectives stream from redirect targets, and broken episodes are not enqueued')
+    enclosures.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+ Latency of handlers that load the user's state and the catalog in the same
+ request, with the loads run one after another against run concurrently on the
+ I/O pool (lambda/fanout.py). The local DynamoDB stand-in answers every call
+ after --latency-ms, like a network round trip.
+
+ Each request is made with the container's catalog, presigned URL and enclosure
+ probe caches emptied first, as after a cold start or once the cached catalog
+ has expired; with warm caches there is nothing to fan out and both modes are
+ the same.
+
+ Usage: python benchmarks/fanout.py [--latency-ms 10] [--requests 20]
+ """
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from standins import (LocalDynamoDbResource, FeedServer, build_feed, load_skill, envelope, intent_request,
+                      launch_request, audio_player_event)
+
+def sequentially(*calls):
+    return [call() for call in calls]
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--latency-ms', type=float, default=10)
+    parser.add_argument('--requests', type=int, default=20)
+    args = parser.parse_args()
+
+    resource = LocalDynamoDbResource()
+    feed = FeedServer(build_feed(100))
+    skill = load_skill(resource, feed.url)
+    import catalog
+    import enclosures
+    import fanout
+    import utils
+    catalog.refresh_catalog(feed.url)
+    feed.close()
+
+    # Give the user a position and warm up boto3 and the pool
+    first = skill.lambda_handler(envelope(intent_request('ChooseEpisodeIntent', {'EpisodeNumber': '50'})), None)
+    token = first['response']['directives'][0]['audioItem']['stream']['token']
+    skill.lambda_handler(envelope(intent_request('AMAZON.NextIntent')), None)
+    skill.lambda_handler(envelope(intent_request('AMAZON.PreviousIntent')), None)
+    fanout.get_executor()
+    resource.table.latency = args.latency_ms / 1e3
+
+    requests = [('LaunchRequest', launch_request()),
+                ('PlayNewestEpisodeIntent', intent_request('PlayNewestEpisodeIntent')),
+                ('AMAZON.ResumeIntent', intent_request('AMAZON.ResumeIntent')),
+                ('AudioPlayer.PlaybackStarted', audio_player_event('PlaybackStarted', token, 1000))]
+
+    print('{:<32} {:>16} {:>16} {:>9}'.format('request', 'sequential ms', 'concurrent ms', 'speedup'))
+    for name, request in requests:
+        medians = []
+        for run_calls in (sequentially, fanout.run_concurrently):
+            skill.run_concurrently = run_calls
+            timings = []
+            for _ in range(args.requests):
+                catalog._catalog_cache.clear()
+                utils._presigned_url_cache.clear()
+                enclosures._probe_cache.clear()
+                start = time.perf_counter()
+                skill.lambda_handler(envelope(request), None)
+                timings.append(time.perf_counter() - start)
+            medians.append(statistics.median(timings) * 1e3)
+        print('{:<32} {:>16.2f} {:>16.2f} {:>8.2f}x'.format(name, medians[0], medians[1], medians[0] / medians[1]))
+
+if __name__ == '__main__':
+    main()
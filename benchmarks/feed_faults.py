@@ -0,0 +1,150 @@
+"""
+ Fault injection for the catalog layer: the feed's local HTTP stand-in
+ (standins.FeedServer) is made slow, answers 503s or sends the feed cut off
+ halfway, and the catalog table is made to fail, while the skill keeps being
+ asked for the newest episode. Each scenario prints PASS or FAIL, and the script
+ exits non-zero on the first failure.
+
+ Covered:
+ - a feed that fails to refresh leaves the published catalog alone, a truncated
+   one included, and after FEED_FAILURE_THRESHOLD failures its circuit opens and
+   the feed is not fetched again until the cool-down has passed
+ - requests go on being served throughout, from the published catalog, and a
+   cold container finds the last good catalog in the table
+ - an expired catalog is served while it is read again in the background, and
+   still served when the table cannot be read
+ - a container with no catalog to serve and no feed to fetch says so, and stops
+   waiting on the feed once its circuit is open
+
+ Timeouts and the cool-down are shortened so the script runs in a few seconds.
+
+ Usage: python benchmarks/feed_faults.py
+ """
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from standins import LocalDynamoDbResource, FeedServer, build_feed, load_skill, envelope, intent_request
+
+COOLDOWN = 1.0
+
+def check(condition, message):
+    if not condition:
+        print('FAIL: ' + message)
+        sys.exit(1)
+
+def newest_episode_url(skill):
+    response = skill.lambda_handler(envelope(intent_request('PlayNewestEpisodeIntent')), None)['response']
+    directives = response.get('directives') or []
+    return directives[0]['audioItem']['stream']['url'] if directives else response['outputSpeech']['ssml']
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def main():
+    feed = FeedServer(build_feed(20))
+    resource = LocalDynamoDbResource()
+    skill = load_skill(resource, feed.url)
+    import catalog
+    import circuit_breaker
+    import feed_http
+    import logging
+    import persistence
+    logging.disable(logging.CRITICAL)
+
+    feed_http.http_connect_timeout = feed_http.http_read_timeout = 0.3
+    feed.delay = 0.6
+    circuit_breaker.feed_cooldown = COOLDOWN
+    threshold = circuit_breaker.feed_failure_threshold
+    newest = 'https://cdn.example.com/episode-20.mp3'
+
+    catalog.refresh_catalog(feed.url)
+    check(newest_episode_url(skill) == newest, 'the catalog was not published')
+
+    # The feed gains an episode, then every fetch of it fails
+    feed.publish(build_feed(21))
+    for fault in ('slow', 'error', 'truncated'):
+        circuit_breaker._breakers.clear()
+        feed.fault = fault
+        for attempt in range(threshold):
+            try:
+                catalog.refresh_catalog(feed.url)
+                check(False, 'refreshing a {} feed succeeded'.format(fault))
+            except circuit_breaker.CircuitOpenError:
+                check(False, 'the circuit opened after {} {} failures'.format(attempt, fault))
+            except Exception:
+                pass
+        published = persistence.catalog_store.get_catalog(feed.url)
+        check(published['version'] == 1 and len(published['episodes']) == 20,
+              'a {} feed changed the published catalog'.format(fault))
+
+        requests = feed.requests
+        start = time.perf_counter()
+        try:
+            catalog.refresh_catalog(feed.url)
+            check(False, 'the feed was refreshed with its circuit open')
+        except circuit_breaker.CircuitOpenError:
+            pass
+        check(feed.requests == requests, 'the feed was fetched with its circuit open')
+        check(time.perf_counter() - start < 0.1, 'a refresh with the circuit open waited on something')
+
+        catalog._catalog_cache.clear()
+        check(newest_episode_url(skill) == newest, 'a cold container was not served during the {} fault'.format(fault))
+        print('PASS: {} feed: the published catalog is kept and the circuit opens after {} failures'.format(
+            fault, threshold))
+
+    # After the cool-down one fetch is let through, and it closes the circuit
+    feed.fault = None
+    time.sleep(COOLDOWN)
+    refreshed = catalog.refresh_catalog(feed.url)
+    check(refreshed['version'] == 2 and len(refreshed['episodes']) == 21, 'the recovered feed was not published')
+    check(not circuit_breaker.feed_breaker(feed.url).is_open, 'the circuit stayed open after a good fetch')
+    print('PASS: the circuit closes on the first good fetch after the cool-down')
+
+    # An expired catalog is served as it is, and read again in the background
+    check(catalog._catalog_cache[feed.url]['version'] == 1, 'the container did not hold version 1')
+    catalog._catalog_cache[feed.url]['fetched_at'] -= catalog.catalog_cache_ttl
+    check(newest_episode_url(skill) == newest, 'an expired catalog was not served while being read again')
+    check(wait_for(lambda: catalog._catalog_cache[feed.url]['version'] == 2),
+          'the expired catalog was not read again in the background')
+    check(newest_episode_url(skill) == 'https://cdn.example.com/episode-21.mp3', 'the new version was not served')
+    print('PASS: an expired catalog is served while it is read again in the background')
+
+    # The table fails: the cached catalog is served, however old
+    get_catalog = persistence.catalog_store.get_catalog
+
+    def failing_get_catalog(feed_url):
+        raise persistence.PersistenceException('Injected table failure')
+    persistence.catalog_store.get_catalog = failing_get_catalog
+    for age in (catalog.catalog_cache_ttl, catalog.catalog_cache_ttl + catalog.catalog_max_stale):
+        catalog._catalog_cache[feed.url]['fetched_at'] = time.time() - age - 1
+        check(newest_episode_url(skill) == 'https://cdn.example.com/episode-21.mp3',
+              'a catalog {}s old was not served while the table failed'.format(age))
+        wait_for(lambda: not catalog._revalidating)
+    persistence.catalog_store.get_catalog = get_catalog
+    print('PASS: the cached catalog is served while the table cannot be read')
+
+    # A container with nothing published to read and the feed down
+    circuit_breaker._breakers.clear()
+    catalog._catalog_cache.clear()
+    resource.table.items.clear()
+    feed.fault = 'error'
+    timings = []
+    for _ in range(threshold + 2):
+        start = time.perf_counter()
+        speech = newest_episode_url(skill)
+        timings.append(time.perf_counter() - start)
+        check("can't reach the episode list" in speech, 'the user was not told the episodes are unavailable')
+    check(max(timings[threshold:]) < 0.1, 'requests kept waiting on the feed with its circuit open')
+    print('PASS: with nothing to serve users are told so, in {:.0f} ms once the circuit is open (first: {:.0f} ms)'.format(
+        max(timings[threshold:]) * 1e3, timings[0] * 1e3))
+    feed.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""
+ Compares the streaming lxml feed parser in lambda/utils.py with the previous
+ BeautifulSoup full-tree parse on synthetic feeds of 100, 1k and 10k items.
+
+ Every measurement runs in a fresh interpreter so peak RSS is not shared between
+ runs. The BeautifulSoup baseline needs bs4 installed (pip install bs4); it is no
+ longer part of lambda/requirements.txt.
+
+ Usage: python benchmarks/feed_parser.py [--sizes 100,1000,10000] [--repeat 5]
+ """
+
+import argparse
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+ITEM_TEMPLATE = (
+    '<item>'
+    '<title>Episode {n}: a conversation about things</title>'
+    '<description><![CDATA[<p>Show notes for episode {n}. {filler}</p>]]></description>'
+    '<link>https://anchor.fm/show/episodes/episode-{n}</link>'
+    '<guid isPermaLink="false">guid-{n}</guid>'
+    '<pubDate>Mon, 01 Jun 2020 10:00:00 GMT</pubDate>'
+    '<enclosure url="https://anchor.fm/s/172e72c0/podcast/play/{n}/episode-{n}.mp3" length="1000000" type="audio/mpeg"/>'
+    '<itunes:duration>00:30:00</itunes:duration>'
+    '</item>'
+)
+
+def build_feed(size):
+    filler = 'Lorem ipsum dolor sit amet. ' * 20
+    items = ''.join(ITEM_TEMPLATE.format(n=n, filler=filler) for n in range(size, 0, -1))
+    return ('<?xml version="1.0" encoding="UTF-8"?>'
+            '<rss version="2.0" xmlns:itunes="http://www.itunes.com/dtds/podcast-1.0.dtd">'
+            '<channel><title>Benchmark show</title>' + items + '</channel></rss>').encode('utf-8')
+
+# The parse path that utils.populate_playlist_from_rss used before the streaming parser
+def bs4_parse(rss_raw_content):
+    from bs4 import BeautifulSoup
+    playlist = []
+    rss_parsed_data = BeautifulSoup(rss_raw_content, 'xml')
+    all_episodes = rss_parsed_data.find_all('item')
+    all_episodes.reverse()
+    for index, episode in enumerate(all_episodes):
+        playlist.append({'url': episode.enclosure['url'], 'title': episode.title.text, 'token': str(index+1)})
+    return playlist
+
+def streaming_parse(rss_raw_content):
+    from utils import parse_playlist
+    return parse_playlist(rss_raw_content)
+
+# Refresh of a catalog that is one episode behind the feed, by a refresher that
+# already has the catalog's guid index
+def streaming_refresh(rss_raw_content, size):
+    from utils import parse_playlist, diff_feed, apply_feed_changes, build_guid_index
+    older = parse_playlist(rss_raw_content)[:size - 1]
+    guid_index = build_guid_index(older)
+    start = time.perf_counter()
+    apply_feed_changes(older, diff_feed(rss_raw_content, guid_index))
+    return time.perf_counter() - start
+
+PARSERS = {'bs4': bs4_parse, 'streaming': streaming_parse}
+
+def run_child(parser, size, repeat):
+    rss_raw_content = build_feed(size)
+    if parser == 'refresh':
+        timings = [streaming_refresh(rss_raw_content, size) for _ in range(repeat)]
+        print('{} 0'.format(statistics.median(timings)))
+        return
+
+    parse = PARSERS[parser]
+    # Import the parser's dependencies before taking the baseline RSS
+    parse(build_feed(1))
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        parse(rss_raw_content)
+        timings.append(time.perf_counter() - start)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    print('{} {}'.format(statistics.median(timings), peak))
+
+def measure(parser, size, repeat):
+    output = subprocess.check_output(
+        [sys.executable, os.path.abspath(__file__), '--child', parser, '--sizes', str(size), '--repeat', str(repeat)])
+    seconds, peak_kb = output.decode().split()
+    return float(seconds), int(peak_kb)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='100,1000,10000')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--child')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    if args.child:
+        run_child(args.child, sizes[0], args.repeat)
+        return
+
+    print('{:>7} {:>10} {:>12} {:>14}'.format('items', 'parser', 'median ms', 'peak RSS KiB'))
+    for size in sizes:
+        for name in ('bs4', 'streaming', 'refresh'):
+            seconds, peak_kb = measure(name, size, args.repeat)
+            print('{:>7} {:>10} {:>12.2f} {:>14}'.format(size, name, seconds * 1000, peak_kb if name != 'refresh' else '-'))
+
+if __name__ == '__main__':
+    main()
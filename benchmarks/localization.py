@@ -0,0 +1,64 @@
+"""
+ Time spent in LocalizationInterceptor per request: the previous interceptor, which
+ opened and parsed languages/<locale>.json on every request and fell back to the
+ two-letter file after a failed open, against the preloaded locale table.
+
+ Locales are timed separately: en-US and en-AU have their own files, while en-NZ
+ has none and resolves to en.json, which cost the previous interceptor a failed
+ open before the second read.
+
+ Usage: python benchmarks/localization.py [--calls 5000]
+ """
+
+import argparse
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from standins import LocalDynamoDbResource, load_skill
+
+LOCALES = ('en-US', 'en-AU', 'en-NZ')
+
+# LocalizationInterceptor.process before the prompts were preloaded
+def reading_interceptor(handler_input):
+    locale = handler_input.request_envelope.request.locale
+    try:
+        with open("languages/"+str(locale)+".json") as language_data:
+            language_prompts = json.load(language_data)
+    except:
+        with open("languages/"+ str(locale[:2]) +".json") as language_data:
+            language_prompts = json.load(language_data)
+    handler_input.attributes_manager.request_attributes["_"] = language_prompts
+
+# Only the attributes the interceptor touches
+def handler_input(locale):
+    return SimpleNamespace(request_envelope=SimpleNamespace(request=SimpleNamespace(locale=locale)),
+                           attributes_manager=SimpleNamespace(request_attributes={}))
+
+def time_calls(process, locale, calls):
+    inputs = [handler_input(locale) for _ in range(calls)]
+    start = time.perf_counter()
+    for item in inputs:
+        process(item)
+    return (time.perf_counter() - start) / calls
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=5000)
+    args = parser.parse_args()
+
+    skill = load_skill(LocalDynamoDbResource(), 'http://127.0.0.1:9/unused')
+    interceptor = skill.LocalizationInterceptor()
+
+    print('{:<8} {:>16} {:>16} {:>10}'.format('locale', 'before (us)', 'after (us)', 'speedup'))
+    for locale in LOCALES:
+        before = time_calls(reading_interceptor, locale, args.calls)
+        after = time_calls(interceptor.process, locale, args.calls)
+        print('{:<8} {:>16.2f} {:>16.3f} {:>9.0f}x'.format(locale, before * 1e6, after * 1e6, before / after))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+ Per-call cost of the album art URL used by every PlayDirective: the previous
+ create_presigned_url, which built an S3 client and signed a URL on every call,
+ against the cached version in lambda/utils.py.
+
+ Signing happens locally, so this needs no network access. Dummy credentials
+ and a bucket name are filled in when none are configured.
+
+ Usage: python benchmarks/presigned_url.py [--calls 200]
+ """
+
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+os.environ.setdefault('S3_PERSISTENCE_REGION', 'us-east-1')
+os.environ.setdefault('S3_PERSISTENCE_BUCKET', 'benchmark-bucket')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+import boto3
+
+OBJECT_NAME = 'Media/album_art.png'
+
+# create_presigned_url before the client and the URLs were cached
+def uncached_presigned_url(object_name):
+    s3_client = boto3.client('s3',
+                             region_name=os.environ.get('S3_PERSISTENCE_REGION'),
+                             config=boto3.session.Config(signature_version='s3v4', s3={'addressing_style': 'path'}))
+    return s3_client.generate_presigned_url('get_object',
+                                            Params={'Bucket': os.environ.get('S3_PERSISTENCE_BUCKET'),
+                                                    'Key': object_name},
+                                            ExpiresIn=6000)
+
+def time_calls(function, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        function(OBJECT_NAME)
+    return (time.perf_counter() - start) / calls
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=200)
+    args = parser.parse_args()
+
+    import utils
+
+    # Warm up botocore's loaders so neither side pays for the first model load
+    uncached_presigned_url(OBJECT_NAME)
+
+    before = time_calls(uncached_presigned_url, args.calls)
+
+    start = time.perf_counter()
+    utils._presigned_url_cache.clear()
+    utils.create_presigned_url(OBJECT_NAME)
+    first = time.perf_counter() - start
+    after = time_calls(utils.create_presigned_url, args.calls)
+
+    print('{:<36} {:>12}'.format('path', 'us per call'))
+    print('{:<36} {:>12.1f}'.format('client + sign per call (before)', before * 1e6))
+    print('{:<36} {:>12.1f}'.format('cached, first call (sign)', first * 1e6))
+    print('{:<36} {:>12.2f}'.format('cached, warm call (after)', after * 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,227 @@
+"""
+ Replays Alexa request envelopes through lambda_handler against the local
+ stand-ins (in-memory DynamoDB table, local RSS server, S3 presigning with dummy
+ credentials) and reports latency percentiles and memory allocation per handler
+ class.
+
+ The synthetic trace has every user launch the skill, choose an episode, listen
+ through PlaybackStarted/Stopped, resume, skip with Next into a
+ PlaybackNearlyFinished/Finished hand-over and launch again later. Recorded
+ envelopes, one JSON request envelope per line, are replayed after it with
+ --recorded.
+
+ Latency is measured without allocation tracing; a second pass over the same
+ trace under tracemalloc records each request's peak traced memory and its
+ allocations: the blocks allocated while it ran, counted per source line from
+ tracemalloc snapshots taken before and after it. A snapshot only holds the
+ blocks still allocated when it is taken, so short-lived allocations show in
+ the peak rather than the count. Results are written as JSON with sorted keys
+ (--output) so runs on two commits can be diffed directly or with --compare.
+
+ Usage: python benchmarks/replay.py [--users 100] [--episodes 200] [--recorded trace.jsonl]
+                                    [--output results.json] [--compare baseline.json]
+ """
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from standins import (LocalDynamoDbResource, FeedServer, build_feed, load_skill, envelope,
+                      intent_request, launch_request, audio_player_event)
+
+MINUTE = 60 * 1000
+
+def stream_token(response):
+    for directive in response['response'].get('directives') or []:
+        if directive.get('type') == 'AudioPlayer.Play':
+            return directive['audioItem']['stream']['token']
+    return None
+
+# One user's session. Envelopes are generated as the replay goes, since the
+# stream tokens of the events come from the responses to the requests before them.
+def synthetic_session(user_id, episode_number):
+    def request(body):
+        return envelope(body, user_id=user_id)
+
+    yield request(launch_request())
+    response = yield request(intent_request('ChooseEpisodeIntent', {'EpisodeNumber': str(episode_number)}))
+    token = stream_token(response)
+    yield request(audio_player_event('PlaybackStarted', token, 0))
+    yield request(audio_player_event('PlaybackStopped', token, 12 * MINUTE))
+    yield request(intent_request('AMAZON.ResumeIntent'))
+    yield request(audio_player_event('PlaybackStarted', token, 12 * MINUTE))
+    response = yield request(intent_request('AMAZON.NextIntent'))
+    token = stream_token(response) or token
+    yield request(audio_player_event('PlaybackStarted', token, 0))
+    response = yield request(audio_player_event('PlaybackNearlyFinished', token, 28 * MINUTE))
+    next_token = stream_token(response)
+    yield request(audio_player_event('PlaybackFinished', token, 30 * MINUTE))
+    if next_token is not None:
+        yield request(audio_player_event('PlaybackStarted', next_token, 0))
+        yield request(audio_player_event('PlaybackStopped', next_token, 5 * MINUTE))
+    yield request(launch_request())
+
+def recorded_envelopes(path):
+    with open(path) as trace:
+        for line in trace:
+            if line.strip():
+                yield json.loads(line)
+
+# Calls `invoke` with every envelope of the trace and returns one
+# (handler class, result) pair per request. Each pass uses its own user ids, so
+# every pass starts from users the table has not seen.
+def replay(handled, invoke, prefix, users, episodes, recorded):
+    samples = []
+
+    def run(request_envelope):
+        handled['name'] = None
+        result = invoke(request_envelope)
+        samples.append((handled['name'] or 'unhandled', result[1]))
+        return result[0]
+
+    for user in range(users):
+        session = synthetic_session('{}-user-{}'.format(prefix, user), user % episodes + 1)
+        response = None
+        try:
+            while True:
+                response = run(session.send(response) if response is not None else next(session))
+        except StopIteration:
+            pass
+    if recorded:
+        for request_envelope in recorded_envelopes(recorded):
+            run(request_envelope)
+    return samples
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def summarize(latencies, allocations):
+    handlers = {}
+    for name in sorted(set(name for name, _ in latencies)):
+        times = [value for handler, value in latencies if handler == name]
+        peaks = [value[0] for handler, value in allocations if handler == name]
+        counts = [value[1] for handler, value in allocations if handler == name]
+        handlers[name] = {
+            'requests': len(times),
+            'p50_ms': round(percentile(times, 0.50), 3),
+            'p95_ms': round(percentile(times, 0.95), 3),
+            'p99_ms': round(percentile(times, 0.99), 3),
+            'allocations_p50': percentile(counts, 0.50),
+            'allocations_mean': round(sum(counts) / float(len(counts)), 1),
+            'peak_alloc_kib_p50': round(percentile(peaks, 0.50) / 1024.0, 1),
+        }
+    return handlers
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def print_results(results):
+    print('{:<38} {:>8} {:>9} {:>9} {:>9} {:>10} {:>10} {:>10}'.format(
+        'handler', 'requests', 'p50 ms', 'p95 ms', 'p99 ms', 'allocs p50', 'allocs avg', 'peak KiB'))
+    for name, stats in sorted(results['handlers'].items()):
+        print('{:<38} {:>8} {:>9.3f} {:>9.3f} {:>9.3f} {:>10} {:>10.1f} {:>10.1f}'.format(
+            name, stats['requests'], stats['p50_ms'], stats['p95_ms'], stats['p99_ms'],
+            stats['allocations_p50'], stats['allocations_mean'], stats['peak_alloc_kib_p50']))
+    print('dynamodb: {reads} reads, {writes} writes; feed requests: {feed_requests}'.format(**results['services']))
+
+def print_comparison(results, baseline):
+    print('')
+    print('{:<38} {:>12} {:>12} {:>12} {:>12}'.format('change against ' + str(baseline['meta'].get('commit')),
+                                                     'p50', 'p95', 'allocs avg', 'peak KiB'))
+    for name, stats in sorted(results['handlers'].items()):
+        before = baseline['handlers'].get(name)
+        if before is None:
+            continue
+        changes = []
+        for key in ('p50_ms', 'p95_ms', 'allocations_mean', 'peak_alloc_kib_p50'):
+            changes.append('{:+.1%}'.format(stats[key] / before[key] - 1) if before.get(key) else 'n/a')
+        print('{:<38} {:>12} {:>12} {:>12} {:>12}'.format(name, *changes))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--episodes', type=int, default=200)
+    parser.add_argument('--recorded', help='file with one recorded request envelope per line')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='results JSON of an earlier run to compare against')
+    args = parser.parse_args()
+
+    resource = LocalDynamoDbResource()
+    feed = FeedServer(build_feed(args.episodes))
+    skill = load_skill(resource, feed.url)
+
+    # Publish the catalog the way the scheduled refresher would
+    import catalog
+    catalog.refresh_catalog(feed.url)
+
+    # Record which handler each request ends up in
+    handled = {'name': None}
+    def recording(handler):
+        handle = handler.handle
+        def recorded_handle(handler_input):
+            handled['name'] = type(handler).__name__
+            return handle(handler_input)
+        return recorded_handle
+    for mapper in skill.sb.skill_configuration.request_mappers:
+        for chain in mapper.request_handler_chains:
+            chain.request_handler.handle = recording(chain.request_handler)
+
+    # Warm-up pass over a different set of users, so the timed pass sees a warm container
+    replay(handled, lambda request_envelope: (skill.lambda_handler(request_envelope, None), None),
+           'warmup', min(args.users, 10), args.episodes, None)
+    resource.table.reset_counters()
+    feed_requests = feed.requests
+
+    def timed(request_envelope):
+        start = time.perf_counter()
+        response = skill.lambda_handler(request_envelope, None)
+        return response, (time.perf_counter() - start) * 1e3
+    latencies = replay(handled, timed, 'timed', args.users, args.episodes, args.recorded)
+    services = {'reads': resource.table.reads, 'writes': resource.table.writes,
+                'feed_requests': feed.requests - feed_requests}
+
+    # The snapshots' own allocations are left out of the count
+    untraced = [tracemalloc.Filter(False, tracemalloc.__file__)]
+
+    def traced(request_envelope):
+        snapshot = tracemalloc.take_snapshot().filter_traces(untraced)
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        response = skill.lambda_handler(request_envelope, None)
+        _, peak = tracemalloc.get_traced_memory()
+        statistics = tracemalloc.take_snapshot().filter_traces(untraced).compare_to(snapshot, 'lineno')
+        return response, (peak - before, sum(stat.count_diff for stat in statistics if stat.count_diff > 0))
+    tracemalloc.start()
+    allocations = replay(handled, traced, 'traced', args.users, args.episodes, args.recorded)
+    tracemalloc.stop()
+    feed.close()
+
+    results = {
+        'meta': {'commit': git_commit(), 'python': platform.python_version(),
+                 'users': args.users, 'episodes': args.episodes, 'recorded': args.recorded},
+        'handlers': summarize(latencies, allocations),
+        'services': services,
+    }
+    print_results(results)
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            print_comparison(results, json.load(baseline_file))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+            output.write('\n')
+
+if __name__ == '__main__':
+    main()
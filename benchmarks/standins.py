@@ -0,0 +1,356 @@
+"""
+ Local stand-ins for the services the skill talks to, shared by the benchmark
+ scripts: an in-memory DynamoDB table, local HTTP servers for the RSS feed and
+ the episode enclosures, and builders for Alexa request envelopes. Presigning
+ needs no stand-in, since it happens locally once dummy credentials are set.
+
+ The table keeps items as DynamoDB would hand them back (numbers as Decimal) and
+ counts reads, writes and the capacity units they would consume. It understands
+ the UpdateItem expressions the persistence adapter generates (SET/REMOVE on
+ attribute paths, conditioned on a version attribute) and the version condition
+ the catalog store puts its records with.
+ """
+
+import base64
+import json
+import math
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from decimal import Decimal
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+LAMBDA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda')
+
+def configure_environment():
+    for key, value in (('AWS_ACCESS_KEY_ID', 'benchmark'),
+                       ('AWS_SECRET_ACCESS_KEY', 'benchmark'),
+                       ('AWS_DEFAULT_REGION', 'us-east-1'),
+                       ('DYNAMODB_PERSISTENCE_REGION', 'us-east-1'),
+                       ('DYNAMODB_PERSISTENCE_TABLE_NAME', 'benchmark'),
+                       ('S3_PERSISTENCE_REGION', 'us-east-1'),
+                       ('S3_PERSISTENCE_BUCKET', 'benchmark-bucket')):
+        os.environ.setdefault(key, value)
+    if LAMBDA_DIR not in sys.path:
+        sys.path.insert(0, LAMBDA_DIR)
+
+def _encode(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, bytes):
+        return {'__binary__': base64.b64encode(value).decode('ascii')}
+    raise TypeError(type(value).__name__)
+
+# Binary attributes come back as bytes, where boto3 would wrap them in a Binary
+def _decode(value):
+    if '__binary__' in value:
+        return base64.b64decode(value['__binary__'])
+    return value
+
+# Like DynamoDB, rejects expression attribute names and values that none of the
+# expressions use
+def check_expression_attributes(names, values, *expressions):
+    used = set(re.findall(r'[#:]\w+', ' '.join(filter(None, expressions))))
+    unused = sorted(set(names or ()).union(values or ()) - used)
+    if unused:
+        from botocore.exceptions import ClientError
+        raise ClientError({'Error': {'Code': 'ValidationException',
+                                     'Message': 'Value provided in ExpressionAttributeNames or '
+                                                'ExpressionAttributeValues unused in expressions: {}'.format(
+                                                    ', '.join(unused))}}, 'UpdateItem')
+
+class LocalTable(object):
+
+    def __init__(self):
+        self.items = {}
+        self.lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+        self.read_units = 0
+        self.write_units = 0
+        # Seconds every call waits before it is answered, like a network round trip
+        self.latency = 0
+
+    def _store(self, item):
+        data = json.dumps(item, default=_encode)
+        self.writes += 1
+        self.write_units += max(1, math.ceil(len(data) / 1024.0))
+        self.items[item['id']] = data
+
+    def get_item(self, Key, **kwargs):
+        self._wait()
+        with self.lock:
+            data = self.items.get(Key['id'])
+            self.reads += 1
+            self.read_units += max(1, math.ceil(len(data or '') / 4096.0))
+        if data is None:
+            return {}
+        return {'Item': json.loads(data, parse_float=Decimal, parse_int=Decimal, object_hook=_decode)}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None,
+                 **kwargs):
+        self._wait()
+        check_expression_attributes(ExpressionAttributeNames, ExpressionAttributeValues, ConditionExpression)
+        with self.lock:
+            data = self.items.get(Item['id'])
+            if ConditionExpression and data is not None:
+                # Only the catalog's "attribute_not_exists(#key) OR <path> < :value"
+                path, placeholder = ConditionExpression.split(' OR ')[1].split(' < ')
+                value = json.loads(data, parse_float=Decimal, parse_int=Decimal, object_hook=_decode)
+                for part in path.split('.'):
+                    value = value.get(ExpressionAttributeNames.get(part, part), {}) if isinstance(value, dict) else {}
+                if isinstance(value, dict) or not value < ExpressionAttributeValues[placeholder]:
+                    from botocore.exceptions import ClientError
+                    raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException',
+                                                 'Message': 'The conditional request failed'}}, 'PutItem')
+            self._store(Item)
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues,
+                    ConditionExpression=None, **kwargs):
+        self._wait()
+        check_expression_attributes(ExpressionAttributeNames, ExpressionAttributeValues, UpdateExpression,
+                                    ConditionExpression)
+        names = ExpressionAttributeNames
+        values = json.loads(json.dumps(ExpressionAttributeValues, default=_encode),
+                            parse_float=Decimal, parse_int=Decimal)
+
+        def resolve(path):
+            return [names.get(part, part) for part in path.strip().split('.')]
+
+        with self.lock:
+            data = self.items.get(Key['id'])
+            item = json.loads(data, parse_float=Decimal, parse_int=Decimal, object_hook=_decode) if data else dict(Key)
+
+            if ConditionExpression:
+                if ConditionExpression.startswith('attribute_not_exists('):
+                    satisfied = resolve(ConditionExpression[len('attribute_not_exists('):-1])[0] not in item
+                else:
+                    path, placeholder = ConditionExpression.split(' = ')
+                    satisfied = item.get(resolve(path)[0]) == values[placeholder.strip()]
+                if not satisfied:
+                    from botocore.exceptions import ClientError
+                    raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException',
+                                                 'Message': 'The conditional request failed'}}, 'UpdateItem')
+
+            set_part, _, remove_part = UpdateExpression.partition(' REMOVE ')
+            for clause in set_part[len('SET '):].split(', '):
+                path, placeholder = clause.split(' = ')
+                parent = item
+                keys = resolve(path)
+                for key in keys[:-1]:
+                    parent = parent.setdefault(key, {})
+                parent[keys[-1]] = values[placeholder.strip()]
+            for path in filter(None, remove_part.split(', ')):
+                parent = item
+                keys = resolve(path)
+                for key in keys[:-1]:
+                    parent = parent.get(key, {})
+                parent.pop(keys[-1], None)
+            self._store(item)
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        self._wait()
+        with self.lock:
+            self.items.pop(Key['id'], None)
+        return {}
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def reset_counters(self):
+        self.reads = self.writes = self.read_units = self.write_units = 0
+
+class LocalDynamoDbResource(object):
+
+    def __init__(self):
+        self.table = LocalTable()
+
+    def Table(self, name):
+        return self.table
+
+def cdn_enclosure_url(n):
+    return 'https://cdn.example.com/episode-{}.mp3'.format(n)
+
+# `enclosure_url` returns the enclosure URL of episode n
+def build_feed(size, first=1, enclosure_url=cdn_enclosure_url):
+    items = ''.join(
+        '<item><title>Episode {n}</title><guid isPermaLink="false">guid-{n}</guid>'
+        '<enclosure url="{url}" length="1000000" type="audio/mpeg"/>'
+        '</item>'.format(n=n, url=enclosure_url(n)) for n in range(first + size - 1, first - 1, -1))
+    return ('<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel>'
+            '<title>Benchmark show</title>' + items + '</channel></rss>').encode('utf-8')
+
+# Serves `body` with an ETag and answers matching If-None-Match requests with 304.
+# Setting `fault` makes every request fail: 'slow' answers after `delay` seconds,
+# 'error' with a 503 and 'truncated' with the first half of the feed and a new
+# ETag.
+class FeedServer(object):
+
+    def __init__(self, body):
+        self.body = body
+        self.etag = '"1"'
+        self.requests = 0
+        self.fault = None
+        self.delay = 1.0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.requests += 1
+                if server.fault == 'slow':
+                    time.sleep(server.delay)
+                elif server.fault == 'error':
+                    self.send_response(503)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                elif server.fault == 'truncated':
+                    body = server.body[:len(server.body) // 2]
+                    self.send_response(200)
+                    self.send_header('ETag', '"truncated"')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                if self.headers.get('If-None-Match') == server.etag:
+                    self.send_response(304)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('ETag', server.etag)
+                self.send_header('Content-Type', 'application/rss+xml')
+                self.send_header('Content-Length', str(len(server.body)))
+                self.end_headers()
+                self.wfile.write(server.body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        # A slow feed answers clients that have timed out and gone
+        self.httpd.handle_error = lambda request, client_address: None
+        self.url = 'http://127.0.0.1:{}/podcast/rss'.format(self.httpd.server_address[1])
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def publish(self, body):
+        self.body = body
+        self.etag = '"{}"'.format(int(self.etag.strip('"')) + 1)
+
+    def close(self):
+        self.httpd.shutdown()
+
+# Serves enclosures under /audio/<name>, honouring one-byte Range requests, with
+# the behaviours an enclosure host can have selected by path prefix:
+# /redirect/<hops>/<name> redirects <hops> times before reaching /audio/<name>,
+# /slow/<seconds>/<name> waits before answering, /missing/<name> is a 404 and
+# /empty/<name> is a zero-length file. Every response waits `latency` seconds.
+class EnclosureServer(object):
+
+    def __init__(self, size=1000000, latency=0):
+        self.size = size
+        self.latency = latency
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                parts = self.path.strip('/').split('/')
+                if parts[0] == 'redirect':
+                    hops = int(parts[1])
+                    target = '/redirect/{}/{}'.format(hops - 1, parts[2]) if hops > 1 else '/audio/' + parts[2]
+                    self.send_response(302)
+                    self.send_header('Location', target)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if parts[0] == 'slow':
+                    time.sleep(float(parts[1]))
+                    parts = ['audio', parts[2]]
+                if parts[0] == 'missing' or parts[0] not in ('audio', 'empty'):
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                size = 0 if parts[0] == 'empty' else server.size
+                if self.headers.get('Range') == 'bytes=0-0' and size:
+                    self.send_response(206)
+                    self.send_header('Content-Range', 'bytes 0-0/{}'.format(size))
+                    self.send_header('Content-Length', '1')
+                    self.end_headers()
+                    self.wfile.write(b'\0')
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'audio/mpeg')
+                self.send_header('Content-Length', str(size))
+                self.end_headers()
+                self.wfile.write(b'\0' * size)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.httpd.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}'.format(self.httpd.server_address[1])
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+
+# Imports the skill with its DynamoDB resource replaced by `resource` and the feed
+# URL pointed at `feed_url`. The skill reads languages/ relative to the working
+# directory, as it does on Lambda.
+def load_skill(resource, feed_url):
+    configure_environment()
+    os.chdir(LAMBDA_DIR)
+    import feeds
+    import metrics
+    import persistence
+    import lambda_function
+    # The EMF records are still built and written, just not onto the benchmark's output
+    metrics.metrics_stream = open(os.devnull, 'w')
+    persistence.ddb_resource = resource
+    feeds.registry = feeds.FeedRegistry({feeds.default_feed_id: {'rss_url': feed_url}})
+    return lambda_function
+
+def envelope(request, user_id='benchmark-user', locale='en-US', audio_player=True):
+    request = dict(request)
+    request.setdefault('requestId', 'amzn1.echo-api.request.' + str(uuid.uuid4()))
+    request.setdefault('timestamp', '2020-06-01T10:00:00Z')
+    request.setdefault('locale', locale)
+    device = {'deviceId': 'benchmark-device',
+              'supportedInterfaces': {'AudioPlayer': {}} if audio_player else {}}
+    system = {'application': {'applicationId': 'amzn1.ask.skill.benchmark'},
+              'user': {'userId': user_id},
+              'device': device}
+    return {'version': '1.0',
+            'session': {'new': False, 'sessionId': 'benchmark-session',
+                        'application': system['application'], 'user': system['user']},
+            'context': {'System': system},
+            'request': request}
+
+def intent_request(name, slots=None):
+    return {'type': 'IntentRequest',
+            'intent': {'name': name, 'confirmationStatus': 'NONE',
+                       'slots': dict((slot, {'name': slot, 'value': value, 'confirmationStatus': 'NONE'})
+                                     for slot, value in (slots or {}).items())}}
+
+def launch_request():
+    return {'type': 'LaunchRequest'}
+
+def audio_player_event(event, token, offset=0):
+    return {'type': 'AudioPlayer.' + event, 'token': token, 'offsetInMilliseconds': offset}
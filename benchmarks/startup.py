@@ -0,0 +1,132 @@
+"""
+ Cold-start cost of the skill, measured in fresh interpreters:
+
+  - `python -X importtime -c "import lambda_function"`, broken down by top-level
+    package (self time, so nested imports are not counted twice)
+  - importing the skill and handling one first request against the local
+    stand-ins, for a request that needs no AWS client (Help), one that reads
+    and writes the user's state (Pause) and one that also presigns the album
+    art (PlayNewestEpisode)
+
+ Exits with status 1 if the median import time exceeds --max-import-ms, or if any
+ of the modules that should only load on first use (boto3, botocore, requests,
+ lxml) is imported by lambda_function itself. The threshold is wall time, so set
+ it for the machine the check runs on.
+
+ Usage: python benchmarks/startup.py [--runs 5] [--max-import-ms 250]
+ """
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from standins import LAMBDA_DIR, configure_environment
+
+DEFERRED_MODULES = ('boto3', 'botocore', 'requests', 'lxml')
+FIRST_REQUESTS = ('AMAZON.HelpIntent', 'AMAZON.PauseIntent', 'PlayNewestEpisodeIntent')
+FEED_URL = 'https://feeds.example.com/podcast/rss'
+
+def run_child(*args):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--child'] + list(args),
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.splitlines()[-1])
+
+# Self and cumulative import time in microseconds per module, from -X importtime
+def import_profile():
+    configure_environment()
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import lambda_function'],
+                            cwd=LAMBDA_DIR, env=os.environ, check=True, capture_output=True, text=True).stderr
+    profile = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        profile[name.strip()] = (int(self_us), int(cumulative_us))
+    return profile
+
+def by_package(profile):
+    packages = {}
+    for name, (self_us, _) in profile.items():
+        package = name.split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)
+
+# Runs in the child interpreter: import the skill, then time its first request
+def first_invocation(intent_name):
+    from standins import LocalDynamoDbResource, load_skill, envelope, intent_request
+
+    resource = LocalDynamoDbResource()
+    start = time.perf_counter()
+    skill = load_skill(resource, FEED_URL)
+    imported = time.perf_counter()
+    loaded_at_import = [name for name in DEFERRED_MODULES if name in sys.modules]
+
+    # A published catalog, as the refresher would have left it
+    from persistence import catalog_key
+    from utils import episode_token
+    episodes = [{'url': 'https://cdn.example.com/episode-{}.mp3'.format(n), 'title': 'Episode {}'.format(n),
+                 'token': episode_token('guid-{}'.format(n)), 'guid': 'guid-{}'.format(n)} for n in range(1, 51)]
+    resource.table.put_item(Item={'id': catalog_key(FEED_URL),
+                                  'attributes': {'version': 1, 'episodes': episodes,
+                                                 'etag': None, 'last_modified': None}})
+
+    before_request = time.perf_counter()
+    skill.lambda_handler(envelope(intent_request(intent_name)), None)
+    handled = time.perf_counter()
+
+    return {'import_ms': (imported - start) * 1e3,
+            'first_request_ms': (handled - before_request) * 1e3,
+            'loaded_at_import': loaded_at_import,
+            'loaded_after_request': [name for name in DEFERRED_MODULES if name in sys.modules]}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--max-import-ms', type=float, default=250)
+    parser.add_argument('--top', type=int, default=12)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        configure_environment()
+        print(json.dumps(first_invocation(args.child)))
+        return
+
+    profile = import_profile()
+    print('import lambda_function: {:.1f} ms (-X importtime, cumulative)'.format(profile['lambda_function'][1] / 1e3))
+    print('{:<28} {:>12}'.format('package', 'self ms'))
+    for package, self_us in by_package(profile)[:args.top]:
+        print('{:<28} {:>12.1f}'.format(package, self_us / 1e3))
+
+    print('')
+    print('{:<28} {:>12} {:>18}  {}'.format('first request', 'import ms', 'first request ms', 'loaded on first use'))
+    import_times = []
+    failures = []
+    for intent_name in FIRST_REQUESTS:
+        runs = [run_child(intent_name) for _ in range(args.runs)]
+        import_ms = statistics.median(run['import_ms'] for run in runs)
+        first_ms = statistics.median(run['first_request_ms'] for run in runs)
+        import_times.append(import_ms)
+        print('{:<28} {:>12.1f} {:>18.1f}  {}'.format(
+            intent_name, import_ms, first_ms, ', '.join(runs[0]['loaded_after_request']) or '-'))
+        if runs[0]['loaded_at_import']:
+            failures.append('{} imported by lambda_function'.format(', '.join(runs[0]['loaded_at_import'])))
+
+    import_ms = statistics.median(import_times)
+    if import_ms > args.max_import_ms:
+        failures.append('median import time {:.1f} ms exceeds {:.1f} ms'.format(import_ms, args.max_import_ms))
+    print('')
+    if failures:
+        for failure in sorted(set(failures)):
+            print('FAIL: ' + failure)
+        sys.exit(1)
+    print('OK: median import time {:.1f} ms (threshold {:.1f} ms)'.format(import_ms, args.max_import_ms))
+
+if __name__ == '__main__':
+    main()
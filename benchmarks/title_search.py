@@ -0,0 +1,104 @@
+"""
+ Build and query time of the episode title index (lambda/title_search.py) used
+ by ChooseEpisodeIntent's EpisodeTitle slot, for synthetic catalogs of titles
+ drawn from a Zipf-distributed vocabulary, against scanning every title for the
+ query's words.
+
+ Queries are two words of a random episode's title, spelt right ("exact") or
+ with one letter changed in one of them ("typo"). A query counts as found when
+ the episode picked has both words in its title. The build time of the typo
+ row is the trigram index of the title words, which the first query with a word
+ that is in no title builds.
+
+ Usage: python benchmarks/title_search.py [--sizes 1000,10000,50000] [--queries 500]
+ """
+
+import argparse
+import os
+import random
+import statistics
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lambda'))
+
+from title_search import TitleIndex, title_words
+
+COMMON_WORDS = ['the', 'with', 'and', 'of', 'a', 'on', 'how', 'to', 'in', 'for']
+
+def build_titles(size, rng):
+    vocabulary = [''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10)))
+                  for _ in range(max(2000, size // 2))]
+    weights = [1.0 / rank for rank in range(1, len(vocabulary) + 1)]
+    titles = []
+    for n in range(1, size + 1):
+        words = rng.choices(vocabulary, weights, k=rng.randint(3, 7)) + rng.sample(COMMON_WORDS, 2)
+        rng.shuffle(words)
+        titles.append('Episode {}: {}'.format(n, ' '.join(words)).capitalize())
+    return titles
+
+def build_queries(titles, count, rng, typo):
+    queries = []
+    while len(queries) < count:
+        words = [word for word in set(title_words(rng.choice(titles))) if word not in COMMON_WORDS and
+                 not word.isdigit() and word != 'episode']
+        if len(words) < 2:
+            continue
+        picked = rng.sample(words, 2)
+        spoken = list(picked)
+        if typo:
+            position = rng.randrange(1, len(spoken[0]))
+            spoken[0] = spoken[0][:position] + rng.choice(string.ascii_lowercase) + spoken[0][position + 1:]
+        queries.append((' '.join(spoken), picked))
+    return queries
+
+# Without an index: the title with the most query words, newest first on ties
+def scan(titles, query):
+    words = set(title_words(query))
+    best_index, best_count = None, 0
+    for index, title in enumerate(titles):
+        count = len(words.intersection(title_words(title)))
+        if count >= best_count and count:
+            best_index, best_count = index, count
+    return best_index
+
+def run_queries(search, titles, queries):
+    timings = []
+    found = 0
+    for query, words in queries:
+        start = time.perf_counter()
+        index = search(query)
+        timings.append(time.perf_counter() - start)
+        if index is not None and set(words) <= set(title_words(titles[index])):
+            found += 1
+    return statistics.median(timings) * 1e3, max(timings) * 1e3, found / float(len(queries))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,50000')
+    parser.add_argument('--queries', type=int, default=500)
+    args = parser.parse_args()
+
+    print('{:>8} {:>10} {:<6} {:>14} {:>12} {:>8} {:>14}'.format(
+        'episodes', 'build ms', 'query', 'median ms', 'max ms', 'found', 'scan median ms'))
+    for size in [int(size) for size in args.sizes.split(',')]:
+        rng = random.Random(size)
+        titles = build_titles(size, rng)
+        start = time.perf_counter()
+        index = TitleIndex(titles)
+        build = (time.perf_counter() - start) * 1e3
+
+        for kind in ('exact', 'typo'):
+            if kind == 'typo':
+                start = time.perf_counter()
+                index._get_trigram_index()
+                build = (time.perf_counter() - start) * 1e3
+            queries = build_queries(titles, args.queries, rng, kind == 'typo')
+            median, slowest, found = run_queries(index.search, titles, queries)
+            scan_median, _, _ = run_queries(lambda query: scan(titles, query), titles, queries[:20])
+            print('{:>8} {:>10.1f} {:<6} {:>14.4f} {:>12.3f} {:>7.0%} {:>14.3f}'.format(
+                size, build, kind, median, slowest, found, scan_median))
+
+if __name__ == '__main__':
+    main()
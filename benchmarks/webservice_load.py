@@ -0,0 +1,134 @@
+"""
+ Load test of the self-hosted webservice mode (lambda/webservice.py): the skill is
+ served over local HTTP with 1, 2, 4, ... worker threads and driven by concurrent
+ clients, each playing the newest episode as a user of its own, reporting its
+ PlaybackStarted event and skipping to the next episode. The local DynamoDB
+ stand-in answers every call after --latency-ms, like a network round trip, which
+ is what the workers spend most of a request waiting on.
+
+ Reports the throughput and latency per worker count, and the catalog reads per
+ request, which stay at zero once the shared catalog cache is warm. Request
+ signatures are not verified, since the requests are not signed.
+
+ Usage: python benchmarks/webservice_load.py [--workers 1,2,4,8,16] [--clients 32] [--requests 600] [--latency-ms 10]
+ """
+
+import argparse
+import http.client
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from standins import (LocalDynamoDbResource, FeedServer, build_feed, load_skill, envelope, intent_request,
+                      audio_player_event)
+
+def fail(message):
+    print('FAIL: ' + message)
+    sys.exit(1)
+
+def post(port, body):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    try:
+        connection.request('POST', '/', json.dumps(body), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        data = response.read()
+        if response.status != 200:
+            fail('request answered with {}: {}'.format(response.status, data[:200]))
+        return json.loads(data)
+    finally:
+        connection.close()
+
+# One client: a user of its own going through the same three requests until
+# `remaining` is used up. Returns the latency of every request it made.
+def run_client(port, user_id, remaining, lock):
+    timings = []
+    while True:
+        with lock:
+            if remaining[0] <= 0:
+                return timings
+            remaining[0] -= 3
+        start = time.perf_counter()
+        response = post(port, envelope(intent_request('PlayNewestEpisodeIntent'), user_id=user_id))
+        timings.append(time.perf_counter() - start)
+        token = response['response']['directives'][0]['audioItem']['stream']['token']
+
+        start = time.perf_counter()
+        post(port, envelope(audio_player_event('PlaybackStarted', token, 0), user_id=user_id))
+        timings.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        post(port, envelope(intent_request('AMAZON.NextIntent'), user_id=user_id))
+        timings.append(time.perf_counter() - start)
+
+def load(port, clients, requests):
+    remaining = [requests]
+    lock = threading.Lock()
+    results = [None] * clients
+
+    def client(n):
+        results[n] = run_client(port, 'load-user-{}'.format(n), remaining, lock)
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    timings = sorted(timing for result in results for timing in result)
+    return len(timings) / elapsed, statistics.median(timings) * 1e3, timings[int(len(timings) * 0.95)] * 1e3
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', default='1,2,4,8,16')
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--requests', type=int, default=600)
+    parser.add_argument('--latency-ms', type=float, default=10)
+    args = parser.parse_args()
+
+    resource = LocalDynamoDbResource()
+    feed = FeedServer(build_feed(100))
+    load_skill(resource, feed.url)
+    import catalog
+    import persistence
+    import webservice
+    catalog.refresh_catalog(feed.url)
+    feed.close()
+    resource.table.latency = args.latency_ms / 1e3
+
+    print('{:>8} {:>12} {:>12} {:>12} {:>16}'.format('workers', 'requests/s', 'median ms', 'p95 ms',
+                                                      'catalog reads'))
+    throughputs = []
+    for workers in [int(workers) for workers in args.workers.split(',')]:
+        server = webservice.create_server('127.0.0.1', 0, workers, verify_requests=False)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_address[1]
+        post(port, envelope(intent_request('PlayNewestEpisodeIntent'), user_id='warm-up'))
+
+        reads_before = resource.table.reads
+        catalog_reads = []
+        get_catalog = persistence.catalog_store.get_catalog
+
+        def counting_get_catalog(feed_url):
+            catalog_reads.append(feed_url)
+            return get_catalog(feed_url)
+        persistence.catalog_store.get_catalog = counting_get_catalog
+        throughput, median, p95 = load(port, args.clients, args.requests)
+        persistence.catalog_store.get_catalog = get_catalog
+        print('{:>8} {:>12.1f} {:>12.2f} {:>12.2f} {:>16}'.format(workers, throughput, median, p95,
+                                                                  len(catalog_reads)))
+        if resource.table.reads == reads_before:
+            fail('the users were never read')
+        throughputs.append(throughput)
+        server.shutdown()
+        server.server_close()
+
+    if len(throughputs) > 1 and throughputs[-1] < throughputs[0] * 2:
+        fail('throughput did not scale with the number of workers')
+
+if __name__ == '__main__':
+    main()
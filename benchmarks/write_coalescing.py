@@ -0,0 +1,89 @@
+"""
+ Replays a recorded-style listening trace through lambda_handler against the local
+ DynamoDB stand-in and reports how many user item writes the persistence adapter
+ actually issued compared to the save_persistent_attributes() calls made by the
+ handlers (each of which used to be a PutItem).
+
+ Usage: python benchmarks/write_coalescing.py [--users 50] [--granularity 5000]
+ """
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from standins import (LocalDynamoDbResource, FeedServer, build_feed, load_skill, envelope,
+                      intent_request, launch_request, audio_player_event)
+
+MINUTE = 60 * 1000
+
+# One listening session: start an episode, pause and resume it a couple of times,
+# let it run into the next one and toggle loop. Tokens come from the responses.
+def replay_session(skill, user_id):
+    def invoke(request):
+        return skill.lambda_handler(envelope(request, user_id=user_id), None)['response']
+
+    def stream(response):
+        return response['directives'][0]['audioItem']['stream']
+
+    invoke(launch_request())
+    token = stream(invoke(intent_request('PlayOldestEpisodeIntent')))['token']
+    invoke(audio_player_event('PlaybackStarted', token, 0))
+    invoke(audio_player_event('PlaybackStopped', token, 3000))
+    invoke(intent_request('AMAZON.ResumeIntent'))
+    invoke(audio_player_event('PlaybackStarted', token, 3000))
+    invoke(audio_player_event('PlaybackStopped', token, 4 * MINUTE))
+    invoke(intent_request('AMAZON.ResumeIntent'))
+    invoke(audio_player_event('PlaybackStarted', token, 4 * MINUTE))
+    next_token = stream(invoke(audio_player_event('PlaybackNearlyFinished', token, 29 * MINUTE)))['token']
+    invoke(audio_player_event('PlaybackFinished', token, 30 * MINUTE))
+    invoke(audio_player_event('PlaybackStarted', next_token, 0))
+    invoke(intent_request('AMAZON.LoopOnIntent'))
+    invoke(intent_request('AMAZON.LoopOnIntent'))
+    invoke(intent_request('AMAZON.ResumeIntent'))
+    invoke(audio_player_event('PlaybackStarted', next_token, 0))
+    invoke(audio_player_event('PlaybackStopped', next_token, 2000))
+    invoke(intent_request('AMAZON.RepeatIntent'))
+    invoke(audio_player_event('PlaybackStarted', next_token, 0))
+    invoke(audio_player_event('PlaybackStopped', next_token, 10 * MINUTE))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--granularity', type=int, default=None,
+                        help='OFFSET_WRITE_GRANULARITY_MS to replay with')
+    args = parser.parse_args()
+    if args.granularity is not None:
+        os.environ['OFFSET_WRITE_GRANULARITY_MS'] = str(args.granularity)
+
+    resource = LocalDynamoDbResource()
+    feed = FeedServer(build_feed(50))
+    skill = load_skill(resource, feed.url)
+
+    import catalog
+    import persistence
+    catalog.get_catalog(feed.url)
+    resource.table.reset_counters()
+
+    adapter = persistence.dynamodb_adapter
+    save_attributes = adapter.save_attributes
+    calls = {'save': 0}
+
+    def counting_save_attributes(request_envelope, attributes):
+        calls['save'] += 1
+        return save_attributes(request_envelope, attributes)
+    adapter.save_attributes = counting_save_attributes
+
+    for user in range(args.users):
+        replay_session(skill, 'benchmark-user-{}'.format(user))
+    feed.close()
+
+    writes = resource.table.writes
+    print('offset write granularity: {} ms'.format(persistence.offset_write_granularity))
+    print('save_persistent_attributes calls: {}'.format(calls['save']))
+    print('item writes issued:               {}'.format(writes))
+    print('writes avoided:                   {:.1%}'.format(1 - float(writes) / calls['save']))
+
+if __name__ == '__main__':
+    main()
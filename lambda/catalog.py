@@ -0,0 +1,254 @@
+from utils import (parse_playlist, diff_feed, has_feed_changes, apply_feed_changes, build_guid_index, patch_guid_index,
+                   episode_token, has_stable_tokens, build_token_index)
+from persistence import catalog_store
+from metrics import timed
+from catalog_codec import PackedEpisodes, ChunkedEpisodes
+from circuit_breaker import feed_breaker
+
+import logging
+import os
+import threading
+import time
+
+# Number of seconds a catalog is served from memory before the published snapshot
+# is read again. Override with the CATALOG_CACHE_TTL environment variable.
+catalog_cache_ttl = int(os.environ.get('CATALOG_CACHE_TTL', 300))
+
+# Number of seconds past the TTL an expired catalog is still served while the
+# snapshot is read again in the background. A catalog older than that is read
+# again before answering, and still served if the read fails. Override with
+# CATALOG_MAX_STALE.
+catalog_max_stale = int(os.environ.get('CATALOG_MAX_STALE', 3600))
+
+# Catalogs keyed by RSS URL, so each feed of the registry (feeds.py) has its own
+# entry and token index. The cache lives at module level so it survives for as
+# long as the Lambda container stays warm, whichever of its feeds it serves. Each
+# entry is the shared catalog record ('version', 'episodes', 'etag',
+# 'last_modified') plus the time it was read and a token -> index map built once
+# per version.
+_catalog_cache = {}
+
+# Feeds whose catalog is being read again in the background
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+
+# One lock per feed, held while a request reads its catalog before answering, so
+# that concurrent requests of a process serving several at once (webservice.py)
+# wait for one read, or one inline fetch of the feed, instead of each making their own
+_load_locks = {}
+_load_locks_lock = threading.Lock()
+
+# Raised when a request needs a catalog that has never been published and the
+# feed cannot be fetched either
+class CatalogUnavailableError(Exception):
+    pass
+
+# Request handlers only read the catalog snapshot published by the refresher
+# (refresher.py), so no user request waits on the RSS download. The feed is only
+# fetched inline when nothing has been published for it yet. The last catalog
+# read is served for as long as reading it again fails, so neither a feed nor a
+# table outage reaches users who have been served before; across cold starts the
+# published snapshot is the last good copy of the feed.
+def get_catalog(url):
+    entry = _catalog_cache.get(url)
+    now = time.time()
+    if entry is None:
+        return _load_catalog_once(url)
+
+    age = now - entry['fetched_at']
+    if age < catalog_cache_ttl:
+        return entry
+    if age < catalog_cache_ttl + catalog_max_stale:
+        _revalidate_in_background(url)
+        return entry
+    try:
+        return _load_catalog_once(url)
+    except Exception as e:
+        logging.error("Reading the catalog of {} failed, serving version {} read {:.0f}s ago: {}".format(
+            url, entry['version'], age, e))
+        return entry
+
+# True if get_catalog(url) would be answered from memory
+def has_cached_catalog(url):
+    entry = _catalog_cache.get(url)
+    return entry is not None and time.time() - entry['fetched_at'] < catalog_cache_ttl + catalog_max_stale
+
+def _load_catalog_once(url):
+    with _load_locks_lock:
+        lock = _load_locks.setdefault(url, threading.Lock())
+    with lock:
+        # Another request may have read it while this one waited
+        entry = _catalog_cache.get(url)
+        now = time.time()
+        if entry is not None and now - entry['fetched_at'] < catalog_cache_ttl:
+            return entry
+        return _load_catalog(url, now)
+
+def _load_catalog(url, now):
+    catalog = catalog_store.get_catalog(url)
+    if catalog is None:
+        logging.warning("No catalog published for {} yet, fetching the feed inline".format(url))
+        try:
+            catalog = refresh_catalog(url, fetch=_fetch_inline)
+        except Exception as e:
+            raise CatalogUnavailableError("No catalog of {} is published and the feed cannot be fetched: {}".format(
+                url, e))
+    elif _needs_token_upgrade(catalog):
+        catalog = _upgrade_tokens(url, catalog, catalog_store)
+
+    return _cache_catalog(url, catalog, now)
+
+# The fetch of a user request, bounded by a deadline (feed_http.fetch_rss_inline)
+def _fetch_inline(url, etag=None, last_modified=None):
+    from feed_http import fetch_rss_inline
+    return fetch_rss_inline(url, etag, last_modified)
+
+# Reads the catalog of `url` again on the I/O pool (fanout.py), once at a time per
+# feed. A read that fails leaves the cached catalog in place, and the next request
+# tries again.
+def _revalidate_in_background(url):
+    with _revalidating_lock:
+        if url in _revalidating:
+            return
+        _revalidating.add(url)
+
+    def revalidate():
+        try:
+            _load_catalog(url, time.time())
+        except Exception as e:
+            logging.warning("Reading the catalog of {} again failed, still serving the cached one: {}".format(url, e))
+        finally:
+            with _revalidating_lock:
+                _revalidating.discard(url)
+
+    from fanout import get_executor
+    get_executor().submit(revalidate)
+
+# The guid index (utils.build_guid_index) of the last catalog version each feed was
+# refreshed to, as (version, index), kept so the next refresh by a warm container
+# does not have to go through every episode again
+_guid_indexes = {}
+
+# Fetches the feed and publishes a new catalog version to `store` if it changed.
+# The stored ETag and Last-Modified make this a conditional GET, so an unchanged
+# feed costs a 304 and nothing is parsed. Otherwise the feed's items are diffed
+# against the catalog by guid (utils.diff_feed), and the new version records the
+# changes against the one before it under 'changes' as {'base_version', 'added',
+# 'removed'}: the number of episodes appended and the old indexes of the ones
+# removed. Containers holding the previous version patch their copy with them.
+# `fetch` has the signature of feed_http.fetch_rss, which is the default; it is
+# imported here so that requests is only loaded when a feed is actually fetched.
+def refresh_catalog(url, store=catalog_store, fetch=None):
+    entry = store.get_catalog(url)
+    if entry is not None and _needs_token_upgrade(entry):
+        entry = _upgrade_tokens(url, entry, store)
+
+    # Failed fetches and feeds that do not parse, such as one cut off mid-download,
+    # count against the feed's circuit breaker (circuit_breaker.py), and while it
+    # is open the feed is not fetched at all. Nothing is published from a feed
+    # that failed to parse.
+    changes = None
+    with feed_breaker(url):
+        if fetch is None:
+            from feed_http import fetch_rss as fetch
+        with timed('RssFetch'):
+            if entry is None:
+                response = fetch(url)
+            else:
+                response = fetch(url, entry['etag'], entry['last_modified'])
+
+        # 304 Not Modified: the feed has not changed, so the published copy is still valid
+        if response.status_code == 304 and entry is not None:
+            return entry
+
+        with timed('FeedParse'):
+            if entry is None:
+                episodes = parse_playlist(response.content)
+                if not episodes:
+                    raise ValueError("The feed at {} has no episodes".format(url))
+            else:
+                guid_index = _get_guid_index(url, entry)
+                changes = diff_feed(response.content, guid_index)
+                if changes['removed'] and len(changes['removed']) == len(guid_index):
+                    # An upstream answering with an empty or unrelated feed must
+                    # not take every episode away
+                    raise ValueError("The feed at {} has none of the catalog's {} episodes".format(
+                        url, len(guid_index)))
+                if has_feed_changes(changes):
+                    episodes = apply_feed_changes(entry['episodes'], changes)
+    if changes is not None and not has_feed_changes(changes):
+        return entry
+
+    catalog = {
+        'version': entry['version'] + 1 if entry is not None else 1,
+        'episodes': episodes,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified')
+    }
+    if changes is not None:
+        catalog['changes'] = {'base_version': entry['version'], 'added': len(changes['added']),
+                              'removed': changes['removed']}
+    if store.save_catalog(url, catalog):
+        guid_index = build_guid_index(episodes) if changes is None else patch_guid_index(guid_index, changes, episodes)
+        _guid_indexes[url] = (catalog['version'], guid_index)
+    else:
+        # Another refresh published this version first; use its copy
+        catalog = store.get_catalog(url)
+
+    return catalog
+
+def _get_guid_index(url, catalog):
+    cached = _guid_indexes.get(url)
+    if cached is not None and cached[0] == catalog['version']:
+        return cached[1]
+    return build_guid_index(catalog['episodes'])
+
+# Catalogs published before stream tokens were derived from guids get the new tokens
+# under a new version. The episodes and their order are unchanged, so the numeric
+# tokens users still hold resolve to the same episodes.
+def _upgrade_tokens(url, catalog, store):
+    for episode in catalog['episodes']:
+        episode['token'] = episode_token(episode['guid'])
+    catalog['version'] += 1
+    if not store.save_catalog(url, catalog):
+        catalog = store.get_catalog(url)
+    return catalog
+
+# Chunked catalogs only ever hold guid tokens, and checking would fetch a chunk
+def _needs_token_upgrade(catalog):
+    return not isinstance(catalog['episodes'], ChunkedEpisodes) and not has_stable_tokens(catalog)
+
+# A catalog read again at the same version keeps the episodes and indexes already
+# in memory, including the chunks a chunked catalog has fetched. The version
+# after it is patched from them with the changes it records where that is cheaper
+# than starting over: a chunked catalog keeps the fetched chunks it still has,
+# and a token index gets the tokens of appended episodes added.
+def _cache_catalog(url, catalog, now):
+    cached = _catalog_cache.get(url)
+    changes = catalog.get('changes')
+    if cached is not None and cached['version'] == catalog['version']:
+        catalog['episodes'] = cached['episodes']
+        catalog['token_index'] = cached['token_index']
+        if 'title_index' in cached:
+            catalog['title_index'] = cached['title_index']
+    elif isinstance(catalog['episodes'], ChunkedEpisodes):
+        if cached is not None and isinstance(cached['episodes'], ChunkedEpisodes):
+            catalog['episodes'].reuse_chunks(cached['episodes'])
+        # Searches the packed tokens instead of loading every chunk
+        catalog['token_index'] = catalog['episodes'].token_index
+    elif cached is not None and isinstance(cached['token_index'], dict) and changes is not None and \
+            int(changes['base_version']) == cached['version'] and not changes['removed']:
+        # The index is copied, since requests may still be using the one cached
+        token_index = dict(cached['token_index'])
+        episodes = catalog['episodes']
+        for index in range(len(episodes) - int(changes['added']), len(episodes)):
+            token_index[episodes[index]['token']] = index
+        catalog['token_index'] = token_index
+    elif isinstance(catalog['episodes'], PackedEpisodes):
+        # Only the tokens are needed, not the episodes' dicts
+        catalog['token_index'] = dict((token, index) for index, token in enumerate(catalog['episodes'].tokens()))
+    else:
+        catalog['token_index'] = build_token_index(catalog['episodes'])
+    catalog['fetched_at'] = now
+    _catalog_cache[url] = catalog
+    return catalog
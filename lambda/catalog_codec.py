@@ -0,0 +1,289 @@
+from collections import OrderedDict
+from collections.abc import Sequence
+from utils import episode_token
+
+import hashlib
+import json
+import os
+import threading
+import zlib
+
+# Storage format of the shared catalog record. With CATALOG_ENCODING=zlib the
+# episode list is written as a single binary attribute instead of a list of
+# DynamoDB maps, which keeps long feeds well below the 400KB item limit and cuts
+# the read units paid whenever a container loads the catalog.
+#
+# With CATALOG_ENCODING=chunked the episodes are split into packed chunks of
+# CATALOG_CHUNK_SIZE episodes, each stored as an item of its own, and the catalog
+# record only keeps the episode count and the chunk ids. Containers then fetch the
+# chunks around the episodes their requests touch, so a request costs the same
+# whatever the length of the back catalog. The stream tokens of all episodes are
+# one more item, only read for tokens that are not next to the user's position,
+# and their titles a few more, only read by title searches.
+#
+# Records in any format are always read, so the setting can be changed at any
+# time.
+catalog_encoding = os.environ.get('CATALOG_ENCODING', 'none').lower()
+catalog_chunk_size = int(os.environ.get('CATALOG_CHUNK_SIZE', 200))
+
+# Number of chunks of a feed a container keeps decoded
+cached_chunks = 8
+
+# Number of episode titles packed together for title searches (title_search.py),
+# which need every title but nothing else about the episodes. A few thousand
+# titles compress to some tens of kilobytes, well within an item.
+titles_group_size = 5000
+
+# Version tags stored next to the packed episodes
+packed_format = 'zlib-v1'
+chunked_format = 'chunked-v1'
+
+# Packs episodes into zlib-compressed JSON rows of
+# [shared, url_suffix, title, guid(, token)]. Enclosure URLs are front coded:
+# `shared` is the number of leading characters the URL has in common with the
+# previous episode's, since they all start with the same host and path. The token
+# is left out when it is the one derived from the guid.
+def encode_episodes(episodes):
+    rows = []
+    previous_url = ''
+    for episode in episodes:
+        url = episode['url']
+        shared = common_prefix_length(previous_url, url)
+        row = [shared, url[shared:], episode['title'], episode['guid']]
+        if episode['token'] != episode_token(episode['guid']):
+            row.append(episode['token'])
+        rows.append(row)
+        previous_url = url
+    return zlib.compress(json.dumps(rows, separators=(',', ':')).encode('utf-8'), 9)
+
+def common_prefix_length(a, b):
+    limit = min(len(a), len(b))
+    length = 0
+    while length < limit and a[length] == b[length]:
+        length += 1
+    return length
+
+# Read-only list of the episodes of a packed catalog. The blob is decompressed on
+# first access and an episode's dict is only built when a handler asks for it,
+# so serving one episode does not turn the whole feed into dicts. Its length is
+# stored next to the blob and needs no decoding.
+class PackedEpisodes(Sequence):
+
+    def __init__(self, packed, count):
+        self._packed = packed
+        self._count = count
+        self._rows = None
+        self._episodes = {}
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("episode index out of range")
+        episode = self._episodes.get(index)
+        if episode is None:
+            episode = self._episodes[index] = self._decode(index)
+        return episode
+
+    def tokens(self):
+        return [row[4] for row in self._load_rows()]
+
+    def titles(self):
+        return [row[2] for row in self._load_rows()]
+
+    def _load_rows(self):
+        if self._rows is None:
+            rows = json.loads(zlib.decompress(self._packed).decode('utf-8'))
+            # Undo the front coding and derive the left out tokens once, so each
+            # episode is a single lookup
+            previous_url = ''
+            for row in rows:
+                row[1] = previous_url = previous_url[:row[0]] + row[1]
+                if len(row) == 4:
+                    row.append(episode_token(row[3]))
+            self._rows = rows
+            self._packed = None
+        return self._rows
+
+    def _decode(self, index):
+        row = self._load_rows()[index]
+        return {'url': row[1], 'title': row[2], 'guid': row[3], 'token': row[4]}
+
+# Tokens derived from guids are 16 hex digits, stored as 8 bytes each in catalog
+# order. A token is found by searching the packed bytes, so no dict of every
+# token is built. The packed tokens are loaded on the first lookup.
+def pack_tokens(episodes):
+    return b''.join(bytes.fromhex(episode['token']) for episode in episodes)
+
+class PackedTokenIndex(object):
+
+    def __init__(self, load_tokens):
+        self._load_tokens = load_tokens
+        self._packed = None
+
+    def get(self, token, default=None):
+        try:
+            key = bytes.fromhex(token)
+        except (TypeError, ValueError):
+            return default
+        if len(key) != 8:
+            return default
+        if self._packed is None:
+            self._packed = self._load_tokens()
+        position = self._packed.find(key)
+        while position > 0 and position % 8:
+            position = self._packed.find(key, position + 1)
+        return position // 8 if position >= 0 else default
+
+def blob_id(packed):
+    return hashlib.sha1(packed).hexdigest()[:16]
+
+# Splits episodes into packed chunks. A chunk's id is derived from its content, so
+# the full chunks of an append-only feed keep their ids, and items, from one
+# version to the next.
+def encode_chunks(episodes, chunk_size=None):
+    chunk_size = chunk_size or catalog_chunk_size
+    chunks = []
+    for start in range(0, len(episodes), chunk_size):
+        packed = encode_episodes(episodes[start:start + chunk_size])
+        chunks.append((blob_id(packed), packed))
+    return chunks
+
+# Packs the titles of `episodes` in groups of titles_group_size, as (id, packed
+# bytes) pairs like the chunks'
+def encode_titles(episodes):
+    groups = []
+    for start in range(0, len(episodes), titles_group_size):
+        titles = [episode['title'] for episode in episodes[start:start + titles_group_size]]
+        packed = zlib.compress(json.dumps(titles, separators=(',', ':')).encode('utf-8'), 9)
+        groups.append((blob_id(packed), packed))
+    return groups
+
+def decode_titles(packed):
+    return json.loads(zlib.decompress(packed).decode('utf-8'))
+
+# Read-only list of the episodes of a chunked catalog. Chunks are fetched with
+# `load_chunk(chunk_id)` when an episode in them is first asked for, and only the
+# most recently used ones are kept.
+class ChunkedEpisodes(Sequence):
+
+    def __init__(self, count, chunk_size, chunk_ids, tokens_id, load_chunk, titles_ids=None):
+        self._count = count
+        self._chunk_size = chunk_size
+        self._chunk_ids = chunk_ids
+        self._titles_ids = titles_ids
+        self._load_chunk = load_chunk
+        self._chunks = OrderedDict()
+        self._lock = threading.Lock()
+        self.token_index = PackedTokenIndex(lambda: load_chunk(tokens_id))
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("episode index out of range")
+        return self._chunk(index // self._chunk_size)[index % self._chunk_size]
+
+    # Takes over the chunks `previous`, another version of the catalog, has fetched
+    # and this one still has. Chunk ids are derived from their content, so an
+    # unchanged chunk has the same id in both.
+    def reuse_chunks(self, previous):
+        with previous._lock:
+            fetched = dict((previous._chunk_ids[number], chunk) for number, chunk in previous._chunks.items())
+        with self._lock:
+            for number, chunk_id in enumerate(self._chunk_ids):
+                chunk = fetched.get(chunk_id)
+                if chunk is not None and number not in self._chunks:
+                    self._chunks[number] = chunk
+
+    # Reads the packed titles, or, for catalogs stored before they were, every
+    # chunk, only keeping the most recent ones afterwards
+    def titles(self):
+        titles = []
+        if self._titles_ids is not None:
+            for titles_id in self._titles_ids:
+                titles.extend(decode_titles(self._load_chunk(titles_id)))
+            return titles
+        for number in range(len(self._chunk_ids)):
+            titles.extend(self._chunk(number).titles())
+        return titles
+
+    def _chunk(self, number):
+        with self._lock:
+            chunk = self._chunks.get(number)
+            if chunk is not None:
+                self._chunks.move_to_end(number)
+                return chunk
+
+        packed = self._load_chunk(self._chunk_ids[number])
+        chunk = PackedEpisodes(packed, min(self._chunk_size, self._count - number * self._chunk_size))
+        with self._lock:
+            self._chunks[number] = chunk
+            while len(self._chunks) > cached_chunks:
+                self._chunks.popitem(last=False)
+        return chunk
+
+# The attributes stored for `catalog` and the chunk items, as (chunk id, packed
+# bytes) pairs, to store with them. Catalogs whose tokens are not all derived from
+# guids are never chunked.
+def encode_catalog(catalog):
+    if catalog_encoding == 'chunked':
+        try:
+            tokens = pack_tokens(catalog['episodes'])
+        except ValueError:
+            tokens = None
+        if tokens is not None:
+            attributes = dict(catalog)
+            episodes = attributes.pop('episodes')
+            chunks = encode_chunks(episodes)
+            attributes['encoding'] = chunked_format
+            attributes['episode_count'] = len(episodes)
+            attributes['chunk_size'] = catalog_chunk_size
+            attributes['chunk_ids'] = [chunk_id for chunk_id, _ in chunks]
+            attributes['tokens_id'] = blob_id(tokens)
+            titles = encode_titles(episodes)
+            attributes['titles_ids'] = [titles_id for titles_id, _ in titles]
+            return attributes, chunks + [(attributes['tokens_id'], tokens)] + titles
+
+    if catalog_encoding not in ('zlib', 'chunked'):
+        return catalog, []
+    attributes = dict(catalog)
+    episodes = attributes.pop('episodes')
+    attributes['encoding'] = packed_format
+    attributes['episode_count'] = len(episodes)
+    attributes['episodes_packed'] = encode_episodes(episodes)
+    return attributes, []
+
+# The catalog stored as `attributes`, in any format. Chunks of a chunked catalog
+# are read with `load_chunk(chunk_id)`, which returns the packed episodes.
+def decode_catalog(attributes, load_chunk=None):
+    encoding = attributes.get('encoding')
+    if encoding not in (packed_format, chunked_format):
+        return attributes
+    catalog = dict(attributes)
+    del catalog['encoding']
+    count = int(catalog.pop('episode_count'))
+    if encoding == chunked_format:
+        catalog.pop('retained_chunk_ids', None)
+        catalog.pop('retired_chunks', None)
+        titles_ids = catalog.pop('titles_ids', None)
+        catalog['episodes'] = ChunkedEpisodes(count, int(catalog.pop('chunk_size')), list(catalog.pop('chunk_ids')),
+                                              catalog.pop('tokens_id'), load_chunk,
+                                              list(titles_ids) if titles_ids is not None else None)
+    else:
+        catalog['episodes'] = PackedEpisodes(binary_value(catalog.pop('episodes_packed')), count)
+    return catalog
+
+# boto3 hands binary attributes back wrapped in a Binary
+def binary_value(value):
+    return bytes(getattr(value, 'value', value))
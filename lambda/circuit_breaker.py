@@ -0,0 +1,74 @@
+import logging
+import os
+import threading
+import time
+
+# After feed_failure_threshold consecutive failed fetches of a feed (errors,
+# timeouts, 5xx responses and feeds that do not parse), the feed's circuit opens
+# and it is not fetched again for feed_cooldown seconds. Then one fetch is let
+# through: if it succeeds the circuit closes, otherwise it stays open for another
+# cool-down. Override with FEED_FAILURE_THRESHOLD and FEED_COOLDOWN.
+feed_failure_threshold = int(os.environ.get('FEED_FAILURE_THRESHOLD', 3))
+feed_cooldown = float(os.environ.get('FEED_COOLDOWN', 300))
+
+class CircuitOpenError(Exception):
+    pass
+
+# Circuit breaker for calls to one upstream, used as a context manager around the
+# call: entering raises CircuitOpenError while the circuit is open, and an
+# exception leaving the block counts as a failure. It is kept per container, so
+# each container finds out about an outage on its own.
+class CircuitBreaker(object):
+
+    def __init__(self, name, failure_threshold=None, cooldown=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or feed_failure_threshold
+        self.cooldown = cooldown if cooldown is not None else feed_cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def __enter__(self):
+        with self._lock:
+            if self.opened_at is None:
+                return self
+            remaining = self.opened_at + self.cooldown - time.time()
+            if remaining > 0 or self._trial_running:
+                raise CircuitOpenError("{} has failed {} times in a row, not trying it again for {:.0f}s".format(
+                    self.name, self.failures, max(remaining, 0)))
+            # Half open: this call is the trial, the others keep failing fast
+            self._trial_running = True
+            return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self._lock:
+            self._trial_running = False
+            if exc_type is None:
+                if self.opened_at is not None:
+                    logging.info("{} is reachable again, closing its circuit".format(self.name))
+                self.failures = 0
+                self.opened_at = None
+                return False
+            self.failures += 1
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logging.warning("{} failed {} times in a row, opening its circuit for {:.0f}s".format(
+                        self.name, self.failures, self.cooldown))
+                self.opened_at = time.time()
+        return False
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+# The circuit breaker of the feed at `url`
+def feed_breaker(url):
+    breaker = _breakers.get(url)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(url, CircuitBreaker(url))
+    return breaker
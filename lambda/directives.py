@@ -0,0 +1,48 @@
+from ask_sdk_model.interfaces.audioplayer import (PlayDirective, PlayBehavior, AudioItem, Stream, AudioItemMetadata)
+from ask_sdk_model.interfaces.display import (Image, ImageInstance)
+from functools import lru_cache
+from utils import create_presigned_url
+from enclosures import stream_url
+
+# S3 key of the album art shown with every episode
+album_art_key = 'Media/album_art.png'
+
+# Builds the PlayDirective for `episode`, a catalog entry, shown as episode
+# `episode_number`. The stream URL is where the enclosure was last probed to
+# redirect to, when it has been (see enclosures.py). Only the Stream is built per
+# call; the metadata subtree is shared by every directive for the same episode
+# until the album art URL is re-signed.
+def play_directive(episode, episode_number, offset=0, play_behavior=PlayBehavior.REPLACE_ALL,
+                   expected_previous_token=None):
+    metadata = episode_metadata(episode['token'], episode['title'], episode_number,
+                                create_presigned_url(album_art_key))
+    return PlayDirective(
+                play_behavior = play_behavior,
+                audio_item = AudioItem(
+                    stream = Stream(
+                        token = episode['token'],
+                        url = stream_url(episode),
+                        offset_in_milliseconds = offset,
+                        expected_previous_token = expected_previous_token
+                        ),
+                    metadata = metadata
+                    )
+                )
+
+# Keyed by the episode's token and the art URL, so a re-signed URL (a new
+# generation of the art) gets new metadata. The subtitle number is part of the
+# key too since it is the episode's position in the catalog. The returned objects
+# are shared and must not be modified.
+@lru_cache(maxsize=256)
+def episode_metadata(token, title, episode_number, art_url):
+    return AudioItemMetadata(
+                title = title,
+                subtitle = "Episode {}".format(episode_number),
+                art = Image(
+                    sources = [
+                        ImageInstance(
+                            url = art_url
+                            )
+                        ]
+                    )
+                )
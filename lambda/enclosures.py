@@ -0,0 +1,152 @@
+from catalog import catalog_cache_ttl
+from metrics import timed
+from persistence import catalog_store
+
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# The refresher (refresher.py) probes the enclosure URLs of the newest
+# PROBE_EPISODES episodes of each feed, PROBE_CONCURRENCY at a time, and publishes
+# the results next to the catalog. A probe records where the URL finally
+# redirects to, the episode's size and the time to its first byte, redirects
+# included. Set PROBE_EPISODES=0 to turn probing off.
+#
+# Request handlers hand devices the final URL, so they skip the redirect hops,
+# and the NearlyFinished handler does not enqueue episodes whose enclosure is
+# broken. Results are probed again once they are half PROBE_MAX_AGE seconds old,
+# and are not acted on once they are PROBE_MAX_AGE old, so a refresher that stops
+# running does not leave devices on an old redirect target.
+probe_episodes = int(os.environ.get('PROBE_EPISODES', 50))
+probe_concurrency = int(os.environ.get('PROBE_CONCURRENCY', 8))
+probe_max_age = int(os.environ.get('PROBE_MAX_AGE', 6 * 3600))
+
+# Published probe results keyed by RSS URL, each {'episodes': token -> result,
+# 'fetched_at'}, read again after the catalog cache TTL like the catalog itself
+_probe_cache = {}
+
+def get_probe_results(url):
+    entry = _probe_cache.get(url)
+    now = time.time()
+    if entry is not None and now - entry['fetched_at'] < catalog_cache_ttl:
+        return entry['episodes']
+    episodes = catalog_store.get_probes(url) if probe_episodes > 0 else None
+    _probe_cache[url] = {'episodes': episodes or {}, 'fetched_at': now}
+    return _probe_cache[url]['episodes']
+
+# True if get_probe_results(url) would be answered from memory
+def has_cached_probe_results(url):
+    entry = _probe_cache.get(url)
+    return probe_episodes <= 0 or (entry is not None and time.time() - entry['fetched_at'] < catalog_cache_ttl)
+
+# The probe result for `episode` from the results already in memory, if it is
+# recent enough and was taken of the enclosure URL the episode has now. Tokens
+# are derived from guids, so they are looked up across the cached feeds.
+def probe_result(episode):
+    for entry in _probe_cache.values():
+        result = entry['episodes'].get(episode['token'])
+        if result is not None:
+            if result['enclosure'] == episode['url'] and time.time() - int(result['checked_at']) < probe_max_age:
+                return result
+            return None
+    return None
+
+# The URL to stream `episode` from: where its enclosure redirects to, if probed
+def stream_url(episode):
+    result = probe_result(episode)
+    if result is not None and not result['broken'] and result['url']:
+        return result['url']
+    return episode['url']
+
+def is_broken(episode):
+    result = probe_result(episode)
+    return result is not None and result['broken']
+
+# Probes one enclosure with a GET of its first byte, which works with hosts and
+# redirect targets that do not answer HEAD like GET, and times the first byte of
+# audio. Failures to connect or read are recorded as a broken enclosure.
+def probe_enclosure(url):
+    from feed_http import http_session, http_connect_timeout, http_read_timeout
+    import requests
+
+    result = {'enclosure': url, 'url': None, 'status': None, 'content_length': None, 'ttfb_ms': None,
+              'redirects': 0, 'broken': True, 'checked_at': int(time.time())}
+    start = time.perf_counter()
+    try:
+        response = http_session.get(url, headers={'Range': 'bytes=0-0', 'Accept-Encoding': 'identity'},
+                                    stream=True, timeout=(http_connect_timeout, http_read_timeout))
+        try:
+            first_byte = response.raw.read(1) if response.status_code < 400 else b''
+            elapsed = time.perf_counter() - start
+        finally:
+            response.close()
+    except requests.RequestException as e:
+        logger.info("Probing {} failed: {}".format(url, e))
+        return result
+
+    result.update({
+        'url': response.url,
+        'status': response.status_code,
+        'content_length': content_length(response),
+        'ttfb_ms': int(elapsed * 1000),
+        'redirects': len(response.history),
+        'broken': response.status_code >= 400 or not first_byte
+    })
+    return result
+
+# Total size of the enclosure from the Content-Range of a ranged response, or the
+# Content-Length of a server that sent the whole file
+def content_length(response):
+    if response.status_code == 206:
+        total = response.headers.get('Content-Range', '').rpartition('/')[2]
+    elif response.status_code == 200:
+        total = response.headers.get('Content-Length', '')
+    else:
+        total = ''
+    return int(total) if total.isdigit() else None
+
+# Probes the newest episodes of `catalog` whose results are missing or due, and
+# publishes the results for the newest episodes to `store`. `probe` has the
+# signature of probe_enclosure, which is the default. Returns the results keyed
+# by token, or None with probing turned off.
+def probe_feed(url, catalog, store=catalog_store, probe=probe_enclosure):
+    if probe_episodes <= 0:
+        return None
+    episodes = catalog['episodes']
+    newest = [episodes[index] for index in range(len(episodes) - 1, max(len(episodes) - probe_episodes, 0) - 1, -1)]
+
+    published = store.get_probes(url) or {}
+    now = time.time()
+    results = {}
+    due = []
+    for episode in newest:
+        result = published.get(episode['token'])
+        if result is not None and result['enclosure'] == episode['url'] and \
+                now - int(result['checked_at']) < probe_max_age / 2:
+            results[episode['token']] = result
+        else:
+            due.append(episode)
+    if not due and len(results) == len(published):
+        return results
+
+    with timed('EnclosureProbe'):
+        if len(due) > 1:
+            from concurrent.futures import ThreadPoolExecutor
+            # A pool of its own: the refresher already runs on the shared one
+            # (fanout.py), and waiting on it from there could use it up
+            with ThreadPoolExecutor(max_workers=probe_concurrency, thread_name_prefix='probe') as pool:
+                probed = list(pool.map(probe, [episode['url'] for episode in due]))
+        else:
+            probed = [probe(episode['url']) for episode in due]
+    for episode, result in zip(due, probed):
+        results[episode['token']] = result
+
+    store.save_probes(url, results)
+    broken = [token for token, result in results.items() if result['broken']]
+    if broken:
+        logger.warning("{} of the {} newest enclosures of {} are broken: {}".format(
+            len(broken), len(results), url, ', '.join(sorted(broken))))
+    return results
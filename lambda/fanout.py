@@ -0,0 +1,44 @@
+from metrics import bind_invocation
+
+import os
+import threading
+
+# Independent I/O of a request (the user's state, the catalog, presigning) is
+# started together on a small pool of threads kept for the life of the container,
+# so the request waits for the slowest call rather than the sum of them. Threads
+# only help with calls that block on the network; the pool is created, and
+# concurrent.futures imported, by the first request that fans out.
+io_pool_size = int(os.environ.get('IO_POOL_SIZE', 4))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                from concurrent.futures import ThreadPoolExecutor
+                _executor = ThreadPoolExecutor(max_workers=io_pool_size, thread_name_prefix='io')
+    return _executor
+
+# Calls every function in `calls` and returns their results in order. The first
+# runs in the calling thread and the others on the pool, and all of them have
+# finished when it returns. If any raised, the first exception in order is
+# re-raised. A single call is just called.
+def run_concurrently(*calls):
+    if len(calls) == 1:
+        return [calls[0]()]
+
+    futures = [get_executor().submit(bind_invocation(call)) for call in calls[1:]]
+    results = []
+    errors = []
+    for call in (calls[0],) + tuple(future.result for future in futures):
+        try:
+            results.append(call())
+        except Exception as e:
+            results.append(None)
+            errors.append(e)
+    if errors:
+        raise errors[0]
+    return results
@@ -0,0 +1,151 @@
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import TimeoutError
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+
+import requests
+import os
+import random
+import threading
+import time
+
+# Only the feed refresh talks HTTP, so this module, and requests with it, is
+# imported on first use rather than by the request handlers.
+#
+# Feed requests go through one pooled session per container so warm invocations
+# reuse the keep-alive connection to the feed host instead of paying for a new TLS
+# handshake. Timeouts are in seconds and keep a slow upstream from using up the
+# skill's response deadline.
+http_connect_timeout = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 2))
+http_read_timeout = float(os.environ.get('HTTP_READ_TIMEOUT', 5))
+http_pool_maxsize = int(os.environ.get('HTTP_POOL_MAXSIZE', 10))
+http_max_retries = int(os.environ.get('HTTP_MAX_RETRIES', 2))
+
+# With retries, one fetch through the pooled session can take several times the
+# timeouts above, which only the refresher (refresher.py) can afford. The fetch a
+# user request makes when nothing is published for its feed yet (catalog.py) goes
+# through a session without retries, with shorter timeouts, and gives up once
+# INLINE_FETCH_DEADLINE seconds have passed, so that it takes at most the deadline
+# plus one read timeout and the skill can still answer in time.
+inline_connect_timeout = float(os.environ.get('INLINE_HTTP_CONNECT_TIMEOUT', 1))
+inline_read_timeout = float(os.environ.get('INLINE_HTTP_READ_TIMEOUT', 2))
+inline_fetch_deadline = float(os.environ.get('INLINE_FETCH_DEADLINE', 4))
+
+# Retries made since the container started, and attempts that timed out connecting
+# or waiting for a response or that ran past the inline deadline; see get_http_metrics
+_counters = {'retries': 0, 'timeouts': 0}
+_counters_lock = threading.Lock()
+
+def count(counter):
+    with _counters_lock:
+        _counters[counter] += 1
+
+# Exponential backoff with up to one extra backoff step of random jitter, so
+# containers that failed together do not retry in lockstep.
+class JitteredRetry(Retry):
+
+    def get_backoff_time(self):
+        backoff_time = super(JitteredRetry, self).get_backoff_time()
+        return backoff_time + random.uniform(0, backoff_time) if backoff_time else 0
+
+    # Called for every failed attempt, the last one included, and raises instead of
+    # returning once the retries are used up
+    def increment(self, method=None, url=None, response=None, error=None, *args, **kwargs):
+        if isinstance(error, TimeoutError):
+            count('timeouts')
+        retry = super(JitteredRetry, self).increment(method, url, response, error, *args, **kwargs)
+        count('retries')
+        return retry
+
+def create_http_session(max_retries=http_max_retries):
+    session = requests.Session()
+    retry = JitteredRetry(total=max_retries,
+                          backoff_factor=0.2,
+                          status_forcelist=(500, 502, 503, 504),
+                          allowed_methods=('GET', 'HEAD'),
+                          raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=http_pool_maxsize, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # Brotli is only advertised when a decoder for it is installed
+    session.headers.update(make_headers(accept_encoding=True))
+    return session
+
+http_session = create_http_session()
+
+# Created by the first inline fetch, which only a container that finds no
+# published catalog makes
+_inline_session = None
+_inline_session_lock = threading.Lock()
+
+def get_inline_session():
+    global _inline_session
+    if _inline_session is None:
+        with _inline_session_lock:
+            if _inline_session is None:
+                _inline_session = create_http_session(max_retries=0)
+    return _inline_session
+
+# Requests made and connections opened by the pooled sessions since the container
+# started, and the retries and timeouts among them. Every request that did not
+# open a connection reused a pooled one.
+def get_http_metrics():
+    total_requests = 0
+    new_connections = 0
+    for session in filter(None, (http_session, _inline_session)):
+        for adapter in set(session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+                total_requests += pool.num_requests
+                new_connections += pool.num_connections
+    with _counters_lock:
+        counters = dict(_counters)
+    return {'requests': total_requests,
+            'new_connections': new_connections,
+            'reused_connections': total_requests - new_connections,
+            'retries': counters['retries'],
+            'timeouts': counters['timeouts']}
+
+def conditional_headers(etag=None, last_modified=None):
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    return headers
+
+def fetch_rss(url, etag=None, last_modified=None):
+    response = http_session.get(url, headers=conditional_headers(etag, last_modified),
+                                timeout=(http_connect_timeout, http_read_timeout))
+    if response.status_code != 304:
+        response.raise_for_status()
+    return response
+
+# A feed read within a deadline, with the attributes of a response that
+# catalog.refresh_catalog uses
+class FetchedFeed(object):
+
+    def __init__(self, status_code, content, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+# fetch_rss for user requests: no retries, and the body is read in pieces so the
+# whole fetch can be given up at the deadline
+def fetch_rss_inline(url, etag=None, last_modified=None):
+    deadline = time.time() + inline_fetch_deadline
+    response = get_inline_session().get(url, headers=conditional_headers(etag, last_modified),
+                                        timeout=(inline_connect_timeout, inline_read_timeout), stream=True)
+    try:
+        if response.status_code != 304:
+            response.raise_for_status()
+        chunks = []
+        for chunk in response.iter_content(64 * 1024):
+            if time.time() > deadline:
+                count('timeouts')
+                raise requests.Timeout("Fetching {} took more than {}s".format(url, inline_fetch_deadline))
+            chunks.append(chunk)
+    finally:
+        response.close()
+    return FetchedFeed(response.status_code, b''.join(chunks), response.headers)
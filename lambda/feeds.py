@@ -0,0 +1,71 @@
+import json
+import os
+
+# RSS feed URL of the podcast served when no feeds are configured
+rss_url = "https://anchor.fm/s/172e72c0/podcast/rss"
+
+# Shows served by this function. Each show is its own Alexa skill pointing at the
+# same Lambda, and a request is served the feed registered for the application id
+# of the skill it came from. The feeds are read, in order of precedence, from the
+# PODCAST_FEEDS environment variable, from the file named by FEEDS_CONFIG, or from
+# feeds.json next to this module, as a JSON object keyed by feed id:
+#
+#     {"main": {"rss_url": "https://...", "application_ids": ["amzn1.ask.skill.1"]},
+#      "other": {"rss_url": "https://...", "application_ids": ["amzn1.ask.skill.2"]}}
+#
+# Requests from an application id that no feed lists get the default feed: the one
+# with id 'default' if there is one, otherwise the first. Without any
+# configuration the only feed is rss_url.
+feeds_config_path = os.environ.get('FEEDS_CONFIG', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'feeds.json'))
+
+default_feed_id = 'default'
+
+class FeedRegistry(object):
+
+    def __init__(self, feeds):
+        if not feeds:
+            raise ValueError("At least one feed has to be configured")
+        self.feeds = {}
+        self._by_application_id = {}
+        for feed_id, config in feeds.items():
+            feed = {
+                'id': feed_id,
+                'rss_url': config['rss_url'],
+                'application_ids': tuple(config.get('application_ids', ()))
+            }
+            self.feeds[feed_id] = feed
+            for application_id in feed['application_ids']:
+                self._by_application_id.setdefault(application_id, feed)
+        self.default = self.feeds.get(default_feed_id) or next(iter(self.feeds.values()))
+
+    def feed_for(self, request_envelope):
+        return self._by_application_id.get(application_id(request_envelope), self.default)
+
+    def is_default(self, feed):
+        return feed is self.default
+
+def application_id(request_envelope):
+    context = request_envelope.context
+    if context is not None and context.system is not None and context.system.application is not None:
+        return context.system.application.application_id
+    session = request_envelope.session
+    if session is not None and session.application is not None:
+        return session.application.application_id
+    return None
+
+def load_feed_config(path=feeds_config_path):
+    if os.environ.get('PODCAST_FEEDS'):
+        return json.loads(os.environ['PODCAST_FEEDS'])
+    if os.path.exists(path):
+        with open(path) as config_file:
+            return json.load(config_file)
+    return {default_feed_id: {'rss_url': rss_url}}
+
+registry = FeedRegistry(load_feed_config())
+
+# The feed of the skill that sent `request_envelope`
+def get_feed(request_envelope):
+    return registry.feed_for(request_envelope)
+
+def feed_url(request_envelope):
+    return registry.feed_for(request_envelope)['rss_url']
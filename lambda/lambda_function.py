@@ -8,36 +8,81 @@
  visit : http://dabblelab.com/copyright
  """
 
-from ask_sdk_core.utils import is_request_type, is_intent_name
 from ask_sdk_core.dispatch_components import (AbstractRequestHandler, AbstractExceptionHandler, AbstractRequestInterceptor, AbstractResponseInterceptor)
-from ask_sdk_core.skill_builder import CustomSkillBuilder
 from ask_sdk_model.interfaces.audioplayer import (
-    PlayDirective, PlayBehavior, AudioItem, Stream, AudioItemMetadata,
-    StopDirective, ClearQueueDirective, ClearBehavior)
-from ask_sdk_model.interfaces.display import (Image, ImageInstance)
-from ask_sdk_dynamodb.adapter import DynamoDbAdapter
-from utils import (create_presigned_url, populate_playlist_from_rss, get_track_index, update_playlist, shuffle_playlist)
+    PlayBehavior, StopDirective, ClearQueueDirective, ClearBehavior)
+from utils import (get_track_index, shuffle_playlist, get_catalog_index, get_play_position, sync_playback_session,
+                   create_presigned_url, has_presigned_url)
+from catalog import get_catalog, has_cached_catalog, CatalogUnavailableError
+from feeds import feed_url
+from enclosures import get_probe_results, has_cached_probe_results, is_broken
+from directives import play_directive, album_art_key
+from fanout import run_concurrently
+from title_search import get_title_index
+from metrics import MetricsRequestInterceptor, MetricsResponseInterceptor, finish_invocation
+from persistence import dynamodb_adapter
+from routing import RoutedRequestHandler, RoutingSkillBuilder
+from types import MappingProxyType
 
 import logging
+import glob
 import json
-import random
 import os
-import boto3
-
-# RSS feed URL of the podcast
-rss_url = "https://anchor.fm/s/172e72c0/podcast/rss"
-
-# Defining the database region, table name and dynamodb persistence adapter
-ddb_region = os.environ.get('DYNAMODB_PERSISTENCE_REGION')
-ddb_table_name = os.environ.get('DYNAMODB_PERSISTENCE_TABLE_NAME')
-ddb_resource = boto3.resource('dynamodb', region_name=ddb_region)
-dynamodb_adapter = DynamoDbAdapter(table_name=ddb_table_name, create_table=False, dynamodb_resource=ddb_resource)
+import random
 
 # Initializing the logger and setting the level to "INFO"
 # Read more about it here https://www.loggly.com/ultimate-guide/python-logging-basics/
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+# Every locale Alexa supports. Each one is resolved up front to its own prompts or,
+# when there is no file for it, to the prompts of its language file (xx-YY -> xx).
+alexa_locales = ('ar-SA', 'de-DE', 'en-AU', 'en-CA', 'en-GB', 'en-IN', 'en-US', 'es-ES', 'es-MX',
+                 'es-US', 'fr-CA', 'fr-FR', 'hi-IN', 'it-IT', 'ja-JP', 'nl-NL', 'pt-BR')
+
+# Loads languages/*.json once per container. The prompts are shared by every request,
+# so they are kept read-only: mappings are wrapped in MappingProxyType and lists of
+# alternative prompts become tuples.
+def load_locale_prompts(directory="languages"):
+    file_prompts = {}
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        with open(path) as language_data:
+            prompts = json.load(language_data)
+        name = os.path.splitext(os.path.basename(path))[0]
+        file_prompts[name] = MappingProxyType(dict(
+            (key, tuple(value) if isinstance(value, list) else value) for key, value in prompts.items()))
+
+    locale_prompts = dict(file_prompts)
+    for locale in alexa_locales:
+        if locale not in locale_prompts and locale[:2] in file_prompts:
+            locale_prompts[locale] = file_prompts[locale[:2]]
+    return MappingProxyType(locale_prompts)
+
+locale_prompts = load_locale_prompts()
+
+# Loads the user's state and the catalog of the request's feed, and with
+# `album_art`, for the handlers that build PlayDirectives, the presigned album art
+# URL and the feed's enclosure probe results, and returns the state and the
+# catalog. The loads that are not already answered from memory run concurrently.
+def load_request_state(handler_input, album_art=False):
+    attributes_manager = handler_input.attributes_manager
+    url = feed_url(handler_input.request_envelope)
+    calls = [lambda: attributes_manager.persistent_attributes]
+    if not has_cached_catalog(url):
+        calls.append(lambda: get_catalog(url))
+    if album_art and not has_presigned_url(album_art_key):
+        calls.append(lambda: create_presigned_url(album_art_key))
+    if album_art and not has_cached_probe_results(url):
+        calls.append(lambda: get_probe_results(url))
+    run_concurrently(*calls)
+    return attributes_manager.persistent_attributes, get_catalog(url)
+
+# The value of slot `name` of an intent, or None when it is not filled or not in
+# the request
+def slot_value(slots, name):
+    slot = (slots or {}).get(name)
+    return slot.value if slot is not None else None
+
 # Intent Handlers
 
 # Check if device supports audio playlack
@@ -62,20 +107,18 @@ class CheckAudioInterfaceHandler(AbstractRequestHandler):
             )
 
 #This Handler is called when the skill is invoked by using only the invocation name(Ex. Alexa, open template four)
-class LaunchRequestHandler(AbstractRequestHandler):
+class LaunchRequestHandler(RoutedRequestHandler):
     
-    def can_handle(self, handler_input):
-        return is_request_type("LaunchRequest")(handler_input)
+    request_types = ("LaunchRequest",)
     
     def handle(self, handler_input):
         logger.info("In LaunchRequestHandler")
         language_prompts = handler_input.attributes_manager.request_attributes["_"]
-        persistent_attributes = handler_input.attributes_manager.persistent_attributes
+        persistent_attributes, catalog = load_request_state(handler_input)
         
         if persistent_attributes.get('playback_session_data') is not None:
-            episode_number = persistent_attributes['playback_session_data']['token']
-            persistent_attributes['playlist'] = update_playlist(rss_url, persistent_attributes['playlist'])
-            handler_input.attributes_manager.save_persistent_attributes()
+            playback_session_data = sync_playback_session(persistent_attributes, catalog)
+            episode_number = get_catalog_index(int(playback_session_data['index']), persistent_attributes.get('shuffle_order')) + 1
             
             speech_output = random.choice(language_prompts["RESUME_PLAYBACK"]).format(episode_number)
             reprompt = random.choice(language_prompts["RESUME_PLAYBACK_REPROMPT"]).format(episode_number)
@@ -83,16 +126,13 @@ class LaunchRequestHandler(AbstractRequestHandler):
         else:
             skill_name = language_prompts['SKILL_NAME']
             
-            playlist = populate_playlist_from_rss(rss_url)
+            playlist = catalog['episodes']
             index = len(playlist) - 1
             token = playlist[index]['token']
-            url = playlist[index]['url']
             offset = 0
-            title = playlist[index]['title']
-            subtitle = "Episode {}".format(token)
             
-            persistent_attributes['playlist'] = playlist
-            persistent_attributes["playback_session_data"] = { 'index': index, 'token': token, 'url': url, 'offset': offset, 'title': title, 'loop': False, 'shuffle': False }
+            persistent_attributes.pop('shuffle_order', None)
+            persistent_attributes["playback_session_data"] = { 'catalog_version': catalog['version'], 'index': index, 'token': token, 'offset': offset, 'loop': False, 'shuffle': False }
             handler_input.attributes_manager.save_persistent_attributes()    
             
             speech_output = random.choice(language_prompts["NEW_USER_GREETING"]).format(skill_name)
@@ -105,51 +145,27 @@ class LaunchRequestHandler(AbstractRequestHandler):
                 .response
             )
 
-class PlayNewestEpisodeIntentHandler(AbstractRequestHandler):
+class PlayNewestEpisodeIntentHandler(RoutedRequestHandler):
     
-    def can_handle(self, handler_input):
-        return is_intent_name("PlayNewestEpisodeIntent")(handler_input)
+    intent_names = ("PlayNewestEpisodeIntent",)
     
     def handle(self, handler_input):
         logger.info("In PlayNewestEpisodeIntentHandler")
         language_prompts = handler_input.attributes_manager.request_attributes["_"]
-        persistent_attributes = handler_input.attributes_manager.persistent_attributes
+        persistent_attributes, catalog = load_request_state(handler_input, album_art = True)
         
-        playlist = populate_playlist_from_rss(rss_url)
+        playlist = catalog['episodes']
         index = len(playlist) - 1
         token = playlist[index]['token']
-        url = playlist[index]['url']
         offset = 0
-        title = playlist[index]['title']
-        subtitle = "Episode {}".format(token)
         
-        persistent_attributes['playlist'] = playlist
-        persistent_attributes["playback_session_data"] = { 'index': index, 'token': token, 'url': url, 'offset': offset, 'title': title, 'loop': False, 'shuffle': False }
+        persistent_attributes.pop('shuffle_order', None)
+        persistent_attributes["playback_session_data"] = { 'catalog_version': catalog['version'], 'index': index, 'token': token, 'offset': offset, 'loop': False, 'shuffle': False }
         handler_input.attributes_manager.save_persistent_attributes()
         
         speech_output = random.choice(language_prompts["PLAY_LATEST_EPISODE"])
         
-        audio_directive = PlayDirective(
-                            play_behavior = PlayBehavior.REPLACE_ALL, 
-                            audio_item = AudioItem(
-                                stream = Stream(
-                                    token = token,
-                                    url = url,
-                                    offset_in_milliseconds = offset
-                                    ),
-                                metadata = AudioItemMetadata(
-                                    title = title,
-                                    subtitle = subtitle,
-                                    art = Image(
-                                        sources = [
-                                            ImageInstance(
-                                                url = create_presigned_url('Media/album_art.png')
-                                                )
-                                            ]
-                                        )
-                                    )
-                                )
-                            )
+        audio_directive = play_directive(playlist[index], index + 1, offset)
         return (
             handler_input.response_builder
                 .speak(speech_output)
@@ -158,51 +174,27 @@ class PlayNewestEpisodeIntentHandler(AbstractRequestHandler):
                 .response
             )
 
-class PlayOldestEpisodeIntentHandler(AbstractRequestHandler):
+class PlayOldestEpisodeIntentHandler(RoutedRequestHandler):
     
-    def can_handle(self, handler_input):
-        return is_intent_name("PlayOldestEpisodeIntent")(handler_input)
+    intent_names = ("PlayOldestEpisodeIntent",)
     
     def handle(self, handler_input):
         logger.info("In PlayOldestEpisodeIntentHandler")
         language_prompts = handler_input.attributes_manager.request_attributes["_"]
-        persistent_attributes = handler_input.attributes_manager.persistent_attributes
+        persistent_attributes, catalog = load_request_state(handler_input, album_art = True)
         
-        playlist = populate_playlist_from_rss(rss_url)
+        playlist = catalog['episodes']
         index = 0
         token = playlist[index]['token']
-        url = playlist[index]['url']
         offset = 0
-        title = playlist[index]['title']
-        subtitle = "Episode {}".format(token)
         
-        persistent_attributes['playlist'] = playlist
-        persistent_attributes["playback_session_data"] = { 'index': index, 'token': token, 'url': url,'offset': offset, 'title': title, 'loop': False, 'shuffle': False }
+        persistent_attributes.pop('shuffle_order', None)
+        persistent_attributes["playback_session_data"] = { 'catalog_version': catalog['version'], 'index': index, 'token': token, 'offset': offset, 'loop': False, 'shuffle': False }
         handler_input.attributes_manager.save_persistent_attributes()
         
         speech_output = random.choice(language_prompts["PLAY_OLDEST_EPISODE"])
         
-        audio_directive = PlayDirective(
-                            play_behavior = PlayBehavior.REPLACE_ALL, 
-                            audio_item = AudioItem(
-                                stream=Stream(
-                                    token=token,
-                                    url=url,
-                                    offset_in_milliseconds=offset,
-                                    ),
-                                metadata = AudioItemMetadata(
-                                    title = title,
-                                    subtitle = subtitle,
-                                    art = Image(
-                                        sources = [
-                                            ImageInstance(
-                                                url = create_presigned_url('Media/album_art.png')
-                                                )
-                                            ]
-                                        )
-                                    )
-                                )
-                            )
+        audio_directive = play_directive(playlist[index], index + 1, offset)
         return (
             handler_input.response_builder
                 .speak(speech_output)
@@ -211,58 +203,44 @@ class PlayOldestEpisodeIntentHandler(AbstractRequestHandler):
                 .response
             )
 
-class ChooseEpisodeIntentHandler(AbstractRequestHandler):
+class ChooseEpisodeIntentHandler(RoutedRequestHandler):
     
-    def can_handle(self, handler_input):
-        return is_intent_name("ChooseEpisodeIntent")(handler_input)
+    intent_names = ("ChooseEpisodeIntent",)
     
     def handle(self, handler_input):
         logger.info("In ChooseEpisodeIntentHandler")
         language_prompts = handler_input.attributes_manager.request_attributes["_"]
-        persistent_attributes = handler_input.attributes_manager.persistent_attributes
-        
-        token = handler_input.request_envelope.request.intent.slots["EpisodeNumber"].value
-        if token is None:
-            token = handler_input.request_envelope.request.intent.slots["OrdinalNumber"].value
-        if token is None:
+        persistent_attributes, catalog = load_request_state(handler_input, album_art = True)
+        
+        slots = handler_input.request_envelope.request.intent.slots
+        episode_number = slot_value(slots, "EpisodeNumber")
+        if episode_number is None:
+            episode_number = slot_value(slots, "OrdinalNumber")
+        episode_title = slot_value(slots, "EpisodeTitle")
+        if episode_number is None and episode_title:
+            track_index = get_title_index(catalog).search(episode_title)
+            if track_index is None:
+                speech_output = random.choice(language_prompts["EPISODE_TITLE_NOT_FOUND"]).format(episode_title)
+                reprompt = random.choice(language_prompts["CHOOSE_EPISODE_REPROMPT"])
+                return handler_input.response_builder.speak(speech_output).ask(reprompt).response
+            episode_number = str(track_index + 1)
+        if episode_number is None:
             speech_output = random.choice(language_prompts["CHOOSE_EPISODE"])
             reprompt = random.choice(language_prompts["CHOOSE_EPISODE_REPROMPT"])
             return handler_input.response_builder.speak(speech_output).ask(reprompt).response
         
-        playlist = populate_playlist_from_rss(rss_url)
-        index = int(token) - 1
-        url = playlist[index]['url']
+        playlist = catalog['episodes']
+        index = int(episode_number) - 1
+        token = playlist[index]['token']
         offset = 0
-        title = playlist[index]['title']
-        subtitle = "Episode {}".format(token)
         
-        persistent_attributes['playlist'] = playlist
-        persistent_attributes["playback_session_data"] = { 'index': index, 'token': token, 'url': url, 'offset': offset, 'title': title, 'loop': False, 'shuffle': False }
+        persistent_attributes.pop('shuffle_order', None)
+        persistent_attributes["playback_session_data"] = { 'catalog_version': catalog['version'], 'index': index, 'token': token, 'offset': offset, 'loop': False, 'shuffle': False }
         handler_input.attributes_manager.save_persistent_attributes()
         
-        speech_output = random.choice(language_prompts["PLAYING_CHOSEN_EPISODE"]).format(token)
-        
-        audio_directive = PlayDirective(
-                            play_behavior = PlayBehavior.REPLACE_ALL, 
-                            audio_item = AudioItem(
-                                stream=Stream(
-                                    token=token,
-                                    url=url,
-                                    offset_in_milliseconds=offset
-                                    ),
-                                metadata = AudioItemMetadata(
-                                    title = title,
-                                    subtitle = subtitle,
-                                    art = Image(
-                                        sources = [
-                                            ImageInstance(
-                                                url = create_presigned_url('Media/album_art.png')
-                                                )
-                                            ]
-                                        )
-                                    )
-                                )
-                            )
+        speech_output = random.choice(language_prompts["PLAYING_CHOSEN_EPISODE"]).format(episode_number)
+        
+        audio_directive = play_directive(playlist[index], index + 1, offset)
         return (
             handler_input.response_builder
                 .speak(speech_output)
@@ -271,13 +249,10 @@ class ChooseEpisodeIntentHandler(AbstractRequestHandler):
                 .response
             )
 
-class PauseIntentHandler(AbstractRequestHandler):
+class PauseIntentHandler(RoutedRequestHandler):
     
-    def can_handle(self, handler_input):
-        return (
-            is_request_type("PlaybackController.PauseCommandIssued")(handler_input) or
-            is_intent_name("AMAZON.PauseIntent")(handler_input)    
-            )
+    request_types = ("PlaybackController.PauseCommandIssued",)
+    intent_names = ("AMAZON.PauseIntent",)
     
     def handle(self, handler_input):
         logger.info("In PauseIntentHandler")
@@ -290,63 +265,35 @@ class PauseIntentHandler(AbstractRequestHandler):
                 .response
             )
 
-class ResumeIntentHandler(AbstractRequestHandler):
+class ResumeIntentHandler(RoutedRequestHandler):
     
-    def can_handle(self, handler_input):
-        return (
-            is_intent_name("AMAZON.ResumeIntent")(handler_input) or
-            is_intent_name("AMAZON.YesIntent")(handler_input) or
-            is_request_type("PlaybackController.PlayCommandIssued")(handler_input)
-            )
+    request_types = ("PlaybackController.PlayCommandIssued",)
+    intent_names = ("AMAZON.ResumeIntent", "AMAZON.YesIntent")
     
     def handle(self, handler_input):
         logger.info("In ResumeIntentHandler")
         language_prompts = handler_input.attributes_manager.request_attributes["_"]
-        persistent_attributes = handler_input.attributes_manager.persistent_attributes
+        persistent_attributes, catalog = load_request_state(handler_input, album_art = True)
         
         if persistent_attributes.get("playback_session_data") is not None:
-            token = persistent_attributes["playback_session_data"]['token']
-            url = persistent_attributes["playback_session_data"]['url']
-            offset = persistent_attributes["playback_session_data"]["offset"]
-            title = persistent_attributes["playback_session_data"]["title"]
-            subtitle = "Episode {}".format(token)
+            playlist = catalog['episodes']
+            playback_session_data = sync_playback_session(persistent_attributes, catalog)
+            index = get_catalog_index(int(playback_session_data["index"]), persistent_attributes.get('shuffle_order'))
+            offset = playback_session_data["offset"]
 
         else:
-            playlist = populate_playlist_from_rss(rss_url)
+            playlist = catalog['episodes']
             index = len(playlist) - 1
             token = playlist[index]['token']
-            url = playlist[index]['url']
             offset = 0
-            title = playlist[index]['title']
-            subtitle = "Episode {}".format(token)
             
             handler_input.response_builder.speak(random.choice(language_prompts["PLAY_LATEST_EPISODE"]))
             
-            persistent_attributes['playlist'] = playlist
-            persistent_attributes["playback_session_data"] = { 'index': index, 'token': token, 'url': url,'offset': offset, 'title': title, 'loop': False, 'shuffle': False }
+            persistent_attributes.pop('shuffle_order', None)
+            persistent_attributes["playback_session_data"] = { 'catalog_version': catalog['version'], 'index': index, 'token': token, 'offset': offset, 'loop': False, 'shuffle': False }
             handler_input.attributes_manager.save_persistent_attributes()
         
-        audio_directive = PlayDirective(
-                            play_behavior = PlayBehavior.REPLACE_ALL, 
-                            audio_item = AudioItem(
-                                stream=Stream(
-                                    token=token,
-                                    url=url,
-                                    offset_in_milliseconds=offset
-                                    ),
-                                metadata = AudioItemMetadata(
-                                    title = title,
-                                    subtitle = subtitle,
-                                    art = Image(
-                                        sources = [
-                                            ImageInstance(
-                                                url = create_presigned_url('Media/album_art.png')
-                                                )
-                                            ]
-                                        )
-                                    )
-                                )
-                            )
+        audio_directive = play_directive(playlist[index], index + 1, offset)
         return (
             handler_input.response_builder
                 .add_directive(audio_directive)
@@ -354,51 +301,27 @@ class ResumeIntentHandler(AbstractRequestHandler):
                 .response
             )
 
-class NoIntentHandler(AbstractRequestHandler):
+class NoIntentHandler(RoutedRequestHandler):
     
-    def can_handle(self, handler_input):
-        return is_intent_name("AMAZON.NoIntent")(handler_input)
+    intent_names = ("AMAZON.NoIntent",)
     
     def handle(self, handler_input):
         logger.info("In NoIntentHandler")
         language_prompts = handler_input.attributes_manager.request_attributes["_"]
-        persistent_attributes = handler_input.attributes_manager.persistent_attributes
+        persistent_attributes, catalog = load_request_state(handler_input, album_art = True)
         
-        playlist = populate_playlist_from_rss(rss_url)
+        playlist = catalog['episodes']
         index = len(playlist) - 1
         token = playlist[index]['token']
-        url = playlist[index]['url']
         offset = 0
-        title = playlist[index]['title']
-        subtitle = "Episode {}".format(token)
         
         speech_output = random.choice(language_prompts["PLAY_LATEST_EPISODE"])
         
-        persistent_attributes['playlist'] = playlist
-        persistent_attributes["playback_session_data"] = { 'index': index, 'token': token, 'url': url,'offset': offset, 'title': title, 'loop': False, 'shuffle': False }
+        persistent_attributes.pop('shuffle_order', None)
+        persistent_attributes["playback_session_data"] = { 'catalog_version': catalog['version'], 'index': index, 'token': token, 'offset': offset, 'loop': False, 'shuffle': False }
         handler_input.attributes_manager.save_persistent_attributes()
 
-        audio_directive = PlayDirective(
-                            play_behavior = PlayBehavior.REPLACE_ALL, 
-                            audio_item = AudioItem(
-                                stream = Stream(
-                                    token = token,
-                                    url = url,
-                                    offset_in_milliseconds = offset
-                                    ),
-                                metadata = AudioItemMetadata(
-                                    title = title,
-                                    subtitle = subtitle,
-                                    art = Image(
-                                        sources = [
-                                            ImageInstance(
-                                                url = create_presigned_url('Media/album_art.png')
-                                                )
-                                            ]
-                                        )
-                                    )
-                                )
-                            )
+        audio_directive = play_directive(playlist[index], index + 1, offset)
         return (
             handler_input.response_builder
                 .speak(speech_output)
@@ -407,22 +330,21 @@ class NoIntentHandler(AbstractRequestHandler):
                 .response
             )
 
-class NextIntentHandler(AbstractRequestHandler):
+class NextIntentHandler(RoutedRequestHandler):
     
-    def can_handle(self, handler_input):
-        return ( 
-            is_intent_name("AMAZON.NextIntent")(handler_input) or
-            is_request_type("PlaybackController.NextCommandIssued")(handler_input)
-            )
+    request_types = ("PlaybackController.NextCommandIssued",)
+    intent_names = ("AMAZON.NextIntent",)
     
     def handle(self, handler_input):
         logger.info("In NextIntentHandler")
         language_prompts = handler_input.attributes_manager.request_attributes["_"]
-        persistent_attributes = handler_input.attributes_manager.persistent_attributes
+        persistent_attributes, catalog = load_request_state(handler_input, album_art = True)
         
-        playlist = persistent_attributes['playlist']
-        loop = persistent_attributes["playback_session_data"]["loop"]
-        index = int(persistent_attributes["playback_session_data"]["index"])
+        playlist = catalog['episodes']
+        shuffle_order = persistent_attributes.get('shuffle_order')
+        playback_session_data = sync_playback_session(persistent_attributes, catalog)
+        loop = playback_session_data["loop"]
+        index = int(playback_session_data["index"])
         
         if index != len(playlist) - 1:
             index += 1
@@ -432,36 +354,14 @@ class NextIntentHandler(AbstractRequestHandler):
             speech_output = random.choice(language_prompts["END_OF_PLAYLIST"])
             return handler_input.response_builder.speak(speech_output).set_should_end_session(True).response
         
-        token = playlist[index]['token']
-        url = playlist[index]['url']
+        track_index = get_catalog_index(index, shuffle_order)
+        token = playlist[track_index]['token']
         offset = 0
-        title = playlist[index]['title']
-        subtitle = "Episode {}".format(token)
         
-        persistent_attributes["playback_session_data"].update({ 'index': index, 'token': token, 'url': url, 'offset': offset, 'title': title })
+        playback_session_data.update({ 'index': index, 'token': token, 'offset': offset })
         handler_input.attributes_manager.save_persistent_attributes()        
 
-        audio_directive = PlayDirective(
-                            play_behavior = PlayBehavior.REPLACE_ALL, 
-                            audio_item = AudioItem(
-                                stream = Stream(
-                                    token = token,
-                                    url = url,
-                                    offset_in_milliseconds = offset
-                                    ),
-                                metadata = AudioItemMetadata(
-                                    title = title,
-                                    subtitle = subtitle,
-                                    art = Image(
-                                        sources = [
-                                            ImageInstance(
-                                                url = create_presigned_url('Media/album_art.png')
-                                                )
-                                            ]
-                                        )
-                                    )
-                                )
-                            )
+        audio_directive = play_directive(playlist[track_index], track_index + 1, offset)
 
         return (
             handler_input.response_builder
@@ -470,22 +370,21 @@ class NextIntentHandler(AbstractRequestHandler):
                 .response
             )
 
-class PreviousIntentHandler(AbstractRequestHandler):
+class PreviousIntentHandler(RoutedRequestHandler):
     
-    def can_handle(self, handler_input):
-        return (
-            is_intent_name("AMAZON.PreviousIntent")(handler_input) or
-            is_request_type("PlaybackController.PreviousCommandIssued")(handler_input)
-            )
+    request_types = ("PlaybackController.PreviousCommandIssued",)
+    intent_names = ("AMAZON.PreviousIntent",)
     
     def handle(self, handler_input):
         logger.info("In PreviousIntentHandler")
         language_prompts = handler_input.attributes_manager.request_attributes["_"]
-        persistent_attributes = handler_input.attributes_manager.persistent_attributes
+        persistent_attributes, catalog = load_request_state(handler_input, album_art = True)
         
-        playlist = persistent_attributes['playlist']
-        loop = persistent_attributes["playback_session_data"]["loop"]
-        index = int(persistent_attributes["playback_session_data"]["index"])
+        playlist = catalog['episodes']
+        shuffle_order = persistent_attributes.get('shuffle_order')
+        playback_session_data = sync_playback_session(persistent_attributes, catalog)
+        loop = playback_session_data["loop"]
+        index = int(playback_session_data["index"])
         
         if index != 0:
             index -= 1
@@ -495,36 +394,14 @@ class PreviousIntentHandler(AbstractRequestHandler):
             speech_output = speech_output = random.choice(language_prompts["START_OF_PLAYLIST"])
             return handler_input.response_builder.speak(speech_output).set_should_end_session(True).response
         
-        token = playlist[index]['token']
-        url = playlist[index]['url']
+        track_index = get_catalog_index(index, shuffle_order)
+        token = playlist[track_index]['token']
         offset = 0
-        title = playlist[index]['title']
-        subtitle = "Episode {}".format(token)
         
-        persistent_attributes["playback_session_data"].update({ 'index': index, 'token': token, 'url': url, 'offset': offset, 'title': title})
+        playback_session_data.update({ 'index': index, 'token': token, 'offset': offset })
         handler_input.attributes_manager.save_persistent_attributes()        
 
-        audio_directive = PlayDirective(
-                            play_behavior = PlayBehavior.REPLACE_ALL, 
-                            audio_item = AudioItem(
-                                stream = Stream(
-                                    token = token,
-                                    url = url,
-                                    offset_in_milliseconds = offset,
-                                    ),
-                                metadata = AudioItemMetadata(
-                                    title = title,
-                                    subtitle = subtitle,
-                                    art = Image(
-                                        sources = [
-                                            ImageInstance(
-                                                url = create_presigned_url('Media/album_art.png')
-                                                )
-                                            ]
-                                        )
-                                    )
-                                )
-                            )
+        audio_directive = play_directive(playlist[track_index], track_index + 1, offset)
 
         return (
             handler_input.response_builder
@@ -533,46 +410,21 @@ class PreviousIntentHandler(AbstractRequestHandler):
                 .response
             )
 
-class RepeatIntentHandler(AbstractRequestHandler):
+class RepeatIntentHandler(RoutedRequestHandler):
     
-    def can_handle(self, handler_input):
-        return (is_intent_name("AMAZON.RepeatIntent")(handler_input) or
-                is_intent_name("AMAZON.StartOverIntent")(handler_input))
+    intent_names = ("AMAZON.RepeatIntent", "AMAZON.StartOverIntent")
     
     def handle(self, handler_input):
         logger.info("In RepeatIntentHandler")
         language_prompts = handler_input.attributes_manager.request_attributes["_"]
-        persistent_attributes = handler_input.attributes_manager.persistent_attributes
+        persistent_attributes, catalog = load_request_state(handler_input, album_art = True)
         
-        playlist = persistent_attributes['playlist']
-        index = int(persistent_attributes["playback_session_data"]["index"])
-        token = persistent_attributes['playlist'][index]['token']
-        url = persistent_attributes['playlist'][index]['url']
+        playlist = catalog['episodes']
+        playback_session_data = sync_playback_session(persistent_attributes, catalog)
+        index = get_catalog_index(int(playback_session_data["index"]), persistent_attributes.get('shuffle_order'))
         offset = 0
-        title = persistent_attributes['playlist'][index]['title']
-        subtitle = "Episode {}".format(token)
-        
-        audio_directive = PlayDirective(
-                            play_behavior = PlayBehavior.REPLACE_ALL, 
-                            audio_item = AudioItem(
-                                stream=Stream(
-                                    token=token,
-                                    url=url,
-                                    offset_in_milliseconds=offset,
-                                    ),
-                                metadata = AudioItemMetadata(
-                                    title = title,
-                                    subtitle = subtitle,
-                                    art = Image(
-                                        sources = [
-                                            ImageInstance(
-                                                url = create_presigned_url('Media/album_art.png')
-                                                )
-                                            ]
-                                        )
-                                    )
-                                )
-                            )
+        
+        audio_directive = play_directive(playlist[index], index + 1, offset)
 
         return (
             handler_input.response_builder
@@ -581,22 +433,20 @@ class RepeatIntentHandler(AbstractRequestHandler):
                 .response
             )
 
-class ShuffleOnIntentHandler(AbstractRequestHandler):
+class ShuffleOnIntentHandler(RoutedRequestHandler):
     
-    def can_handle(self, handler_input):
-        return is_intent_name("AMAZON.ShuffleOnIntent")(handler_input)
+    intent_names = ("AMAZON.ShuffleOnIntent",)
     
     def handle(self, handler_input):
         logger.info("In ShuffleOnIntentHandler")
         language_prompts = handler_input.attributes_manager.request_attributes["_"]
-        persistent_attributes = handler_input.attributes_manager.persistent_attributes
+        persistent_attributes, catalog = load_request_state(handler_input)
         
-        index = int(persistent_attributes["playback_session_data"]["index"])
-        old_playlist = persistent_attributes['playlist']
-        new_playlist = shuffle_playlist(index, old_playlist)
+        playback_session_data = sync_playback_session(persistent_attributes, catalog)
+        index = get_catalog_index(int(playback_session_data["index"]), persistent_attributes.get('shuffle_order'))
         
-        persistent_attributes['playlist'] = new_playlist
-        persistent_attributes["playback_session_data"].update({"index": 0, "shuffle": True })
+        persistent_attributes['shuffle_order'] = shuffle_playlist(index, len(catalog['episodes']))
+        playback_session_data.update({"index": 0, "shuffle": True })
         handler_input.attributes_manager.save_persistent_attributes()
         
         speech_output = random.choice(language_prompts["SHUFFLE_ON"])
@@ -608,20 +458,17 @@ class ShuffleOnIntentHandler(AbstractRequestHandler):
                 .response
             )
 
-class ShuffleOffIntentHandler(AbstractRequestHandler):
+class ShuffleOffIntentHandler(RoutedRequestHandler):
     
-    def can_handle(self, handler_input):
-        return is_intent_name("AMAZON.ShuffleOffIntent")(handler_input)
+    intent_names = ("AMAZON.ShuffleOffIntent",)
     
     def handle(self, handler_input):
         logger.info("In ShuffleOffIntentHandler")
         language_prompts = handler_input.attributes_manager.request_attributes["_"]
         persistent_attributes = handler_input.attributes_manager.persistent_attributes
         
-        token = persistent_attributes["playback_session_data"]["token"]
-        index = int(token) - 1
-        playlist = populate_playlist_from_rss(rss_url)
-        persistent_attributes['playlist'] = playlist
+        index = int(persistent_attributes["playback_session_data"]["index"])
+        index = get_catalog_index(index, persistent_attributes.pop('shuffle_order', None))
         persistent_attributes["playback_session_data"].update({"index": index, "shuffle": False})
         handler_input.attributes_manager.save_persistent_attributes()
         
@@ -634,10 +481,9 @@ class ShuffleOffIntentHandler(AbstractRequestHandler):
                 .response
             )
 
-class LoopOnIntentHandler(AbstractRequestHandler):
+class LoopOnIntentHandler(RoutedRequestHandler):
     
-    def can_handle(self, handler_input):
-        return is_intent_name("AMAZON.LoopOnIntent")(handler_input)
+    intent_names = ("AMAZON.LoopOnIntent",)
     
     def handle(self, handler_input):
         logger.info("In LoopOnIntentHandler")
@@ -656,10 +502,9 @@ class LoopOnIntentHandler(AbstractRequestHandler):
                 .response
             )
 
-class LoopOffIntentHandler(AbstractRequestHandler):
+class LoopOffIntentHandler(RoutedRequestHandler):
     
-    def can_handle(self, handler_input):
-        return is_intent_name("AMAZON.LoopOffIntent")(handler_input)
+    intent_names = ("AMAZON.LoopOffIntent",)
     
     def handle(self, handler_input):
         logger.info("In LoopOffIntentHandler")
@@ -678,161 +523,146 @@ class LoopOffIntentHandler(AbstractRequestHandler):
                 .response
             )
 
-class PlaybackStartedEventHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return is_request_type("AudioPlayer.PlaybackStarted")(handler_input)
+class PlaybackStartedEventHandler(RoutedRequestHandler):
+    request_types = ("AudioPlayer.PlaybackStarted",)
     
     def handle(self, handler_input):
         logger.info("In PlaybackStartedEventHandler")
-        persistent_attributes = handler_input.attributes_manager.persistent_attributes
+        persistent_attributes, catalog = load_request_state(handler_input)
         audio_player_attributes = handler_input.request_envelope.request
         
-        playlist = persistent_attributes['playlist']
         token = audio_player_attributes.token
-        index = int(get_track_index(token, playlist))
-        url = playlist[index]['url']
+        track_index = get_track_index(token, catalog, persistent_attributes)
+        if track_index is None:
+            logger.info("Stream token {} is not in the catalog".format(token))
+            return handler_input.response_builder.response
+        index = get_play_position(track_index, persistent_attributes.get('shuffle_order'))
         offset = audio_player_attributes.offset_in_milliseconds
-        title = playlist[index]['title']
         
-        persistent_attributes["playback_session_data"].update({ 'index': index, 'token': token, 'url': url, 'offset': offset, 'title': title})
+        persistent_attributes["playback_session_data"].update({ 'catalog_version': catalog['version'], 'index': index, 'token': token, 'offset': offset })
         handler_input.attributes_manager.save_persistent_attributes()
         
         return handler_input.response_builder.response
 
-class PlaybackStoppedEventHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return is_request_type("AudioPlayer.PlaybackStopped")(handler_input)
+class PlaybackStoppedEventHandler(RoutedRequestHandler):
+    request_types = ("AudioPlayer.PlaybackStopped",)
     
     def handle(self, handler_input):
         logger.info("In PlaybackStoppedEventHandler")
-        persistent_attributes = handler_input.attributes_manager.persistent_attributes
+        persistent_attributes, catalog = load_request_state(handler_input)
         audio_player_attributes = handler_input.request_envelope.request
         
-        playlist = persistent_attributes['playlist']
         token = audio_player_attributes.token
-        index = int(get_track_index(token, playlist))
-        url = playlist[index]['url']
+        track_index = get_track_index(token, catalog, persistent_attributes)
+        if track_index is None:
+            logger.info("Stream token {} is not in the catalog".format(token))
+            return handler_input.response_builder.response
+        index = get_play_position(track_index, persistent_attributes.get('shuffle_order'))
         offset = audio_player_attributes.offset_in_milliseconds
-        title = playlist[index]['title']
         
-        persistent_attributes["playback_session_data"].update({ 'index': index, 'token': token, 'url': url, 'offset': offset, 'title': title})
+        persistent_attributes["playback_session_data"].update({ 'catalog_version': catalog['version'], 'index': index, 'token': token, 'offset': offset })
         handler_input.attributes_manager.save_persistent_attributes()
 
         return handler_input.response_builder.response
 
-class PlaybackNearlyFinishedEventHandler(AbstractRequestHandler):
+class PlaybackNearlyFinishedEventHandler(RoutedRequestHandler):
     
-    def can_handle(self, handler_input):
-        return is_request_type("AudioPlayer.PlaybackNearlyFinished")(handler_input)
+    request_types = ("AudioPlayer.PlaybackNearlyFinished",)
     
     def handle(self, handler_input):
         logger.info("In PlaybackNearlyFinishedEventHandler")
         language_prompts = handler_input.attributes_manager.request_attributes["_"]
-        persistent_attributes = handler_input.attributes_manager.persistent_attributes
-
-        playlist = persistent_attributes['playlist']
-        loop = persistent_attributes["playback_session_data"]["loop"]
-        index = int(persistent_attributes["playback_session_data"]["index"])
-        old_token = playlist[index]['token']
-        
-        if index != len(playlist) - 1:
-            index += 1
-        elif (index == len(playlist) - 1) and loop:
-            index = 0
+        persistent_attributes, catalog = load_request_state(handler_input, album_art = True)
+
+        playlist = catalog['episodes']
+        shuffle_order = persistent_attributes.get('shuffle_order')
+        playback_session_data = sync_playback_session(persistent_attributes, catalog)
+        loop = playback_session_data["loop"]
+        index = int(playback_session_data["index"])
+        # The token of the stream that is playing, which is no longer in the
+        # catalog when its episode has been removed
+        old_token = handler_input.request_envelope.request.token
+        
+        # Episodes whose enclosure the refresher found broken are skipped
+        for _ in range(len(playlist)):
+            if index != len(playlist) - 1:
+                index += 1
+            elif (index == len(playlist) - 1) and loop:
+                index = 0
+            else:
+                return handler_input.response_builder.response
+
+            track_index = get_catalog_index(index, shuffle_order)
+            if not is_broken(playlist[track_index]):
+                break
+            logger.info("Skipping episode {} with a broken enclosure".format(playlist[track_index]['token']))
         else:
             return handler_input.response_builder.response
-        
-        new_token = playlist[index]['token']
-        url = playlist[index]['url']
         offset = 0
-        title = playlist[index]['title']
-        subtitle = "Episode {}".format(new_token)
-
-        audio_directive = PlayDirective(
-                            play_behavior = PlayBehavior.ENQUEUE, 
-                            audio_item = AudioItem(
-                                stream = Stream(
-                                    token = new_token,
-                                    url = url,
-                                    offset_in_milliseconds = offset,
-                                    expected_previous_token = old_token
-                                    ),
-                                metadata = AudioItemMetadata(
-                                    title = title,
-                                    subtitle = subtitle,
-                                    art = Image(
-                                        sources = [
-                                            ImageInstance(
-                                                url = create_presigned_url('Media/album_art.png')
-                                                )
-                                            ]
-                                        )
-                                    )
-                                )
-                            )
+
+        audio_directive = play_directive(playlist[track_index], track_index + 1, offset,
+                                         play_behavior = PlayBehavior.ENQUEUE,
+                                         expected_previous_token = old_token)
         return (
             handler_input.response_builder
                 .add_directive(audio_directive)
                 .response
             )
 
-class PlaybackFinishedEventHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return is_request_type("AudioPlayer.PlaybackFinished")(handler_input)
-
+class PlaybackFinishedEventHandler(RoutedRequestHandler):
+    request_types = ("AudioPlayer.PlaybackFinished",)
+    
     def handle(self, handler_input):
         logger.info("In PlaybackFinishedEventHandler")
-        persistent_attributes = handler_input.attributes_manager.persistent_attributes
+        persistent_attributes, catalog = load_request_state(handler_input)
         audio_player_attributes = handler_input.request_envelope.request
         
-        playlist = persistent_attributes['playlist']
         token = audio_player_attributes.token
-        index = int(get_track_index(token, playlist))
-        url = playlist[index]['url']
+        track_index = get_track_index(token, catalog, persistent_attributes)
+        if track_index is None:
+            logger.info("Stream token {} is not in the catalog".format(token))
+            return handler_input.response_builder.response
+        index = get_play_position(track_index, persistent_attributes.get('shuffle_order'))
         offset = audio_player_attributes.offset_in_milliseconds
-        title = playlist[index]['title']
         
-        persistent_attributes["playback_session_data"].update({ 'index': index, 'token': token, 'url': url, 'offset': offset, 'title': title})
+        persistent_attributes["playback_session_data"].update({ 'catalog_version': catalog['version'], 'index': index, 'token': token, 'offset': offset })
         handler_input.attributes_manager.save_persistent_attributes()
 
         return handler_input.response_builder.response
 
 
-class PlaybackFailedEventHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return is_request_type("AudioPlayer.PlaybackFailed")(handler_input)
+class PlaybackFailedEventHandler(RoutedRequestHandler):
+    request_types = ("AudioPlayer.PlaybackFailed",)
     
     def handle(self,handler_input):
         logger.info("In PlaybackFailedEventHandler")
-        persistent_attributes = handler_input.attributes_manager.persistent_attributes
+        persistent_attributes, catalog = load_request_state(handler_input)
         audio_player_attributes = handler_input.request_envelope.request
         
-        playlist = persistent_attributes['playlist']
         token = audio_player_attributes.current_playback_state.token
-        index = int(get_track_index(token, playlist))
-        url = playlist[index]['url']
+        track_index = get_track_index(token, catalog, persistent_attributes)
+        if track_index is None:
+            logger.info("Stream token {} is not in the catalog".format(token))
+            return handler_input.response_builder.response
+        index = get_play_position(track_index, persistent_attributes.get('shuffle_order'))
         offset = audio_player_attributes.current_playback_state.offset_in_milliseconds
-        title = playlist[index]['title']
         
-        persistent_attributes["playback_session_data"].update({ 'index': index, 'token': token, 'url': url, 'offset': offset, 'title': title})
+        persistent_attributes["playback_session_data"].update({ 'catalog_version': catalog['version'], 'index': index, 'token': token, 'offset': offset })
         handler_input.attributes_manager.save_persistent_attributes()
 
         logger.info("Playback Failed: {}".format(handler_input.request_envelope.request.error))
         return handler_input.response_builder.response
 
 # Handler to handle exceptions from responses sent by AudioPlayer request.
-class ExceptionEncounteredHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return is_request_type("System.ExceptionEncountered")(handler_input)
-
+class ExceptionEncounteredHandler(RoutedRequestHandler):
+    request_types = ("System.ExceptionEncountered",)
+    
     def handle(self, handler_input):
         logger.info("System exception encountered: {}".format(handler_input.request_envelope.request))
         return handler_input.response_builder.response
 
-class CancelOrStopIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return (is_intent_name("AMAZON.CancelIntent")(handler_input) or
-                is_intent_name("AMAZON.StopIntent")(handler_input))
+class CancelOrStopIntentHandler(RoutedRequestHandler):
+    intent_names = ("AMAZON.CancelIntent", "AMAZON.StopIntent")
     
     def handle(self, handler_input):
         logger.info("In CancelOrStopIntentHandler")
@@ -849,9 +679,8 @@ class CancelOrStopIntentHandler(AbstractRequestHandler):
                 .response
             )
 
-class HelpIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return is_intent_name("AMAZON.HelpIntent")(handler_input)
+class HelpIntentHandler(RoutedRequestHandler):
+    intent_names = ("AMAZON.HelpIntent",)
     
     def handle(self, handler_input):
         logger.info("In HelpIntentHandler")
@@ -869,9 +698,8 @@ class HelpIntentHandler(AbstractRequestHandler):
             )
 
 # This handler handles utterances that can't be matched to any other intent handler.
-class FallbackIntentHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return is_intent_name("AMAZON.FallbackIntent")(handler_input)
+class FallbackIntentHandler(RoutedRequestHandler):
+    intent_names = ("AMAZON.FallbackIntent",)
     
     def handle(self, handler_input):
         logger.info("In FallbackIntentHandler")
@@ -887,9 +715,8 @@ class FallbackIntentHandler(AbstractRequestHandler):
                 .response
             )
 
-class SessionEndedRequestHandler(AbstractRequestHandler):
-    def can_handle(self, handler_input):
-        return is_request_type("SessionEndedRequest")(handler_input)
+class SessionEndedRequestHandler(RoutedRequestHandler):
+    request_types = ("SessionEndedRequest",)
     
     def handle(self, handler_input):
         logger.info("Session ended with the reason: {}".format(handler_input.request_envelope.request.reason))
@@ -897,6 +724,26 @@ class SessionEndedRequestHandler(AbstractRequestHandler):
 
 # Exception Handlers
 
+# Tells the user the episode list is unreachable when no catalog can be loaded
+class CatalogUnavailableExceptionHandler(AbstractExceptionHandler):
+
+    def can_handle(self, handler_input, exception):
+        return isinstance(exception, CatalogUnavailableError)
+
+    def handle(self, handler_input, exception):
+        logger.error(exception)
+        finish_invocation(error=True)
+
+        language_prompts = handler_input.attributes_manager.request_attributes["_"]
+        speech_output = language_prompts["CATALOG_UNAVAILABLE"]
+
+        return (
+            handler_input.response_builder
+                .speak(speech_output)
+                .set_should_end_session(True)
+                .response
+            )
+
 # This exception handler handles syntax or routing errors. If you receive an error stating 
 # the request handler is not found, you have not implemented a handler for the intent or 
 # included it in the skill builder below
@@ -907,6 +754,8 @@ class CatchAllExceptionHandler(AbstractExceptionHandler):
     
     def handle(self, handler_input, exception):
         logger.error(exception, exc_info=True)
+        # Response interceptors are skipped after an exception
+        finish_invocation(error=True)
         
         language_prompts = handler_input.attributes_manager.request_attributes["_"]
         
@@ -944,11 +793,10 @@ class LocalizationInterceptor(AbstractRequestInterceptor):
         #logger.info("Locale is {}".format(locale))
         
         try:
-            with open("languages/"+str(locale)+".json") as language_data:
-                language_prompts = json.load(language_data)
-        except:
-            with open("languages/"+ str(locale[:2]) +".json") as language_data:
-                language_prompts = json.load(language_data)
+            language_prompts = locale_prompts[locale]
+        except KeyError:
+            # A locale Alexa added after alexa_locales was written
+            language_prompts = locale_prompts[str(locale)[:2]]
         
         handler_input.attributes_manager.request_attributes["_"] = language_prompts
 
@@ -956,7 +804,7 @@ class LocalizationInterceptor(AbstractRequestInterceptor):
 # Define a skill builder instance and add all the request handlers,
 # exception handlers and interceptors to it.
 
-sb = CustomSkillBuilder(persistence_adapter = dynamodb_adapter)
+sb = RoutingSkillBuilder(persistence_adapter = dynamodb_adapter)
 sb.add_request_handler(CheckAudioInterfaceHandler())
 sb.add_request_handler(LaunchRequestHandler())
 sb.add_request_handler(PlayNewestEpisodeIntentHandler())
@@ -983,10 +831,13 @@ sb.add_request_handler(HelpIntentHandler())
 sb.add_request_handler(FallbackIntentHandler())
 sb.add_request_handler(SessionEndedRequestHandler())
 
+sb.add_exception_handler(CatalogUnavailableExceptionHandler())
 sb.add_exception_handler(CatchAllExceptionHandler())
 
+sb.add_global_request_interceptor(MetricsRequestInterceptor())
 sb.add_global_request_interceptor(LocalizationInterceptor())
 sb.add_global_request_interceptor(RequestLogger())
 sb.add_global_response_interceptor(ResponseLogger())
+sb.add_global_response_interceptor(MetricsResponseInterceptor())
 
 lambda_handler = sb.lambda_handler()
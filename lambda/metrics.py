@@ -0,0 +1,146 @@
+from ask_sdk_core.dispatch_components import AbstractRequestInterceptor, AbstractResponseInterceptor
+from contextlib import contextmanager
+from functools import wraps
+
+import json
+import os
+import sys
+import threading
+import time
+
+# Per-invocation latency breakdown, written to stdout as one CloudWatch Embedded
+# Metric Format (EMF) record per request. CloudWatch Logs extracts the metrics from
+# the log line itself, so publishing them costs no API calls.
+#
+# Each record has the handler that served the request and whether it was the
+# container's first invocation as dimensions, the total time, and the time spent
+# in each phase that ran: RssFetch, FeedParse, CatalogRead, DynamoDbGet,
+# DynamoDbSave, Presign and EnclosureProbe. A phase that ran more than once is summed. Set
+# METRICS_ENABLED=false to turn the records off.
+metrics_namespace = os.environ.get('METRICS_NAMESPACE', 'PodcastSkill')
+metrics_enabled = os.environ.get('METRICS_ENABLED', 'true').lower() != 'false'
+
+# Where records are written. Lambda forwards stdout to CloudWatch Logs.
+metrics_stream = sys.stdout
+
+# Keeps the records of concurrent invocations (webservice.py) on lines of their own
+_stream_lock = threading.Lock()
+
+# True until the first invocation of this container has been recorded
+cold_start = True
+
+# The invocation being measured, kept per thread so concurrent requests in one
+# process each get their own breakdown. `current` is None between invocations.
+class InvocationLocal(threading.local):
+    current = None
+
+_invocation = InvocationLocal()
+
+# Guards the phase totals of invocations that fan out to several threads
+_phases_lock = threading.Lock()
+
+def start_invocation(request_id=None):
+    _invocation.current = {
+        'start': time.perf_counter(),
+        'request_id': request_id,
+        'handler': None,
+        'phases': {}
+    }
+
+def record_handler(name):
+    current = _invocation.current
+    if current is not None:
+        current['handler'] = name
+
+# Adds the time spent in the block to `phase` of the current invocation. Outside
+# of an invocation nothing is recorded. Phases that ran concurrently (see
+# fanout.py) are each counted in full.
+@contextmanager
+def timed(phase):
+    current = _invocation.current
+    if current is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        with _phases_lock:
+            phases = current['phases']
+            phases[phase] = phases.get(phase, 0.0) + duration
+
+# Wraps `function` to run in another thread as part of the current invocation, so
+# the phases it times are added to this invocation's record.
+def bind_invocation(function):
+    current = _invocation.current
+
+    def bound(*args, **kwargs):
+        _invocation.current = current
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _invocation.current = None
+    return bound
+
+# Decorator form of timed()
+def timed_phase(phase):
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timed(phase):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Writes the record of the current invocation and ends it
+def finish_invocation(error=False):
+    global cold_start
+    current = _invocation.current
+    if current is None:
+        return
+    _invocation.current = None
+    total = time.perf_counter() - current['start']
+    was_cold = cold_start
+    cold_start = False
+    if metrics_enabled:
+        line = json.dumps(emf_record(current, total, was_cold, error)) + '\n'
+        with _stream_lock:
+            metrics_stream.write(line)
+            metrics_stream.flush()
+
+def emf_record(invocation, total, cold, error):
+    metrics = [{'Name': 'TotalTime', 'Unit': 'Milliseconds'}, {'Name': 'Error', 'Unit': 'Count'}]
+    record = {
+        'Handler': invocation['handler'] or 'Unhandled',
+        'ColdStart': 'true' if cold else 'false',
+        'RequestId': invocation['request_id'],
+        'TotalTime': round(total * 1e3, 3),
+        'Error': 1 if error else 0
+    }
+    for phase, duration in sorted(invocation['phases'].items()):
+        metrics.append({'Name': phase, 'Unit': 'Milliseconds'})
+        record[phase] = round(duration * 1e3, 3)
+    record['_aws'] = {
+        'Timestamp': int(time.time() * 1000),
+        'CloudWatchMetrics': [{
+            'Namespace': metrics_namespace,
+            'Dimensions': [['Handler', 'ColdStart']],
+            'Metrics': metrics
+        }]
+    }
+    return record
+
+# Register first among the request interceptors so the total includes the others
+class MetricsRequestInterceptor(AbstractRequestInterceptor):
+
+    def process(self, handler_input):
+        start_invocation(handler_input.request_envelope.request.request_id)
+
+# Register last among the response interceptors. Requests that end in an
+# exception skip the response interceptors, so the exception handler finishes
+# those itself with finish_invocation(error=True).
+class MetricsResponseInterceptor(AbstractResponseInterceptor):
+
+    def process(self, handler_input, response):
+        finish_invocation()
@@ -0,0 +1,526 @@
+from ask_sdk_core.attributes_manager import AbstractPersistenceAdapter
+from ask_sdk_core.exceptions import PersistenceException
+from ask_sdk_dynamodb.partition_keygen import user_id_partition_keygen
+from collections import OrderedDict
+from decimal import Decimal
+from metrics import timed_phase
+from catalog_codec import encode_catalog, decode_catalog, binary_value
+from utils import shuffle_playlist, aws_client_lock
+
+import feeds
+import logging
+import os
+import copy
+import json
+import threading
+import time
+
+# Defining the database region, table name and dynamodb resource. The resource, and
+# boto3 with it, is created by the first request that reads or writes the table,
+# so requests that never do (Help, Cancel, ...) do not pay for it at cold start.
+#
+# boto3 resources are not safe to share between threads, and requests are served
+# from several: the fanout.py I/O pool, and the request workers of webservice.py.
+# Each thread gets a resource of its own, with its own connection, the first time
+# it uses the table. Setting ddb_resource shares that one resource instead.
+ddb_region = os.environ.get('DYNAMODB_PERSISTENCE_REGION')
+ddb_table_name = os.environ.get('DYNAMODB_PERSISTENCE_TABLE_NAME')
+ddb_resource = None
+_thread_resources = threading.local()
+
+def get_ddb_resource():
+    if ddb_resource is not None:
+        return ddb_resource
+    resource = getattr(_thread_resources, 'resource', None)
+    if resource is None:
+        with aws_client_lock:
+            import boto3
+            resource = boto3.resource('dynamodb', region_name=ddb_region)
+        _thread_resources.resource = resource
+    return resource
+
+# Number of milliseconds the stored playback offset may lag behind the reported one
+# before an offset-only change is written. Override with OFFSET_WRITE_GRANULARITY_MS.
+offset_write_granularity = int(os.environ.get('OFFSET_WRITE_GRANULARITY_MS', 5000))
+
+# Number of times a conflicting write is re-applied on top of the newer item
+# before the save fails.
+update_retries = 2
+
+# Per-user items only hold the playback position. Items written before the shared
+# catalog existed carry a full copy of the feed under 'playlist', and shuffled items
+# may carry the whole shuffled order as a list; both are rewritten in the compact
+# format the first time they are read.
+#
+# The attributes loaded at the start of a request are remembered for that request,
+# and save_attributes only writes when they changed. A change to nothing but the
+# playback offset, which is most AudioPlayer event traffic, is written only once it
+# has moved by at least offset_write_granularity.
+#
+# Writes are UpdateItem calls that SET or REMOVE only the attribute paths that
+# changed, conditioned on the item's 'version' attribute still being the one that
+# was read. When another request got there first, for example a racing AudioPlayer
+# event, the changed paths are re-applied on top of the newer item instead of
+# overwriting it.
+#
+# It takes the arguments of ask_sdk_dynamodb's DynamoDbAdapter, except that the
+# table is never created and the resource defaults to the shared, lazily created
+# one. Importing DynamoDbAdapter alone builds a boto3 resource for its default
+# argument, which is why this adapter does not extend it.
+class PlaybackStateAdapter(AbstractPersistenceAdapter):
+
+    def __init__(self, table_name, partition_key_name="id", attribute_name="attributes",
+                 partition_keygen=user_id_partition_keygen, dynamodb_resource=None):
+        self.table_name = table_name
+        self.partition_key_name = partition_key_name
+        self.attribute_name = attribute_name
+        self.partition_keygen = partition_keygen
+        self.dynamodb_resource = dynamodb_resource
+        self._loaded_attributes = OrderedDict()
+        self._loaded_attributes_lock = threading.Lock()
+
+    @property
+    def dynamodb(self):
+        return self.dynamodb_resource if self.dynamodb_resource is not None else get_ddb_resource()
+
+    @timed_phase('DynamoDbGet')
+    def get_attributes(self, request_envelope):
+        partition_key_val = self.partition_keygen(request_envelope)
+        version, attributes = self._get_item(partition_key_val)
+        self._remember(snapshot_key(request_envelope, partition_key_val), version, attributes)
+        if 'playlist' in attributes or isinstance(attributes.get('shuffle_order'), list):
+            attributes = migrate_legacy_attributes(attributes)
+            self.save_attributes(request_envelope, attributes)
+        return attributes
+
+    @timed_phase('DynamoDbSave')
+    def save_attributes(self, request_envelope, attributes):
+        from botocore.exceptions import ClientError
+        partition_key_val = self.partition_keygen(request_envelope)
+        key = snapshot_key(request_envelope, partition_key_val)
+        with self._loaded_attributes_lock:
+            snapshot = self._loaded_attributes.get(key)
+        if snapshot is None:
+            snapshot = self._get_item(partition_key_val)
+        version, loaded = snapshot
+        if not needs_write(loaded, attributes):
+            return
+
+        changes = diff_attributes(loaded, attributes)
+        for attempt in range(update_retries + 1):
+            if attempt > 0:
+                version, current = self._get_item(partition_key_val)
+                attributes = apply_changes(current, changes)
+                changes = diff_attributes(current, attributes)
+                if not changes['set'] and not changes['remove']:
+                    # The newer item already has this request's changes
+                    self._remember(key, version, attributes)
+                    return
+            try:
+                self._update_item(partition_key_val, version, changes)
+                self._remember(key, (version or 0) + 1, attributes)
+                return
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise PersistenceException(
+                        "Failed to save attributes to DynamoDb table. Exception of type {} occurred: {}".format(
+                            type(e).__name__, str(e)))
+                logging.info("Attributes of {} changed since they were read, re-applying".format(partition_key_val))
+
+        raise PersistenceException(
+            "Failed to save attributes to DynamoDb table. The item kept changing after {} attempts".format(
+                update_retries + 1))
+
+    def delete_attributes(self, request_envelope):
+        partition_key_val = self.partition_keygen(request_envelope)
+        try:
+            table = self.dynamodb.Table(self.table_name)
+            table.delete_item(Key={self.partition_key_name: partition_key_val})
+        except Exception as e:
+            raise PersistenceException(
+                "Failed to delete attributes in DynamoDb table. Exception of type {} occurred: {}".format(
+                    type(e).__name__, str(e)))
+        with self._loaded_attributes_lock:
+            self._loaded_attributes.pop(snapshot_key(request_envelope, partition_key_val), None)
+
+    def _get_item(self, partition_key_val):
+        try:
+            table = self.dynamodb.Table(self.table_name)
+            response = table.get_item(
+                Key={self.partition_key_name: partition_key_val},
+                ConsistentRead=True)
+        except Exception as e:
+            raise PersistenceException(
+                "Failed to retrieve attributes from DynamoDb table. Exception of type {} occurred: {}".format(
+                    type(e).__name__, str(e)))
+
+        item = response.get("Item", {})
+        version = item.get('version')
+        return (int(version) if version is not None else None), item.get(self.attribute_name, {})
+
+    def _update_item(self, partition_key_val, version, changes):
+        from botocore.exceptions import ClientError
+        # DynamoDB rejects names the expressions do not use
+        names = {'#version': 'version'}
+        if changes['set'] or changes['remove']:
+            names['#attributes'] = self.attribute_name
+        values = {':next_version': (version or 0) + 1}
+        set_clauses = []
+        remove_clauses = []
+        for path, value in changes['set']:
+            placeholder = ':v{}'.format(len(values))
+            values[placeholder] = value
+            set_clauses.append('{} = {}'.format(path_expression(path, names), placeholder))
+        for path in changes['remove']:
+            remove_clauses.append(path_expression(path, names))
+        set_clauses.append('#version = :next_version')
+
+        update_expression = 'SET ' + ', '.join(set_clauses)
+        if remove_clauses:
+            update_expression += ' REMOVE ' + ', '.join(remove_clauses)
+        if version is None:
+            condition_expression = 'attribute_not_exists(#version)'
+        else:
+            condition_expression = '#version = :version'
+            values[':version'] = version
+
+        try:
+            table = self.dynamodb.Table(self.table_name)
+            table.update_item(
+                Key={self.partition_key_name: partition_key_val},
+                UpdateExpression=update_expression,
+                ConditionExpression=condition_expression,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values)
+        except ClientError:
+            raise
+        except Exception as e:
+            raise PersistenceException(
+                "Failed to save attributes to DynamoDb table. Exception of type {} occurred: {}".format(
+                    type(e).__name__, str(e)))
+
+    # Snapshots are kept for the most recent requests only; a request without one
+    # reads the item back before the write. The adapter is shared by every request
+    # of the process, and moving and evicting entries of an OrderedDict from two
+    # threads at once can corrupt it, so the snapshots are only touched under a lock.
+    def _remember(self, key, version, attributes):
+        snapshot = (version, copy.deepcopy(attributes))
+        with self._loaded_attributes_lock:
+            self._loaded_attributes[key] = snapshot
+            self._loaded_attributes.move_to_end(key)
+            if len(self._loaded_attributes) > 1024:
+                self._loaded_attributes.popitem(last=False)
+
+# Snapshots are remembered per request rather than per user: two requests for the
+# same user served at once (webservice.py) each have their write checked against
+# the version they read, so neither can silently undo the other's changes.
+def snapshot_key(request_envelope, partition_key_val):
+    request = request_envelope.request
+    return partition_key_val, (request.request_id if request is not None else None)
+
+# The paths, relative to the item's attributes map, whose value differs between
+# `loaded` and `attributes`. Nested maps are compared key by key; anything else,
+# lists included, is replaced as a whole. An empty path stands for the whole map,
+# which is how an item that has no attributes yet gets its first write.
+def diff_attributes(loaded, attributes, path=()):
+    changes = {'set': [], 'remove': []}
+    if not loaded:
+        changes['set'].append((path, attributes))
+        return changes
+
+    for key, value in attributes.items():
+        if key not in loaded:
+            changes['set'].append((path + (key,), value))
+        elif isinstance(value, dict) and isinstance(loaded[key], dict) and loaded[key]:
+            nested = diff_attributes(loaded[key], value, path + (key,))
+            changes['set'].extend(nested['set'])
+            changes['remove'].extend(nested['remove'])
+        elif fingerprint(loaded[key]) != fingerprint(value):
+            changes['set'].append((path + (key,), value))
+    for key in loaded:
+        if key not in attributes:
+            changes['remove'].append(path + (key,))
+    return changes
+
+def apply_changes(attributes, changes):
+    attributes = copy.deepcopy(attributes)
+    for path, value in changes['set']:
+        if not path:
+            attributes = copy.deepcopy(value)
+            continue
+        parent = attributes
+        for key in path[:-1]:
+            if not isinstance(parent.get(key), dict):
+                parent[key] = {}
+            parent = parent[key]
+        parent[path[-1]] = copy.deepcopy(value)
+    for path in changes['remove']:
+        parent = attributes
+        for key in path[:-1]:
+            parent = parent.get(key, {})
+        parent.pop(path[-1], None)
+    return attributes
+
+def path_expression(path, names):
+    expression = '#attributes'
+    for key in path:
+        placeholder = '#n{}'.format(len(names))
+        names[placeholder] = key
+        expression += '.' + placeholder
+    return expression
+
+def needs_write(loaded, attributes):
+    loaded_offset, loaded = split_offset(loaded)
+    offset, attributes = split_offset(attributes)
+    if fingerprint(loaded) != fingerprint(attributes):
+        return True
+    if loaded_offset is None or offset is None:
+        return loaded_offset != offset
+    return abs(int(offset) - int(loaded_offset)) >= max(offset_write_granularity, 1)
+
+def split_offset(attributes):
+    session = attributes.get('playback_session_data')
+    if not isinstance(session, dict) or 'offset' not in session:
+        return None, attributes
+    attributes = dict(attributes)
+    attributes['playback_session_data'] = dict(session)
+    return attributes['playback_session_data'].pop('offset'), attributes
+
+# DynamoDB hands numbers back as Decimal while handlers write ints, so numbers are
+# normalised before the attributes are compared.
+def fingerprint(attributes):
+    return json.dumps(attributes, sort_keys=True, default=_json_number)
+
+def _json_number(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    raise TypeError("Object of type {} is not JSON serializable".format(type(value).__name__))
+
+# Legacy tokens are 1-based indexes into the unshuffled feed. The catalog version is
+# unknown and left at 0 so the position is re-resolved on first use. A stored shuffle
+# order is replaced by a seeded shuffle that starts at the current episode.
+def migrate_legacy_attributes(attributes):
+    playlist = attributes.pop('playlist', None)
+    session = attributes.get('playback_session_data')
+    if session is None:
+        attributes.pop('shuffle_order', None)
+        return attributes
+
+    if playlist is not None:
+        session = {
+            'catalog_version': 0,
+            'index': session['index'],
+            'token': session['token'],
+            'offset': session['offset'],
+            'loop': session['loop'],
+            'shuffle': session['shuffle']
+        }
+        attributes['playback_session_data'] = session
+        size = len(playlist)
+    else:
+        size = len(attributes['shuffle_order'])
+
+    if session['shuffle']:
+        attributes['shuffle_order'] = shuffle_playlist(int(session['token']) - 1, size)
+        session['index'] = 0
+    return attributes
+
+# Number of seconds the chunk items a new catalog version no longer lists are kept
+# for the containers still serving an older version. A container may serve a
+# version for CATALOG_CACHE_TTL plus CATALOG_MAX_STALE seconds after reading it
+# (catalog.py), so the default is that plus a margin. Override with
+# CATALOG_CHUNK_RETENTION.
+catalog_chunk_retention = int(os.environ.get(
+    'CATALOG_CHUNK_RETENTION',
+    int(os.environ.get('CATALOG_CACHE_TTL', 300)) + int(os.environ.get('CATALOG_MAX_STALE', 3600)) + 900))
+
+# The episode catalog of a feed is stored once, in the same table as the user items,
+# under a 'catalog#<feed url>' key. Every published catalog carries a version number
+# that only ever increases. The episode list is stored as plain maps, packed, or in
+# packed chunk items of its own depending on CATALOG_ENCODING (see catalog_codec.py).
+class CatalogStore(object):
+
+    def __init__(self, table_name, dynamodb_resource=None, partition_key_name="id", attribute_name="attributes"):
+        self.table_name = table_name
+        self.partition_key_name = partition_key_name
+        self.attribute_name = attribute_name
+        self.dynamodb_resource = dynamodb_resource
+
+    @property
+    def dynamodb(self):
+        return self.dynamodb_resource if self.dynamodb_resource is not None else get_ddb_resource()
+
+    @timed_phase('CatalogRead')
+    def get_catalog(self, feed_url):
+        try:
+            table = self.dynamodb.Table(self.table_name)
+            response = table.get_item(Key={self.partition_key_name: catalog_key(feed_url)})
+        except Exception as e:
+            raise PersistenceException(
+                "Failed to retrieve catalog from DynamoDb table. Exception of type {} occurred: {}".format(
+                    type(e).__name__, str(e)))
+
+        if "Item" not in response:
+            return None
+        catalog = decode_catalog(response["Item"][self.attribute_name],
+                                 lambda chunk_id: self.get_chunk(feed_url, chunk_id))
+        catalog['version'] = int(catalog['version'])
+        return catalog
+
+    # Chunks are written before the catalog record that lists them, so they are read
+    # consistently to be sure to find them.
+    @timed_phase('CatalogRead')
+    def get_chunk(self, feed_url, chunk_id):
+        try:
+            table = self.dynamodb.Table(self.table_name)
+            response = table.get_item(Key={self.partition_key_name: chunk_key(feed_url, chunk_id)},
+                                      ConsistentRead=True)
+            return binary_value(response["Item"][self.attribute_name]['packed'])
+        except Exception as e:
+            raise PersistenceException(
+                "Failed to retrieve catalog chunk from DynamoDb table. Exception of type {} occurred: {}".format(
+                    type(e).__name__, str(e)))
+
+    # Returns False without writing if a catalog with the same or a newer version
+    # has already been published by another container.
+    #
+    # A chunked catalog only writes the chunks the published one does not already
+    # have. The record keeps the chunks that are no longer listed under
+    # 'retired_chunks', with the time each stopped being listed, and they are
+    # deleted by the first publish after catalog_chunk_retention seconds. Chunks
+    # written for a version that lost the race to be published are deleted again
+    # unless the winning one lists them too.
+    def save_catalog(self, feed_url, catalog):
+        from botocore.exceptions import ClientError
+        attributes, chunks = encode_catalog(catalog)
+        stale_chunk_ids = set()
+        written_chunk_ids = []
+        try:
+            table = self.dynamodb.Table(self.table_name)
+            if chunks:
+                now = int(time.time())
+                current = table.get_item(Key={self.partition_key_name: catalog_key(feed_url)},
+                                         ConsistentRead=True).get("Item", {}).get(self.attribute_name, {})
+                current_chunk_ids = set(referenced_chunk_ids(current))
+                chunk_ids = set(chunk_id for chunk_id, _ in chunks)
+                retired = retired_chunks(current, now)
+                for chunk_id in current_chunk_ids - chunk_ids:
+                    retired[chunk_id] = now
+                for chunk_id in chunk_ids:
+                    retired.pop(chunk_id, None)
+                stale_chunk_ids = set(chunk_id for chunk_id, retired_at in retired.items()
+                                      if now - retired_at >= catalog_chunk_retention)
+                attributes['retired_chunks'] = dict((chunk_id, retired_at) for chunk_id, retired_at in retired.items()
+                                                    if chunk_id not in stale_chunk_ids)
+                for chunk_id, packed in chunks:
+                    if chunk_id not in current_chunk_ids:
+                        written_chunk_ids.append(chunk_id)
+                        table.put_item(Item={self.partition_key_name: chunk_key(feed_url, chunk_id),
+                                             self.attribute_name: {'packed': packed}})
+            table.put_item(
+                Item={self.partition_key_name: catalog_key(feed_url), self.attribute_name: attributes},
+                ConditionExpression="attribute_not_exists(#key) OR #attributes.#version < :version",
+                ExpressionAttributeNames={
+                    '#key': self.partition_key_name,
+                    '#attributes': self.attribute_name,
+                    '#version': 'version'
+                },
+                ExpressionAttributeValues={':version': catalog['version']})
+        except Exception as e:
+            if isinstance(e, ClientError) and e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                logging.info("Catalog version {} of {} is already superseded".format(catalog['version'], feed_url))
+                self._delete_orphaned_chunks(feed_url, written_chunk_ids)
+                return False
+            raise PersistenceException(
+                "Failed to save catalog to DynamoDb table. Exception of type {} occurred: {}".format(
+                    type(e).__name__, str(e)))
+
+        self._delete_chunks(feed_url, stale_chunk_ids)
+        return True
+
+    # Deletes the chunks in `chunk_ids` that the published catalog neither lists nor
+    # still keeps for older versions
+    def _delete_orphaned_chunks(self, feed_url, chunk_ids):
+        if not chunk_ids:
+            return
+        try:
+            table = self.dynamodb.Table(self.table_name)
+            current = table.get_item(Key={self.partition_key_name: catalog_key(feed_url)},
+                                     ConsistentRead=True).get("Item", {}).get(self.attribute_name, {})
+        except Exception as e:
+            logging.warning("Failed to read the catalog of {} to clean up its chunks: {}".format(feed_url, e))
+            return
+        kept = set(referenced_chunk_ids(current)) | set(retired_chunks(current, 0))
+        self._delete_chunks(feed_url, set(chunk_ids) - kept)
+
+    def _delete_chunks(self, feed_url, chunk_ids):
+        for chunk_id in chunk_ids:
+            try:
+                self.dynamodb.Table(self.table_name).delete_item(
+                    Key={self.partition_key_name: chunk_key(feed_url, chunk_id)})
+            except Exception as e:
+                logging.warning("Failed to delete catalog chunk {} of {}: {}".format(chunk_id, feed_url, e))
+
+    # Enclosure probe results of a feed (enclosures.py), keyed by episode token.
+    # They are rewritten whole by the refresher and need no versioning: the last
+    # probe of an enclosure is the one worth keeping.
+    @timed_phase('CatalogRead')
+    def get_probes(self, feed_url):
+        try:
+            table = self.dynamodb.Table(self.table_name)
+            response = table.get_item(Key={self.partition_key_name: probes_key(feed_url)})
+        except Exception as e:
+            raise PersistenceException(
+                "Failed to retrieve enclosure probes from DynamoDb table. Exception of type {} occurred: {}".format(
+                    type(e).__name__, str(e)))
+        if "Item" not in response:
+            return None
+        return response["Item"][self.attribute_name]['episodes']
+
+    def save_probes(self, feed_url, probes):
+        try:
+            table = self.dynamodb.Table(self.table_name)
+            table.put_item(Item={self.partition_key_name: probes_key(feed_url),
+                                 self.attribute_name: {'episodes': probes}})
+        except Exception as e:
+            raise PersistenceException(
+                "Failed to save enclosure probes to DynamoDb table. Exception of type {} occurred: {}".format(
+                    type(e).__name__, str(e)))
+
+def catalog_key(feed_url):
+    return "catalog#{}".format(feed_url)
+
+def chunk_key(feed_url, chunk_id):
+    return "catalog#{}#chunk#{}".format(feed_url, chunk_id)
+
+def probes_key(feed_url):
+    return "probes#{}".format(feed_url)
+
+# The chunks a stored catalog record keeps for older versions, as chunk id -> the
+# time it stopped being listed. Records written before the times were kept list the
+# chunks of the version before them under 'retained_chunk_ids'; those count as
+# retired at `now`.
+def retired_chunks(attributes, now):
+    retired = dict((chunk_id, now) for chunk_id in attributes.get('retained_chunk_ids', ()))
+    retired.update((chunk_id, int(retired_at)) for chunk_id, retired_at in attributes.get('retired_chunks', {}).items())
+    return retired
+
+def referenced_chunk_ids(attributes):
+    chunk_ids = list(attributes.get('chunk_ids', ()))
+    if attributes.get('tokens_id'):
+        chunk_ids.append(attributes['tokens_id'])
+    chunk_ids.extend(attributes.get('titles_ids', ()))
+    return chunk_ids
+
+# Partition key of a user's state for the feed of the request. Users of the default
+# feed keep the bare user id, so items written before there were several feeds
+# are still found; every other feed gets '<user id>#<feed id>'.
+def feed_partition_keygen(request_envelope):
+    user_id = user_id_partition_keygen(request_envelope)
+    feed = feeds.get_feed(request_envelope)
+    if feeds.registry.is_default(feed):
+        return user_id
+    return "{}#{}".format(user_id, feed['id'])
+
+dynamodb_adapter = PlaybackStateAdapter(table_name=ddb_table_name, partition_keygen=feed_partition_keygen)
+catalog_store = CatalogStore(table_name=ddb_table_name)
@@ -0,0 +1,138 @@
+"""
+ Refreshes the episode catalog outside of user requests. Deploy this module as a
+ second Lambda function with handler refresher.refresh_handler, sharing the skill's
+ environment variables, and trigger it from a scheduled EventBridge rule (e.g.
+ rate(5 minutes)). The skill's request handlers then only ever read the catalog
+ snapshot it publishes.
+
+ It can be run locally against a feed file and a JSON file standing in for the
+ DynamoDB table, without AWS credentials or network access:
+
+     python refresher.py --feed-file feed.xml --store-file catalog.json
+ """
+
+from catalog import refresh_catalog
+from circuit_breaker import CircuitOpenError
+from enclosures import probe_feed
+from fanout import run_concurrently
+from metrics import start_invocation, record_handler, finish_invocation
+
+import argparse
+import email.utils
+import feeds
+import functools
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Entry point for the scheduled event. The feeds of the registry (feeds.py) are
+# refreshed concurrently, over the same pooled connections; a 'feed_url' in the
+# event refreshes only that feed. The newest enclosures of each feed are probed
+# after its refresh (enclosures.py). The fetch, parse and probe times are recorded
+# like a skill request's, under the handler name CatalogRefresh. The result ends
+# with the connection, retry and timeout counts of the container's feed sessions
+# (feed_http.get_http_metrics), which are also logged.
+def refresh_handler(event, context):
+    feed_url = (event or {}).get('feed_url')
+    if feed_url is not None:
+        return with_http_metrics(refresh_feed(feed_url, context))
+
+    def refresh(feed):
+        try:
+            return refresh_feed(feed['rss_url'], context)
+        except CircuitOpenError as e:
+            logger.warning("Not refreshing {}: {}".format(feed['rss_url'], e))
+            return {'feed_url': feed['rss_url'], 'error': str(e)}
+        except Exception as e:
+            # One unreachable feed must not hold back the others
+            logger.error("Refreshing {} failed: {}".format(feed['rss_url'], e), exc_info=True)
+            return {'feed_url': feed['rss_url'], 'error': str(e)}
+    return with_http_metrics(
+        {'feeds': run_concurrently(*[functools.partial(refresh, feed) for feed in feeds.registry.feeds.values()])})
+
+def with_http_metrics(result):
+    from feed_http import get_http_metrics
+    result['http'] = get_http_metrics()
+    logger.info("Feed HTTP since the container started: {}".format(json.dumps(result['http'])))
+    return result
+
+def refresh_feed(feed_url, context):
+    start_invocation(getattr(context, 'aws_request_id', None))
+    record_handler('CatalogRefresh')
+    try:
+        catalog = refresh_catalog(feed_url)
+    except Exception:
+        finish_invocation(error=True)
+        raise
+    try:
+        probes = probe_feed(feed_url, catalog)
+    except Exception as e:
+        # The catalog is published; the previous probe results stay in place
+        logger.error("Probing the enclosures of {} failed: {}".format(feed_url, e), exc_info=True)
+        probes = None
+    finish_invocation()
+    logger.info("Catalog of {} is at version {} with {} episodes".format(
+        feed_url, catalog['version'], len(catalog['episodes'])))
+    result = {'feed_url': feed_url, 'version': catalog['version'], 'episodes': len(catalog['episodes'])}
+    if probes is not None:
+        result['broken_enclosures'] = sum(1 for probe in probes.values() if probe['broken'])
+    return result
+
+# Stand-ins for running the refresher locally
+
+# Reads a feed from disk with the same conditional semantics as fetch_rss: the
+# file's modification time is its Last-Modified date, and an unchanged file is
+# answered with a 304.
+class FileFeedResponse(object):
+
+    def __init__(self, status_code, content, headers):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers
+
+def fetch_feed_file(path, etag=None, last_modified=None):
+    stat = os.stat(path)
+    headers = {'ETag': '"{:x}-{:x}"'.format(int(stat.st_mtime * 1000), stat.st_size),
+               'Last-Modified': email.utils.formatdate(stat.st_mtime, usegmt=True)}
+    if etag is not None and etag == headers['ETag']:
+        return FileFeedResponse(304, b'', headers)
+    with open(path, 'rb') as feed_file:
+        return FileFeedResponse(200, feed_file.read(), headers)
+
+# Keeps catalogs in a JSON file, keyed by feed URL, with the version check of
+# persistence.CatalogStore.
+class FileCatalogStore(object):
+
+    def __init__(self, path):
+        self.path = path
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as store_file:
+            return json.load(store_file)
+
+    def get_catalog(self, feed_url):
+        return self._load().get(feed_url)
+
+    def save_catalog(self, feed_url, catalog):
+        catalogs = self._load()
+        if feed_url in catalogs and catalogs[feed_url]['version'] >= catalog['version']:
+            return False
+        catalogs[feed_url] = catalog
+        with open(self.path, 'w') as store_file:
+            json.dump(catalogs, store_file)
+        return True
+
+if __name__ == '__main__':
+    logging.basicConfig()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--feed-file', required=True)
+    parser.add_argument('--store-file', required=True)
+    args = parser.parse_args()
+
+    catalog = refresh_catalog(args.feed_file, store=FileCatalogStore(args.store_file), fetch=fetch_feed_file)
+    print("version {} with {} episodes".format(catalog['version'], len(catalog['episodes'])))
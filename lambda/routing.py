@@ -0,0 +1,96 @@
+from ask_sdk_core.dispatch_components import AbstractRequestHandler
+from ask_sdk_core.skill_builder import CustomSkillBuilder
+from ask_sdk_model import RequestEnvelope
+from ask_sdk_runtime.dispatch_components.request_components import GenericRequestMapper
+from metrics import record_handler
+
+import json
+
+# A request handler that declares the request types and intent names it handles
+# instead of testing them in can_handle, so the skill can route to it with a dict
+# lookup. can_handle answers from the same declaration, so it still works with
+# the SDK's default mapper.
+class RoutedRequestHandler(AbstractRequestHandler):
+    request_types = ()
+    intent_names = ()
+
+    def can_handle(self, handler_input):
+        request = handler_input.request_envelope.request
+        return (request.object_type in self.request_types or
+                (request.object_type == "IntentRequest" and request.intent.name in self.intent_names))
+
+def route_keys(handler):
+    keys = [(request_type, None) for request_type in handler.request_types]
+    keys.extend(("IntentRequest", intent_name) for intent_name in handler.intent_names)
+    return keys
+
+# Request mapper that finds the handler for a request by its type and intent name
+# instead of calling can_handle on every registered handler in turn.
+#
+# Handlers that are not RoutedRequestHandlers (e.g. the audio interface check,
+# which looks at the device) stay in a chain of predicates. The result is always
+# the handler the linear scan would have picked: the first registered one that can
+# handle the request. Predicates registered before the routed handler are tried
+# first and the ones registered after it are never reached. The chosen handler is
+# recorded for the invocation's latency metrics.
+class RoutingRequestMapper(GenericRequestMapper):
+
+    def __init__(self, request_handler_chains):
+        self._routes = {}
+        self._predicate_chains = []
+        super(RoutingRequestMapper, self).__init__(request_handler_chains)
+
+    def add_request_handler_chain(self, request_handler_chain):
+        super(RoutingRequestMapper, self).add_request_handler_chain(request_handler_chain)
+        position = len(self.request_handler_chains) - 1
+        handler = request_handler_chain.request_handler
+        if isinstance(handler, RoutedRequestHandler):
+            for key in route_keys(handler):
+                # An earlier registration for the same key keeps precedence
+                self._routes.setdefault(key, (position, request_handler_chain))
+        else:
+            self._predicate_chains.append((position, request_handler_chain))
+
+    def get_request_handler_chain(self, handler_input):
+        request = handler_input.request_envelope.request
+        routed = self._routes.get((request.object_type, None))
+        if request.object_type == "IntentRequest":
+            intent_routed = self._routes.get(("IntentRequest", request.intent.name))
+            if routed is None or (intent_routed is not None and intent_routed[0] < routed[0]):
+                routed = intent_routed
+
+        chain = self._find_chain(handler_input, routed)
+        if chain is not None:
+            record_handler(type(chain.request_handler).__name__)
+        return chain
+
+    def _find_chain(self, handler_input, routed):
+        for position, chain in self._predicate_chains:
+            if routed is not None and position > routed[0]:
+                break
+            if chain.request_handler.can_handle(handler_input=handler_input):
+                return chain
+        return routed[1] if routed is not None else None
+
+# CustomSkillBuilder that dispatches through RoutingRequestMapper.
+#
+# The SDK's lambda_handler builds a new skill, and with it the request mappers,
+# on every invocation. Handlers and interceptors are all registered before
+# lambda_handler() is called, so here the skill is built once per container.
+class RoutingSkillBuilder(CustomSkillBuilder):
+
+    def lambda_handler(self):
+        skill = self.create()
+
+        def wrapper(event, context):
+            request_envelope = skill.serializer.deserialize(payload=json.dumps(event), obj_type=RequestEnvelope)
+            response_envelope = skill.invoke(request_envelope=request_envelope, context=context)
+            return skill.serializer.serialize(response_envelope)
+        return wrapper
+
+    @property
+    def skill_configuration(self):
+        skill_config = super(RoutingSkillBuilder, self).skill_configuration
+        skill_config.request_mappers = [RoutingRequestMapper(mapper.request_handler_chains)
+                                        for mapper in skill_config.request_mappers]
+        return skill_config
@@ -0,0 +1,126 @@
+from array import array
+from collections import defaultdict
+
+import math
+import re
+import threading
+import unicodedata
+
+# Share of the query's words, weighted by how rare they are in the catalog, a
+# title has to match to be picked
+min_match = 0.5
+
+# Trigram similarity from which a word that is in no title is taken for one that is
+min_similarity = 0.3
+
+_word_pattern = re.compile(r'\w+')
+
+# The words of a title or a spoken query: lower case, with accents removed so
+# that "café" and "cafe" are the same word
+def title_words(text):
+    text = (text or '').casefold()
+    if not text.isascii():
+        text = ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+    return _word_pattern.findall(text)
+
+def trigrams(word):
+    padded = ' {} '.format(word)
+    return set(padded[i:i + 3] for i in range(len(padded) - 2))
+
+# Inverted index from title words to the catalog indexes of the episodes whose
+# titles contain them, for picking an episode by what a user says about it. Query
+# words are weighted by how rare they are, so a name or a topic counts for more
+# than "the" or "show"; words in more than half the titles are left out, since
+# they cannot tell episodes apart and would cost a pass over most of the catalog.
+# Query words that are in no title, misrecognised or misspelt ones, are matched
+# to the most similar title words by their trigrams, and score in proportion to
+# the similarity. Ties go to the newest episode.
+class TitleIndex(object):
+
+    def __init__(self, titles):
+        self._count = len(titles)
+        postings = defaultdict(list)
+        for index, title in enumerate(titles):
+            for word in set(title_words(title)):
+                postings[word].append(index)
+        self._postings = dict((word, array('I', indexes)) for word, indexes in postings.items())
+        # Built on the first query that needs it
+        self._trigram_index = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    # The catalog index of the episode that best matches `query`, or None
+    def search(self, query):
+        scores = defaultdict(float)
+        total = 0.0
+        for word in set(title_words(query)):
+            matches = [(word, 1.0)] if word in self._postings else self._similar_words(word)
+            if not matches:
+                # Counts like a common word, so that a query that is half
+                # about something no episode has is not matched
+                total += math.log(2.0)
+                continue
+            best = 0.0
+            for match, similarity in matches:
+                indexes = self._postings[match]
+                if len(indexes) * 2 > self._count:
+                    continue
+                weight = math.log(1.0 + self._count / float(len(indexes)))
+                best = max(best, weight)
+                for index in indexes:
+                    scores[index] += weight * similarity
+            total += best
+        if not scores:
+            return None
+        score, index = max((score, index) for index, score in scores.items())
+        return index if score >= total * min_match else None
+
+    # Title words whose trigrams are most like the ones of `word`, with their
+    # similarity
+    def _similar_words(self, word):
+        if len(word) < 3:
+            return []
+        vocabulary, trigram_counts, trigram_index = self._get_trigram_index()
+        query_trigrams = trigrams(word)
+        shared = defaultdict(int)
+        for trigram in query_trigrams:
+            for word_id in trigram_index.get(trigram, ()):
+                shared[word_id] += 1
+        similar = []
+        for word_id, count in shared.items():
+            similarity = count / float(len(query_trigrams) + trigram_counts[word_id] - count)
+            if similarity >= min_similarity:
+                similar.append((similarity, vocabulary[word_id]))
+        similar.sort(reverse=True)
+        return [(match, similarity) for similarity, match in similar[:3]]
+
+    def _get_trigram_index(self):
+        if self._trigram_index is None:
+            with self._lock:
+                if self._trigram_index is None:
+                    vocabulary = list(self._postings)
+                    trigram_counts = array('H')
+                    index = defaultdict(list)
+                    for word_id, word in enumerate(vocabulary):
+                        word_trigrams = trigrams(word)
+                        trigram_counts.append(min(len(word_trigrams), 0xFFFF))
+                        for trigram in word_trigrams:
+                            index[trigram].append(word_id)
+                    self._trigram_index = (vocabulary, trigram_counts,
+                                           dict((trigram, array('I', ids)) for trigram, ids in index.items()))
+        return self._trigram_index
+
+# The title index of `catalog`, a cached catalog entry (catalog.get_catalog). It is
+# built on the first title search and kept with the entry, so it is built once
+# per catalog version and container. Packed and chunked catalogs hand over their
+# titles without building every episode; a chunked one reads the titles it stores
+# packed on their own (catalog_codec.encode_titles), not its chunks.
+def get_title_index(catalog):
+    index = catalog.get('title_index')
+    if index is None:
+        episodes = catalog['episodes']
+        titles = episodes.titles() if hasattr(episodes, 'titles') else [episode['title'] for episode in episodes]
+        index = catalog['title_index'] = TitleIndex(titles)
+    return index
@@ -1,67 +1,315 @@
-from botocore.exceptions import ClientError
-from bs4 import BeautifulSoup
+from metrics import timed_phase
 
-import requests
+import bisect
 import logging
 import os
-import boto3
+import hashlib
+import io
 import json
 import random
+import threading
+import time
 
+# Presigned URLs are valid for presigned_url_expiry seconds. They are cached per
+# object key and re-signed once they are presigned_url_refresh seconds old, so a
+# device is never handed a URL that is about to expire.
+presigned_url_expiry = 6000
+presigned_url_refresh = int(os.environ.get('PRESIGNED_URL_REFRESH', 3000))
+
+#
+# The S3 client, and boto3 with it, is only loaded by the first request that needs
+# a URL.
+s3_client = None
+_presigned_url_cache = {}
+
+# Held while boto3 clients and resources are created. Requests fan out to several
+# threads (fanout.py), and boto3's default session is not safe to set up from two
+# threads at once; the clients, once created, are.
+aws_client_lock = threading.Lock()
+
+def get_s3_client():
+    global s3_client
+    if s3_client is None:
+        with aws_client_lock:
+            if s3_client is None:
+                import boto3
+                s3_client = boto3.client('s3',
+                                         region_name=os.environ.get('S3_PERSISTENCE_REGION'),
+                                         config=boto3.session.Config(signature_version='s3v4',s3={'addressing_style': 'path'}))
+    return s3_client
+
+@timed_phase('Presign')
 def create_presigned_url(object_name):
-    s3_client = boto3.client('s3',
-                             region_name=os.environ.get('S3_PERSISTENCE_REGION'),
-                             config=boto3.session.Config(signature_version='s3v4',s3={'addressing_style': 'path'}))
+    cached = _presigned_url_cache.get(object_name)
+    now = time.time()
+    if cached is not None and now - cached[1] < presigned_url_refresh:
+        return cached[0]
+
+    s3_client = get_s3_client()
+    from botocore.exceptions import ClientError
     try:
         bucket_name = os.environ.get('S3_PERSISTENCE_BUCKET')
         response = s3_client.generate_presigned_url('get_object',
                                                     Params={'Bucket': bucket_name,
                                                             'Key': object_name},
-                                                    ExpiresIn=6000)
+                                                    ExpiresIn=presigned_url_expiry)
     except ClientError as e:
         logging.error(e)
         return None
 
     # The response contains the presigned URL
+    _presigned_url_cache[object_name] = (response, now)
     return response
 
-def populate_playlist_from_rss(url):
-    playlist = []
-    rss_raw_text = requests.get(url).text
-    rss_parsed_data = BeautifulSoup(rss_raw_text,'xml')
-    all_episodes = rss_parsed_data.find_all('item')
-    all_episodes.reverse()
-    
-    for index, episode in enumerate(all_episodes):
-        current_track_data = ({ 'url': episode.enclosure['url'], "title": episode.title.text, "token": str(index+1)})
-        playlist.append(current_track_data)
-
-    return playlist
-
-def update_playlist(url, playlist):
-    rss_raw_text = requests.get(url).text
-    rss_parsed_data = BeautifulSoup(rss_raw_text,'xml')
-    all_episodes = rss_parsed_data.find_all('item')
-    all_episodes.reverse()
-    
-    for index in range(len(playlist), len(all_episodes)):
-        current_track_data = ({ 'url': all_episodes[index].enclosure['url'], "title": all_episodes[index].title.text, "token": str(index+1)})
-        playlist.append(current_track_data)
-
-    return playlist
-
-def get_track_index(token, playlist):
-    for index, value in enumerate(playlist):
-        if value['token'] == token:
-            track_index = index
-            break
-        else:
-            track_index = 0
+def has_presigned_url(object_name):
+    cached = _presigned_url_cache.get(object_name)
+    return cached is not None and time.time() - cached[1] < presigned_url_refresh
+
+# Streams <item> elements out of the feed as (guid, url, title) tuples, newest first,
+# clearing each element once it has been read so memory stays flat for large feeds.
+# Items without a <guid> are identified by their enclosure URL.
+def iter_feed_items(rss_raw_content):
+    from lxml import etree
+    for _, item in etree.iterparse(io.BytesIO(rss_raw_content), events=('end',), tag='item'):
+        enclosure = item.find('enclosure')
+        url = enclosure.get('url') if enclosure is not None else None
+        guid = item.findtext('guid') or url
+        title = item.findtext('title')
+
+        item.clear()
+        while item.getprevious() is not None:
+            del item.getparent()[0]
+
+        if url is None:
+            continue
+        yield guid, url, title
+
+def parse_playlist(rss_raw_content):
+    return apply_feed_changes([], diff_feed(rss_raw_content, {}))
+
+# Compares the items of a feed with the episodes of a catalog, looked up by guid in
+# `guid_index` (see build_guid_index), and returns what changed as
+# {'added': [episode, ...], 'updated': {catalog index: episode}, 'removed': [catalog index, ...]}.
+# Items new to the catalog are added oldest first. Episodes keep their place in
+# the catalog whatever order the feed lists them in, and an episode is updated
+# when its enclosure URL or title changed. The whole feed is parsed, since an
+# episode can be taken out of it anywhere, but the catalog's episodes are only
+# touched for the items that changed.
+def diff_feed(rss_raw_content, guid_index):
+    added = []
+    updated = {}
+    seen = set()
+    for guid, url, title in iter_feed_items(rss_raw_content):
+        if guid in seen:
+            continue
+        seen.add(guid)
+        known = guid_index.get(guid)
+        if known is None:
+            added.append({'url': url, 'title': title, 'token': episode_token(guid), 'guid': guid})
+        elif known[1] != url or known[2] != title:
+            updated[known[0]] = {'url': url, 'title': title, 'token': episode_token(guid), 'guid': guid}
+    added.reverse()
+
+    removed = []
+    if len(seen) - len(added) < len(guid_index):
+        removed = sorted(index for guid, (index, _, _) in guid_index.items() if guid not in seen)
+    return {'added': added, 'updated': updated, 'removed': removed}
+
+def has_feed_changes(changes):
+    return bool(changes['added'] or changes['updated'] or changes['removed'])
+
+# Applies the changes found by diff_feed to `episodes` and returns a new list:
+# updated episodes are replaced where they are, removed ones are dropped, which
+# moves the ones after them up, and added ones are appended.
+def apply_feed_changes(episodes, changes):
+    episodes = list(episodes)
+    for index, episode in changes['updated'].items():
+        episodes[index] = episode
+    if changes['removed']:
+        removed = set(changes['removed'])
+        episodes = [episode for index, episode in enumerate(episodes) if index not in removed]
+    episodes.extend(changes['added'])
+    return episodes
+
+# guid -> (catalog index, url, title) of every episode, what diff_feed compares a
+# feed against. Episodes written before guids were stored are keyed by their URL.
+def build_guid_index(episodes):
+    return dict((episode.get('guid', episode['url']), (index, episode['url'], episode['title']))
+                for index, episode in enumerate(episodes))
+
+# The guid index of the episodes after `changes` from the index they were diffed
+# against. It is patched in place unless episodes were removed, which moves the
+# ones after them and has it rebuilt from `episodes`.
+def patch_guid_index(guid_index, changes, episodes):
+    if changes['removed']:
+        return build_guid_index(episodes)
+    for index, episode in changes['updated'].items():
+        guid_index[episode['guid']] = (index, episode['url'], episode['title'])
+    first = len(episodes) - len(changes['added'])
+    for offset, episode in enumerate(changes['added']):
+        guid_index[episode['guid']] = (first + offset, episode['url'], episode['title'])
+    return guid_index
+
+# Stream tokens are derived from the item guid, so a token keeps pointing at the same
+# episode however the feed changes around it.
+def episode_token(guid):
+    return hashlib.sha1(guid.encode('utf-8')).hexdigest()[:16]
+
+def has_stable_tokens(catalog):
+    episodes = catalog['episodes']
+    return not episodes or episodes[0]['token'] == episode_token(episodes[0]['guid'])
+
+def build_token_index(episodes):
+    return dict((episode['token'], index) for index, episode in enumerate(episodes))
+
+# Resolves a stream token to its catalog index. The tokens of AudioPlayer events
+# are nearly always the user's current episode or the one next to it in play
+# order, so with the user's `persistent_attributes` those are tried first, which
+# for a chunked catalog only touches the chunks around the user's position. Any
+# other token goes through the catalog's token index. The numeric tokens handed
+# out before tokens were derived from guids are read as 1-based episode numbers.
+# Returns None for unknown tokens.
+def get_track_index(token, catalog, persistent_attributes=None):
+    track_index = get_window_index(token, catalog, persistent_attributes) if persistent_attributes else None
+    if track_index is not None:
+        return track_index
+    track_index = catalog['token_index'].get(token)
+    if track_index is None and token is not None and token.isdigit() and 0 < int(token) <= len(catalog['episodes']):
+        track_index = int(token) - 1
     return track_index
 
-def shuffle_playlist(index, playlist):
-    current_track_data = playlist[index]
-    playlist.pop(index)
-    random.shuffle(playlist)
-    playlist.insert(0,current_track_data)
-    return playlist
\ No newline at end of file
+def get_window_index(token, catalog, persistent_attributes):
+    session = persistent_attributes.get('playback_session_data')
+    size = len(catalog['episodes'])
+    if session is None or token is None or not size:
+        return None
+    shuffle_order = persistent_attributes.get('shuffle_order')
+    position = int(session['index'])
+    if token == session['token'] and int(session.get('catalog_version', 0)) == catalog['version']:
+        return get_catalog_index(position, shuffle_order)
+    # A stored position from an older catalog version is checked against the
+    # episode's token like its neighbours
+    for candidate in (position, position + 1, position - 1):
+        catalog_index = get_catalog_index(candidate % size, shuffle_order)
+        if catalog_index < size and catalog['episodes'][catalog_index]['token'] == token:
+            return catalog_index
+    return None
+
+# Users listen through the shared catalog either in feed order or, with shuffle on,
+# in a shuffled order. A position is an index into whichever order is active.
+#
+# A shuffled order is persisted as {'seed', 'size', 'start'}: the seed of a
+# shuffle over the first `size` catalog entries, with episode `start` moved to the
+# front. Episodes published after shuffle was turned on follow the
+# shuffled ones in feed order.
+def get_catalog_index(position, shuffle_order):
+    if shuffle_order and position < int(shuffle_order['size']):
+        return shuffled_index(position, int(shuffle_order['seed']), int(shuffle_order['size']), int(shuffle_order['start']))
+    return position
+
+def get_play_position(catalog_index, shuffle_order):
+    if shuffle_order and catalog_index < int(shuffle_order['size']):
+        return shuffled_position(catalog_index, int(shuffle_order['seed']), int(shuffle_order['size']), int(shuffle_order['start']))
+    return catalog_index
+
+# A new shuffled order of `size` episodes starting at catalog index `index`, from
+# a random seed unless `seed` is given
+def shuffle_playlist(index, size, seed=None):
+    return {'seed': random.getrandbits(32) if seed is None else seed, 'size': size, 'start': index}
+
+# The seed an order shuffled with `seed` is shuffled again with for catalog
+# `version`. Requests that do not save the user's state shuffle it again on every
+# request, and derive the same order each time.
+def reshuffle_seed(seed, version):
+    return random.Random('{}:{}'.format(seed, version)).getrandbits(32)
+
+# The shuffled order is a bijection on [0, size) computed one position at a time,
+# so neither the permutation nor its inverse is ever built: a Feistel network keyed
+# by the seed permutes the smallest power-of-four range holding `size` values, and
+# values outside [0, size) are mapped again until they fall inside (cycle-walking).
+# The range is at most four times `size`, so that takes a few rounds at most on
+# average, whatever the size of the catalog.
+shuffle_rounds = 4
+
+def _shuffle_keys(seed):
+    return [(seed * 0x9E3779B1 + round * 0x85EBCA77 + 1) & 0xFFFFFFFF for round in range(shuffle_rounds)]
+
+def _shuffle_half_bits(size):
+    return max(1, ((size - 1).bit_length() + 1) // 2)
+
+def _shuffle_round(half, key, mask):
+    value = ((half ^ key) * 0x2C1B3C6D) & 0xFFFFFFFF
+    value ^= value >> 15
+    return ((value * 0x297A2D39) & 0xFFFFFFFF) >> 7 & mask
+
+def _feistel(value, seed, size, inverse=False):
+    half_bits = _shuffle_half_bits(size)
+    mask = (1 << half_bits) - 1
+    keys = _shuffle_keys(seed)
+    if inverse:
+        keys.reverse()
+    while True:
+        left, right = value >> half_bits, value & mask
+        for key in keys:
+            if inverse:
+                left, right = right ^ _shuffle_round(left, key, mask), left
+            else:
+                left, right = right, left ^ _shuffle_round(right, key, mask)
+        value = left << half_bits | right
+        if value < size:
+            return value
+
+# The catalog index at `position` of the order shuffled with `seed`, with episode
+# `start` swapped to the front
+def shuffled_index(position, seed, size, start):
+    if position == 0:
+        return start
+    if position == _feistel(start, seed, size, inverse=True):
+        return _feistel(0, seed, size)
+    return _feistel(position, seed, size)
+
+# The position of catalog index `catalog_index` in that order
+def shuffled_position(catalog_index, seed, size, start):
+    if catalog_index == start:
+        return 0
+    if catalog_index == _feistel(0, seed, size):
+        return _feistel(start, seed, size, inverse=True)
+    return _feistel(catalog_index, seed, size, inverse=True)
+
+# Re-resolves the user's position from the episode token when the catalog has been
+# republished since the position was saved. When the episode has been taken out
+# of the feed, the user goes on with the episode that took its place, found with
+# the removals the catalog records against the version before it. A shuffled
+# order over more episodes than the catalog has left is shuffled again from the
+# user's episode, with a seed derived from the old one (reshuffle_seed).
+def sync_playback_session(persistent_attributes, catalog):
+    session = persistent_attributes['playback_session_data']
+    size = len(catalog['episodes'])
+    shuffle_order = persistent_attributes.get('shuffle_order')
+    if shuffle_order and int(shuffle_order['size']) > size and size:
+        catalog_index = get_track_index(session['token'], catalog)
+        if catalog_index is None:
+            catalog_index = min(int(session['index']), size - 1)
+            session['offset'] = 0
+        # Updated in place, as handlers hold on to the order they read
+        shuffle_order.update(shuffle_playlist(catalog_index, size,
+                                              reshuffle_seed(int(shuffle_order['seed']), catalog['version'])))
+        session.update({'index': 0, 'token': catalog['episodes'][catalog_index]['token'],
+                        'catalog_version': catalog['version']})
+        return session
+
+    session_version = int(session.get('catalog_version', 0))
+    if session_version != catalog['version']:
+        catalog_index = get_track_index(session['token'], catalog, persistent_attributes)
+        if catalog_index is None and size:
+            position = int(session['index'])
+            changes = catalog.get('changes')
+            if not shuffle_order and changes and int(changes['base_version']) == session_version:
+                position -= bisect.bisect_left([int(index) for index in changes['removed']], position)
+            catalog_index = get_catalog_index(min(position, size - 1), shuffle_order)
+            session['offset'] = 0
+        if catalog_index is not None:
+            session['index'] = get_play_position(catalog_index, shuffle_order)
+            session['token'] = catalog['episodes'][catalog_index]['token']
+        session['catalog_version'] = catalog['version']
+    return session
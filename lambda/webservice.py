@@ -0,0 +1,192 @@
+"""
+ Serves the skill from one long-lived process instead of from Lambda, for
+ deployments on a server or container behind a proxy or load balancer that
+ terminates HTTPS; point the skill's endpoint at it. Requests are handled by a
+ fixed pool of worker threads sharing everything a warm Lambda container keeps
+ between invocations: the skill and its handlers, the prompts, the catalog, probe
+ and presigned URL caches, and the S3 and feed connection pools. Each worker keeps
+ its own DynamoDB connection.
+
+ Alexa signs its requests and the endpoint has to check the signatures; that is
+ done with the ask-sdk-webservice-support package, which is not needed on Lambda
+ and so not in requirements.txt. Install it, or set WEBSERVICE_VERIFY_REQUESTS=false
+ when the proxy in front of this process verifies requests itself.
+
+ There is no scheduled refresher here, so the process refreshes the catalogs of
+ its feeds itself every WEBSERVICE_REFRESH_INTERVAL seconds (refresher.py). Set
+ it to 0 when the refresher Lambda is still deployed.
+
+     python webservice.py --port 8080 --workers 16
+ """
+
+from ask_sdk_core.exceptions import AskSdkException
+from ask_sdk_model import RequestEnvelope
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import argparse
+import fanout
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+webservice_host = os.environ.get('WEBSERVICE_HOST', '0.0.0.0')
+webservice_port = int(os.environ.get('WEBSERVICE_PORT', 8080))
+
+# Number of requests served at once. Requests mostly wait on DynamoDB, so this can
+# be well above the number of cores.
+webservice_workers = int(os.environ.get('WEBSERVICE_WORKERS', 16))
+
+webservice_verify_requests = os.environ.get('WEBSERVICE_VERIFY_REQUESTS', 'true').lower() != 'false'
+webservice_refresh_interval = float(os.environ.get('WEBSERVICE_REFRESH_INTERVAL', 300))
+
+# Alexa requests are a few kilobytes; anything much larger is not one
+max_request_size = 256 * 1024
+
+# Sizes the I/O pool the workers share for `workers` concurrent requests, as each
+# request may fan out to it (fanout.py). Only raises the size, and only has an
+# effect before the pool is created by the first request.
+def configure_pools(workers):
+    fanout.io_pool_size = max(fanout.io_pool_size, workers * 2)
+
+# A function from a request's headers and body to the skill's serialized response.
+# With `verify_requests` the request's signature and timestamp are checked first.
+def create_dispatcher(skill, verify_requests=True):
+    if verify_requests:
+        try:
+            from ask_sdk_webservice_support.webservice_handler import WebserviceSkillHandler
+        except ImportError:
+            raise RuntimeError("Verifying requests needs the ask-sdk-webservice-support package. Install it, or set "
+                               "WEBSERVICE_VERIFY_REQUESTS=false if requests are verified in front of this process")
+        handler = WebserviceSkillHandler(skill, verify_signature=True, verify_timestamp=True)
+        return handler.verify_request_and_dispatch
+
+    def dispatch(headers, body):
+        request_envelope = skill.serializer.deserialize(payload=body, obj_type=RequestEnvelope)
+        response_envelope = skill.invoke(request_envelope=request_envelope, context=None)
+        return skill.serializer.serialize(response_envelope)
+    return dispatch
+
+# HTTPServer that hands each connection to one of a fixed number of worker
+# threads. ThreadingHTTPServer would start a thread per connection, so a burst of
+# requests would run all at once and each wait longer on the shared pools;
+# here the connections beyond `workers` wait in line instead.
+class PooledHTTPServer(HTTPServer):
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler_class, workers):
+        from concurrent.futures import ThreadPoolExecutor
+        HTTPServer.__init__(self, server_address, handler_class)
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='request')
+
+    def process_request(self, request, client_address):
+        self._pool.submit(self._process_request, request, client_address)
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self._pool.shutdown(wait=True)
+
+def create_handler_class(dispatch):
+
+    class SkillRequestHandler(BaseHTTPRequestHandler):
+        # One request per connection, so that an idle keep-alive connection never
+        # holds on to a worker; the proxy in front keeps the connections to Alexa
+        protocol_version = 'HTTP/1.0'
+        # Seconds a client may take to send its request
+        timeout = 10
+
+        # Health check for the load balancer
+        def do_GET(self):
+            self._respond(200, {'status': 'ok'})
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            if length > max_request_size:
+                self._respond(413, {'error': 'Request too large'})
+                return
+            body = self.rfile.read(length).decode('utf-8')
+            try:
+                response = dispatch(dict(self.headers.items()), body)
+            except AskSdkException as e:
+                # Requests that do not deserialize or fail verification
+                logger.warning("Rejected request: {}".format(e))
+                self._respond(400, {'error': str(e)})
+                return
+            except Exception as e:
+                logger.error("Request failed: {}".format(e), exc_info=True)
+                self._respond(500, {'error': 'Internal error'})
+                return
+            self._respond(200, response)
+
+        def _respond(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json;charset=UTF-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return SkillRequestHandler
+
+# Refreshes the catalogs of all feeds every `interval` seconds on a daemon thread
+def start_refresh_thread(interval):
+    from refresher import refresh_handler
+
+    def refresh_loop():
+        while True:
+            try:
+                refresh_handler({}, None)
+            except Exception as e:
+                logger.error("Refreshing the catalogs failed: {}".format(e), exc_info=True)
+            stop.wait(interval)
+
+    stop = threading.Event()
+    thread = threading.Thread(target=refresh_loop, name='refresher', daemon=True)
+    thread.start()
+    return stop
+
+# Builds the skill and a server for it listening on (`host`, `port`), without
+# starting it. The skill is the one lambda_function builds for Lambda.
+def create_server(host=webservice_host, port=webservice_port, workers=webservice_workers,
+                  verify_requests=webservice_verify_requests):
+    configure_pools(workers)
+    import lambda_function
+    skill = lambda_function.sb.create()
+    return PooledHTTPServer((host, port), create_handler_class(create_dispatcher(skill, verify_requests)), workers)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default=webservice_host)
+    parser.add_argument('--port', type=int, default=webservice_port)
+    parser.add_argument('--workers', type=int, default=webservice_workers)
+    parser.add_argument('--refresh-interval', type=float, default=webservice_refresh_interval)
+    args = parser.parse_args()
+
+    # The prompts are read relative to the working directory, as on Lambda
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    server = create_server(args.host, args.port, args.workers)
+    if args.refresh_interval > 0:
+        start_refresh_thread(args.refresh_interval)
+    logger.info("Serving the skill on {}:{} with {} workers".format(args.host, args.port, args.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()